@@ -0,0 +1,98 @@
+"""
+Read replica routing.
+
+Everything reads from and writes to the primary ("default") unless the code
+runs inside use_replica(), which the API views opt into with ReplicaReadMixin
+for their safe requests. Webhooks, orchestration, celery tasks and anything
+else never enter it, so they always see the primary.
+
+After a write through one of those views the user is pinned to the primary
+for DATABASE_PRIMARY_PIN_SECONDS, so their next reads don't hit a replica
+that hasn't caught up yet (read-your-writes).
+"""
+
+import random
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.permissions import SAFE_METHODS
+
+PRIMARY = "default"
+
+_replica_reads = ContextVar("replica_reads", default=False)
+
+
+@contextmanager
+def use_replica():
+    """Send the reads made inside to a replica, when one is configured"""
+    token = _replica_reads.set(True)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+def _pin_key(user_id):
+    return f"db:primary-pin:{user_id}"
+
+
+def pin_to_primary(user):
+    """Keep the user's reads on the primary while replicas catch up"""
+    seconds = getattr(settings, "DATABASE_PRIMARY_PIN_SECONDS", 10)
+    if user.is_authenticated and seconds:
+        cache.set(_pin_key(user.pk), 1, timeout=seconds)
+
+
+def is_pinned_to_primary(user):
+    return user.is_authenticated and cache.get(_pin_key(user.pk)) is not None
+
+
+class ReplicaRouter:
+    """
+    Route reads made under use_replica() to a random replica of
+    DATABASE_REPLICAS, and every write to the primary
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, "DATABASE_REPLICAS", [])
+        if replicas and _replica_reads.get():
+            return random.choice(replicas)
+        return None
+
+    def db_for_write(self, model, **hints):
+        # even for instances read from a replica
+        return PRIMARY
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # replicas hold the same rows as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        # replicas get the schema through replication
+        return db == PRIMARY
+
+
+class ReplicaReadMixin:
+    """
+    Serve the view's safe requests from a replica, unless the user wrote
+    recently. Successful writes pin the user to the primary
+    """
+
+    def initial(self, request, *args, **kwargs):
+        # authentication and permissions read the primary
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and not is_pinned_to_primary(request.user):
+            self._replica_token = _replica_reads.set(True)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        token = getattr(self, "_replica_token", None)
+        if token is not None:
+            _replica_reads.reset(token)
+            self._replica_token = None
+        if request.method not in SAFE_METHODS and status.is_success(
+            response.status_code
+        ):
+            pin_to_primary(request.user)
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -65,6 +65,10 @@ MIDDLEWARE = [
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
+# answer the X-DB-Query-Count header read by the load test (zoolflow.sandbox.loadtest)
+QUERY_COUNT_HEADER = env.bool("QUERY_COUNT_HEADER", default=False)
+if QUERY_COUNT_HEADER:
+    MIDDLEWARE.insert(0, "zoolflow.sandbox.middleware.QueryCountMiddleware")
 
 ROOT_URLCONF = "config.urls"
 
@@ -90,6 +94,18 @@ WSGI_APPLICATION = "config.wsgi.application"
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
 DATABASES = {"default": env.db("DATABASE_URL")}
+# read replicas for the API's safe requests, see config.db_router
+DATABASE_REPLICAS = []
+for index, url in enumerate(env.list("DATABASE_REPLICA_URLS", default=[])):
+    DATABASE_REPLICAS.append(f"replica_{index}")
+    DATABASES[f"replica_{index}"] = {
+        **env.db_url_config(url),
+        # tests run against the primary only
+        "TEST": {"MIRROR": "default"},
+    }
+DATABASE_ROUTERS = ["config.db_router.ReplicaRouter"]
+# seconds a user's reads stay on the primary after they wrote
+DATABASE_PRIMARY_PIN_SECONDS = 10
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -220,6 +236,12 @@ REST_FRAMEWORK = {
     "DEFAULT_FILTER_BACKENDS": ["django_filters.rest_framework.DjangoFilterBackend"],
 }
 
+# load tests sign up many users from one address, no rate means no throttling
+if env.bool("DISABLE_API_THROTTLING", default=False):
+    REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"] = dict.fromkeys(
+        REST_FRAMEWORK["DEFAULT_THROTTLE_RATES"]
+    )
+
 THROTTLES_SCOPE = {
     "validate_verification_code": "verify_code",
     "resend_verification_code": "resend_code",
@@ -240,7 +262,7 @@ SIMPLE_JWT = {
 }
 
 # MailGun Configuration
-MAILGUN_BASE_URL = "https://api.mailgun.net"
+MAILGUN_BASE_URL = env("MAILGUN_BASE_URL", default="https://api.mailgun.net")
 MAILGUN_API_KEY = env("MAILGUN_API_KEY")
 EMAIL_DOMAIN = env("EMAIL_DOMAIN")
 MAILGUN_WEBHOOK_SIGINING_KEY = env("MAILGUN_WEBHOOK_SIGINING_KEY")
@@ -256,6 +278,25 @@ ADDRESSES_COUNT = 3
 STATE_LENGTH = 3
 
 # Provider config
+# Shared keep-alive HTTP pool, one session per upstream host
+HTTP_CLIENT_POOL_CONNECTIONS = env.int("HTTP_CLIENT_POOL_CONNECTIONS", default=10)
+HTTP_CLIENT_POOL_MAXSIZE = env.int("HTTP_CLIENT_POOL_MAXSIZE", default=20)
+# close pooled connections unused for longer than this (seconds)
+HTTP_CLIENT_IDLE_TIMEOUT = 60
+# httpx pool of the async views, one per event loop (ASGI worker)
+HTTP_ASYNC_CLIENT_MAX_CONNECTIONS = env.int(
+    "HTTP_ASYNC_CLIENT_MAX_CONNECTIONS", default=200
+)
+HTTP_ASYNC_CLIENT_MAX_KEEPALIVE = env.int("HTTP_ASYNC_CLIENT_MAX_KEEPALIVE", default=50)
+# urllib3 Retry kwargs keyed by host, "default" applies to every host
+HTTP_CLIENT_RETRY_POLICIES = {
+    "default": {
+        "total": 3,
+        "backoff_factor": 1,
+        "status_forcelist": [500, 502, 503, 504, 429],
+        "allowed_methods": ["POST"],
+    },
+}
 # PayMob Configuration
 PAYMOB_AUTH_CACH_KEY = "paymob:token:key"
 PAYMOB_API_KEY = env("PAYMOB_API_KEY")
@@ -263,9 +304,83 @@ AUTH_PAYMOB_TOKEN = env("AUTH_PAYMOB_TOKEN")
 ORDER_PAYMOB_URL = env("ORDER_PAYMOB_URL")
 PAYMOB_PAYMENT_URL_KEY = env("PAYMOB_PAYMENT_URL_KEY")
 PAYMOB_PAYMENT_KEY = env("PAYMOB_PAYMENT_KEY")
+PAYMOB_INQUIRY_URL = env(
+    "PAYMOB_INQUIRY_URL",
+    default="https://accept.paymob.com/api/ecommerce/orders/transaction_inquiry",
+)
+PAYMOB_TRANSACTIONS_URL = env(
+    "PAYMOB_TRANSACTIONS_URL",
+    default="https://accept.paymob.com/api/acceptance/transactions/",
+)
 HMAC_SECRET_KEY = env("HMAC_SECRET_KEY")
+# derive webhook states from the HMAC verified body instead of asking PayMob
+PAYMOB_TRUST_WEBHOOK_PAYLOAD = env.bool("PAYMOB_TRUST_WEBHOOK_PAYLOAD", default=True)
+# share of trusted webhook states double checked against PayMob later
+PAYMOB_WEBHOOK_RECONCILE_SAMPLE_RATE = 0.05
+# store verified webhooks and apply them from the "webhooks" celery queue
+PAYMOB_WEBHOOK_INBOX = env.bool("PAYMOB_WEBHOOK_INBOX", default=True)
+PAYMOB_WEBHOOK_INBOX_MAX_ATTEMPTS = 5
+PAYMOB_WEBHOOK_INBOX_STALE_AFTER = 60
+# a drainer extends its per merchant order lock before each webhook
+PAYMOB_WEBHOOK_INBOX_LOCK_SECONDS = 60
+PAYMOB_WEBHOOK_INBOX_BUSY_RETRIES = 8
 CACHE_LIFETIME = 60 * 30
+# serve the cached token but refresh it once it's this close to expiry
+PAYMOB_AUTH_REFRESH_MARGIN = 60 * 5
 CONNECTION_TIMEOUT = (5, 15)
+# per PayMob endpoint breaker, shared by every process through redis
+PAYMOB_CIRCUIT_BREAKER = {
+    # seconds of each counting window
+    "window": 30,
+    # calls a window needs before its rates are judged
+    "min_calls": 10,
+    "error_rate": 0.5,
+    "slow_call_seconds": 5,
+    "slow_call_rate": 0.5,
+    # seconds an open circuit refuses calls before a probe goes through
+    "open_seconds": 30,
+}
+# queue creates for later orchestration while the circuit is open, else fail them
+PAYMOB_CIRCUIT_OPEN_DEFER = env.bool("PAYMOB_CIRCUIT_OPEN_DEFER", default=True)
+# outbound token buckets shared through redis, calls per second and burst size.
+# "provider:endpoint" budgets override the provider one
+PROVIDER_RATE_LIMITS = {
+    "paymob": {"rate": 20, "burst": 40},
+    "paymob:auth": {"rate": 1, "burst": 5},
+    "mailgun": {"rate": 10, "burst": 20},
+}
+# seconds a caller blocks for a token before getting a retry-after instead
+PROVIDER_RATE_LIMIT_MAX_WAIT = 2
+# scraper credential of /metrics/ ("Authorization: Metrics <token>"), staff can always read it
+METRICS_AUTH_TOKEN = env("METRICS_AUTH_TOKEN", default="")
+# create only the PayMob order with the transaction, the payment key is
+# requested when the checkout opens and reused until it expires
+PAYMOB_LAZY_PAYMENT_KEY = env.bool("PAYMOB_LAZY_PAYMENT_KEY", default=False)
+# seconds a payment key is reused, under PayMob's default 3600 expiration
+PAYMOB_PAYMENT_KEY_LIFETIME = 60 * 50
+# run provider orchestration on a celery worker and answer creates with 202
+TRANSACTION_ORCHESTRATION_ASYNC = env.bool(
+    "TRANSACTION_ORCHESTRATION_ASYNC", default=False
+)
+TRANSACTION_ORCHESTRATION_QUEUE = "orchestration"
+# callable generating new merchant_order_id values ("ORD-" + 36 chars), time-ordered
+# ids keep inserts and webhook lookups on the recent pages of the unique index.
+# "zoolflow.transactions.services.ids.uuid4_merchant_order_id" for random ones
+MERCHANT_ORDER_ID_GENERATOR = env(
+    "MERCHANT_ORDER_ID_GENERATOR",
+    default="zoolflow.transactions.services.ids.uuid7_merchant_order_id",
+)
+# Idempotency-Key replays are answered from the cache
+IDEMPOTENCY_RESPONSE_TTL = 60 * 60 * 24
+# seconds a create holds its in-flight marker, None derives the longest a create
+# can take from CONNECTION_TIMEOUT, the retry policies and the rate limit wait
+IDEMPOTENCY_IN_FLIGHT_TTL = None
+IDEMPOTENCY_WAIT_TIMEOUT = 5
+# rows fetched per server-side cursor round trip by the staff export
+TRANSACTION_EXPORT_CHUNK_SIZE = 2000
+# batch creation size limit and provider calls running at once per batch
+TRANSACTION_BATCH_MAX_SIZE = env.int("TRANSACTION_BATCH_MAX_SIZE", default=100)
+TRANSACTION_BATCH_MAX_WORKERS = env.int("TRANSACTION_BATCH_MAX_WORKERS", default=8)
 SUPPORTED_COUNTRIES = {
     "Egypt": "EGP",
     "Jordan": "JOD",
@@ -273,6 +388,22 @@ SUPPORTED_COUNTRIES = {
     "Pakistan": "PKR",
     "United Arab Emirates": "AED",
 }
+# stuck transactions reconciliation
+RECONCILIATION_BATCH_SIZE = 500
+RECONCILIATION_MAX_WORKERS = 8
+RECONCILIATION_MIN_AGE = 60 * 15
+# PENDING orders still without a PayMob transaction after this fail
+RECONCILIATION_ABANDON_AFTER = 60 * 60 * 24
+# transactions created before this are no longer queried
+RECONCILIATION_MAX_AGE = 60 * 60 * 24 * 7
+RECONCILIATION_CHECKPOINT_KEY = "transactions:reconciliation:checkpoint"
+RECONCILIATION_MAX_BATCHES = 20
+# terminal transactions older than this move to the archive table
+TRANSACTION_ARCHIVE_RETENTION_DAYS = env.int(
+    "TRANSACTION_ARCHIVE_RETENTION_DAYS", default=90
+)
+TRANSACTION_ARCHIVE_BATCH_SIZE = 1000
+TRANSACTION_ARCHIVE_MAX_BATCHES = 100
 # cache config
 CACHES = {
     "default": {
@@ -289,3 +420,31 @@ CELERY_TIMEZONE = env("CELERY_TIMEZONE")
 CELERY_TASK_SERIALIZER = "json"
 CELERY_RESULT_SERIALIZER = "json"
 CELERY_ACCEPT_CONTENT = ["json"]
+CELERY_BEAT_SCHEDULE = {
+    "reconcile-transactions": {
+        "task": "zoolflow.transactions.tasks.reconcile_transactions_task",
+        "schedule": 60 * 10,
+        "kwargs": {"max_batches": RECONCILIATION_MAX_BATCHES},
+    },
+    "sweep-webhook-inbox": {
+        "task": "zoolflow.transactions.tasks.sweep_webhook_inbox_task",
+        "schedule": PAYMOB_WEBHOOK_INBOX_STALE_AFTER,
+    },
+    "archive-transactions": {
+        "task": "zoolflow.transactions.tasks.archive_transactions_task",
+        "schedule": 60 * 60,
+        "kwargs": {"max_batches": TRANSACTION_ARCHIVE_MAX_BATCHES},
+    },
+    "refresh-paymob-auth-token": {
+        "task": "zoolflow.transactions.tasks.refresh_paymob_auth_token_task",
+        "schedule": CACHE_LIFETIME - PAYMOB_AUTH_REFRESH_MARGIN,
+    },
+}
+CELERY_TASK_ROUTES = {
+    "zoolflow.transactions.tasks.reconcile_transactions_task": {"queue": "expired"},
+    "zoolflow.transactions.tasks.archive_transactions_task": {"queue": "expired"},
+    "zoolflow.transactions.tasks.process_webhook_inbox_task": {"queue": "webhooks"},
+    "zoolflow.transactions.tasks.orchestrate_transaction_task": {
+        "queue": TRANSACTION_ORCHESTRATION_QUEUE
+    },
+}
@@ -5,8 +5,13 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "test_db.sqlite3",
+        # a file, not the shared in-memory database: connections of worker
+        # threads wait for each other's writes instead of failing with
+        # "database table is locked"
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
     }
 }
+DATABASE_REPLICAS = []
 
 PASSWORD_HASHERS = [
     "django.contrib.auth.hashers.MD5PasswordHasher",
@@ -35,3 +40,6 @@ STORAGES = {
         "BACKEND": "django.contrib.staticfiles.storage.StaticFilesStorage",
     },
 }
+
+# worker threads can't see rows of the test transaction, orchestrate inline
+TRANSACTION_BATCH_MAX_WORKERS = 1
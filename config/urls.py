@@ -19,9 +19,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.conf.urls.static import static
 from config import settings
+from zoolflow.transactions.views import MetricsView
 
 urlpatterns = [
     path("admin/", admin.site.urls),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
     path("api/v1/users/", include("zoolflow.users.urls", namespace="users")),
     path("api/v1/customers/", include("zoolflow.customers.urls", namespace="customers")),
     path(
@@ -36,7 +36,7 @@ def currency_and_address(customer):
     address = Address.objects.filter(
         customer_id=customer.id,
         main_address=True,
-    )
+    ).first()
     if not address:
         logger.error(
             f"There is no main address specified for {customer.user.username}."
@@ -44,8 +44,18 @@ def currency_and_address(customer):
         raise SupportedCountryError(
             message="There is no main address specified", details="Address"
         )
-    address = address.first()
-    # Get currency for that country based on our supported countries
+    currency = currency_for_address(address)
+    logger.info(
+        f"Customer {customer.user.username} local currency has been successfully determined",
+    )
+
+    return currency, address
+
+
+def currency_for_address(address):
+    """
+    Return the currency of the address country based on our supported countries
+    """
     currency = getattr(settings, "SUPPORTED_COUNTRIES", {}).get(address.country.name)
     if not currency:
         logger.error("Currency for that country is unsupported.")
@@ -53,8 +63,4 @@ def currency_and_address(customer):
             f"Country {address.country.name} not supported",
             details="Currency",
         )
-    logger.info(
-        f"Customer {customer.user.username} local currency has been successfully determined",
-    )
-
-    return currency, address
+    return currency
@@ -7,6 +7,7 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
+from config.db_router import ReplicaReadMixin
 from .models import Customer, Address, KnowYourCustomer
 from .permissions import IsOwnerOrStaff, IsStaff, IsCustomer
 from . import serializers as s
@@ -57,7 +58,9 @@ class CustomerValidQuerySetMixin(CustomerPermissionMixin):
         return self.queryset_model.objects.filter(customer=customer)
 
 
-class CustomerAddressViewSet(CustomerValidQuerySetMixin, ModelViewSet):
+class CustomerAddressViewSet(
+    ReplicaReadMixin, CustomerValidQuerySetMixin, ModelViewSet
+):
     serializer_class = s.CustomerAddressSerializer
     queryset_model = Address
 
@@ -81,12 +84,14 @@ class CustomerAddressViewSet(CustomerValidQuerySetMixin, ModelViewSet):
         serializer.save(customer=customer)
 
 
-class KnowYourCustomerListAPIView(CustomerValidQuerySetMixin, g.ListAPIView):
+class KnowYourCustomerListAPIView(
+    ReplicaReadMixin, CustomerValidQuerySetMixin, g.ListAPIView
+):
     serializer_class = s.KnowYourCustomerSerializer
     queryset_model = KnowYourCustomer
 
 
-class KnowYourCustomerStaffDetailAPIView(g.RetrieveUpdateAPIView):
+class KnowYourCustomerStaffDetailAPIView(ReplicaReadMixin, g.RetrieveUpdateAPIView):
     permission_classes = [IsStaff]
     serializer_class = s.KnowYourCustomerSerializer
 
@@ -4,6 +4,8 @@ import requests
 from django.conf import settings
 from requests.exceptions import HTTPError
 from zoolflow.transactions.services.http_client import get_session_with_retries
+from zoolflow.transactions.services.metrics import track_provider_call
+from zoolflow.transactions.services.rate_limiter import get_limiter
 
 logger = logging.getLogger(__name__)
 
@@ -21,7 +23,7 @@ class MailGunProvider:
         self.api_key = getattr(settings, "MAILGUN_API_KEY")
         self.base_url = getattr(settings, "MAILGUN_BASE_URL")
         self.mailgun_domain = getattr(settings, "EMAIL_DOMAIN")
-        self.session = get_session_with_retries()
+        self.session = get_session_with_retries(self.base_url)
 
     def send_email(self, recipient, email_subject, email_body):
         """
@@ -35,12 +37,15 @@ class MailGunProvider:
             "subject": email_subject,
             "text": email_body,
         }
+        # wait for the shared Mailgun budget, RateLimitExceeded lets the task retry
+        get_limiter("mailgun:messages").acquire()
         # call MailGun API to send email
         try:
-            response = self.session.post(
-                url=endpoint, auth=auth, data=data, timeout=(5, 5)
-            )
-            response.raise_for_status()
+            with track_provider_call("mailgun", "mailgun:messages") as call:
+                response = call.response = self.session.post(
+                    url=endpoint, auth=auth, data=data, timeout=(5, 5)
+                )
+                response.raise_for_status()
             if response.status_code and response.status_code != 200:
                 logger.error(
                     f"""
@@ -6,6 +6,8 @@ from .providers import MailGunProvider
 from ..models import EmailEvent
 from ..services.trackers import UpdateEmailEventTracker
 from zoolflow.transactions.models import Transaction
+from zoolflow.transactions.services.helpers import transaction_email_details
+from zoolflow.transactions.services.rate_limiter import RateLimitExceeded
 
 logger = logging.getLogger(__name__)
 
@@ -37,20 +39,22 @@ def mail_verify_code(user_email):
     )
 
 
-def mail_transaction_state(transaction_id):
+def mail_transaction_state(transaction_id, details=None):
     """
     Create and configure EmailMessage instance then send the object
+
+    details: email, username, state and state_display of the transaction,
+    loaded from the database when missing
     """
-    # Define email arguments (recipient, subject, body)
-    try:
-        txn = Transaction.objects.get(transaction_id=transaction_id)
-    except Transaction.DoesNotExist:
-        logger.error(f"Transaction {transaction_id} does not exist.")
-        return
+    if details is None:
+        details = _transaction_email_details(transaction_id)
+        if details is None:
+            return
 
-    state = txn.get_state_display()
-    user_email = txn.customer.user.email
-    username = txn.customer.user.username or "Customer"
+    # Define email arguments (recipient, subject, body)
+    state = details["state_display"]
+    user_email = details["email"]
+    username = details["username"] or "Customer"
     subject = f"Transaction {transaction_id} Status Update"
     send_to = user_email
     email_body = f"""
@@ -63,10 +67,21 @@ def mail_transaction_state(transaction_id):
         subject,
         send_to,
         EmailEvent.EmailEventPurpose.TRANSACTION_UPDATE,
-        f"{transaction_id}:{txn.state}",
+        f"{transaction_id}:{details['state']}",
     )
 
 
+def _transaction_email_details(transaction_id):
+    try:
+        txn = Transaction.objects.select_related("customer__user").get(
+            transaction_id=transaction_id
+        )
+    except Transaction.DoesNotExist:
+        logger.error(f"Transaction {transaction_id} does not exist.")
+        return None
+    return transaction_email_details(txn)
+
+
 def _send_idempotent_email(email_body, subject, send_to, purpose, key=None):
     """
     First check if there exsiting email-event with the same key.
@@ -89,9 +104,14 @@ def _send_idempotent_email(email_body, subject, send_to, purpose, key=None):
         def _forward_email():
             # Use MailGunProvider to send the email
             mail_provider = MailGunProvider()
-            reponse_message = mail_provider.send_email(
-                recipient=send_to, email_subject=subject, email_body=email_body
-            )
+            try:
+                reponse_message = mail_provider.send_email(
+                    recipient=send_to, email_subject=subject, email_body=email_body
+                )
+            except RateLimitExceeded:
+                # nothing was sent, free the key for the task retry
+                event.delete()
+                raise
             # update email event status based on provider response
             if "Queued." in reponse_message["message"]:
                 response_message = reponse_message["id"]
@@ -1,23 +1,58 @@
 import logging
 from celery import shared_task
+from zoolflow.transactions.services.rate_limiter import RateLimitExceeded
 from .mailers.senders import mail_transaction_state, mail_verify_code
 
 logger = logging.getLogger(__name__)
 
 
-@shared_task
-def verification_code_mail_task(user_email):
+@shared_task(bind=True, max_retries=10)
+def verification_code_mail_task(self, user_email):
     """Backgroud task for mailing verify code to user email"""
 
     logger.info("start mailing verification code...")
-    mail_verify_code(user_email)
+    try:
+        mail_verify_code(user_email)
+    except RateLimitExceeded as e:
+        raise self.retry(exc=e, countdown=e.retry_after)
 
 
-@shared_task
-def transaction_state_email_task(transaction_id):
+@shared_task(bind=True, max_retries=10)
+def transaction_state_email_task(self, transaction_id, details=None):
     """
-    Background task for mailing transaction state to user email
+    Background task for mailing transaction state to user email.
+
+    details carries recipient and state so the task needn't load the transaction
     """
     logger.info(f"Start mailing transaction {transaction_id} state...")
     # Assuming mail_transaction_state is a function that sends the email
-    mail_transaction_state(transaction_id)
+    try:
+        mail_transaction_state(transaction_id, details)
+    except RateLimitExceeded as e:
+        raise self.retry(exc=e, countdown=e.retry_after)
+
+
+@shared_task
+def transaction_state_batch_email_task(items):
+    """
+    Background task for mailing many transaction states at once.
+
+    items: (transaction_id, details) pairs
+    """
+    logger.info(f"Start mailing {len(items)} transaction states...")
+    deferred, retry_after = [], 0
+    for transaction_id, details in items:
+        try:
+            mail_transaction_state(transaction_id, details)
+        except RateLimitExceeded as e:
+            deferred.append((transaction_id, details))
+            retry_after = max(retry_after, e.retry_after)
+        except Exception as e:
+            # one failing recipient must not drop the rest of the batch
+            logger.error(f"Mailing transaction {transaction_id} state failed: {e}")
+    if deferred:
+        # the rest of the batch waits for the Mailgun budget to refill
+        logger.warning(f"{len(deferred)} transaction state mail(s) deferred.")
+        transaction_state_batch_email_task.apply_async(
+            (deferred,), countdown=retry_after
+        )
@@ -0,0 +1,3 @@
+"""
+Local stand-ins of the PayMob and Mailgun APIs for load and latency testing
+"""
@@ -0,0 +1,92 @@
+"""
+Run the PayMob and Mailgun stand-ins.
+
+    python -m zoolflow.sandbox --webhook-url http://localhost:8000/api/v1/transactions/webhook/
+
+Point the provider settings at them (see README), their faults can be
+changed while running through POST /sandbox/faults.
+"""
+
+import argparse
+import logging
+import os
+import signal
+import threading
+from .mailgun import mailgun_server
+from .paymob import paymob_server
+from .server import FaultProfile
+
+
+def _faults(args, prefix):
+    return FaultProfile(
+        latency_ms=getattr(args, f"{prefix}_latency_ms"),
+        jitter_ms=getattr(args, f"{prefix}_jitter_ms"),
+        error_rate=getattr(args, f"{prefix}_error_rate"),
+        throttle_rate=getattr(args, f"{prefix}_throttle_rate"),
+    )
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--host", default=os.environ.get("SANDBOX_HOST", "127.0.0.1"))
+    parser.add_argument("--paymob-port", type=int, default=8081)
+    parser.add_argument("--mailgun-port", type=int, default=8082)
+    parser.add_argument(
+        "--hmac-secret", default=os.environ.get("HMAC_SECRET_KEY", "sandbox-hmac")
+    )
+    parser.add_argument(
+        "--signing-key",
+        default=os.environ.get("MAILGUN_WEBHOOK_SIGINING_KEY", "sandbox-signing-key"),
+    )
+    parser.add_argument(
+        "--webhook-url",
+        default=os.environ.get("SANDBOX_PAYMOB_WEBHOOK_URL"),
+        help="transaction webhook receiving the signed PayMob callbacks",
+    )
+    parser.add_argument(
+        "--events-url",
+        default=os.environ.get("SANDBOX_MAILGUN_EVENTS_URL"),
+        help="notifications webhook receiving the signed Mailgun events",
+    )
+    parser.add_argument("--event-delay", type=float, default=0.5)
+    for prefix in ("paymob", "mailgun"):
+        parser.add_argument(f"--{prefix}-latency-ms", type=float, default=0)
+        parser.add_argument(f"--{prefix}-jitter-ms", type=float, default=0)
+        parser.add_argument(f"--{prefix}-error-rate", type=float, default=0)
+        parser.add_argument(f"--{prefix}-throttle-rate", type=float, default=0)
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(message)s")
+    servers = [
+        paymob_server(
+            (args.host, args.paymob_port),
+            args.hmac_secret,
+            args.webhook_url,
+            _faults(args, "paymob"),
+        ),
+        mailgun_server(
+            (args.host, args.mailgun_port),
+            args.signing_key,
+            args.events_url,
+            args.event_delay,
+            _faults(args, "mailgun"),
+        ),
+    ]
+    for server in servers:
+        server.start()
+    stop = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop.set())
+    try:
+        stop.wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""
+Load test the payment lifecycle against a running app and the stand-ins.
+
+    python -m zoolflow.sandbox.loadtest --users 200 --concurrency 20 \\
+        --report loadtest-report.json --baseline loadtest-baseline.json
+
+Every virtual user signs up, verifies its email with the code mailed
+through the Mailgun stand-in, creates a transaction, pays it at the PayMob
+stand-in (which sends the signed webhook to the app) and waits for the
+transaction email. KYC approval has no API, it is done through the ORM,
+so the script runs with the app settings (same database).
+
+The app should run with QUERY_COUNT_HEADER=true for the query counts and
+DISABLE_API_THROTTLING=true so the signups aren't throttled.
+"""
+
+import argparse
+import json
+import logging
+import math
+import os
+import re
+import secrets
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime, timezone
+import requests
+from .middleware import QUERY_COUNT_HEADER
+
+logger = logging.getLogger(__name__)
+
+STAGES = ("signup", "verify", "transact", "webhook", "email")
+
+# baseline metrics compared by --baseline
+COMPARED_LATENCIES = ("p95", "p99")
+
+PASSWORD = "Lo@dTest-2024!"
+
+VERIFICATION_CODE = re.compile(r'class="verification-code">\s*(\d+)\s*<')
+
+
+class StageError(Exception):
+    """A stage answered unexpectedly, the virtual user stops there"""
+
+    def __init__(self, message, details=None):
+        super().__init__(message)
+        self.message = message
+        self.details = details
+
+
+@dataclass
+class Sample:
+    stage: str
+    seconds: float
+    ok: bool
+    status: int | None = None
+    queries: int | None = None
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = []
+
+    def add(self, sample):
+        with self._lock:
+            self.samples.append(sample)
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of the values, None when empty"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(1, math.ceil(pct / 100 * len(ordered)))
+    return ordered[rank - 1]
+
+
+def summarize(samples, elapsed, users, concurrency):
+    """Build the JSON report of the samples"""
+    stages = {}
+    for stage in STAGES:
+        runs = [s for s in samples if s.stage == stage]
+        if not runs:
+            continue
+        seconds = [s.seconds for s in runs if s.ok]
+        queries = [s.queries for s in runs if s.queries is not None]
+        stages[stage] = {
+            "count": len(runs),
+            "errors": sum(not s.ok for s in runs),
+            "error_rate": round(sum(not s.ok for s in runs) / len(runs), 4),
+            "p50": percentile(seconds, 50),
+            "p95": percentile(seconds, 95),
+            "p99": percentile(seconds, 99),
+            "max": max(seconds, default=None),
+            "queries_mean": (
+                round(sum(queries) / len(queries), 2) if queries else None
+            ),
+            "queries_max": max(queries, default=None),
+        }
+    completed = sum(1 for s in samples if s.stage == STAGES[-1] and s.ok)
+    requests_sent = sum(1 for s in samples if s.stage != "email")
+    return {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "users": users,
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 3),
+        "requests_per_second": round(requests_sent / elapsed, 2) if elapsed else None,
+        "completed_lifecycles": completed,
+        "stages": stages,
+    }
+
+
+def compare(report, baseline, tolerance=0.2):
+    """
+    Return the regressions of the report against the baseline report:
+    p95/p99 slower by more than the tolerance, more queries or more errors
+    """
+    regressions = []
+    for stage, before in baseline.get("stages", {}).items():
+        after = report["stages"].get(stage)
+        if after is None:
+            regressions.append(f"{stage}: missing from the run")
+            continue
+        for name in COMPARED_LATENCIES:
+            if before.get(name) is None or after.get(name) is None:
+                continue
+            limit = before[name] * (1 + tolerance)
+            if after[name] > limit:
+                regressions.append(
+                    f"{stage} {name}: {after[name]:.3f}s > {before[name]:.3f}s"
+                )
+        # query counts are deterministic, any increase is a regression
+        if (
+            before.get("queries_max") is not None
+            and after.get("queries_max") is not None
+            and after["queries_max"] > before["queries_max"]
+        ):
+            regressions.append(
+                f"{stage} queries: {after['queries_max']} > {before['queries_max']}"
+            )
+        if after["error_rate"] > before["error_rate"] + tolerance / 10:
+            regressions.append(
+                f"{stage} errors: {after['error_rate']:.2%} > {before['error_rate']:.2%}"
+            )
+    return regressions
+
+
+def approve_kyc(email):
+    """Approve the customer's KYC as staff would in the admin"""
+    from zoolflow.customers.models import KnowYourCustomer
+
+    kyc = KnowYourCustomer.objects.get(customer__user__email=email)
+    kyc.status_tracking = KnowYourCustomer.Status.APPROVED
+    # the post_save signal marks the customer verified
+    kyc.save(update_fields=["status_tracking"])
+
+
+class VirtualUser:
+    """
+    One customer going through the lifecycle, recording a sample per stage
+    """
+
+    def __init__(self, options, recorder):
+        self.options = options
+        self.recorder = recorder
+        self.session = requests.Session()
+        self.email = f"load-{secrets.token_hex(6)}@example.com"
+
+    def api(self, path):
+        return f"{self.options.base_url}/api/v1/{path}"
+
+    def request(self, stage, method, url, expected, **kwargs):
+        """Send a timed request recorded as the stage sample, return the response"""
+        started = time.perf_counter()
+        try:
+            response = self.session.request(
+                method, url, timeout=self.options.timeout, **kwargs
+            )
+        except requests.RequestException as e:
+            self.record(stage, time.perf_counter() - started, False)
+            raise StageError(f"{stage} failed", details=str(e))
+        queries = response.headers.get(QUERY_COUNT_HEADER)
+        ok = response.status_code in expected
+        self.record(
+            stage,
+            time.perf_counter() - started,
+            ok,
+            response.status_code,
+            int(queries) if queries is not None else None,
+        )
+        if not ok:
+            raise StageError(
+                f"{stage} answered {response.status_code}", details=response.text
+            )
+        return response
+
+    def record(self, stage, seconds, ok, status=None, queries=None):
+        self.recorder.add(Sample(stage, seconds, ok, status, queries))
+
+    def mailed(self, predicate, since_count=0):
+        """Poll the Mailgun stand-in for a new message to the user matching predicate"""
+        deadline = time.monotonic() + self.options.mail_timeout
+        while time.monotonic() < deadline:
+            messages = requests.get(
+                f"{self.options.mailgun_url}/sandbox/messages",
+                params={"to": self.email},
+                timeout=self.options.timeout,
+            ).json()["items"]
+            found = [m for m in messages[since_count:] if predicate(m)]
+            if found:
+                return found[0], len(messages)
+            time.sleep(self.options.poll_interval)
+        raise StageError("mail not received", details=self.email)
+
+    def run(self):
+        try:
+            self.signup()
+            self.verify()
+            approve_kyc(self.email)
+            order_id = self.transact()
+            self.pay(order_id)
+        except StageError as e:
+            logger.warning(f"{self.email}: {e.message}")
+            return False
+        except Exception:
+            logger.exception(f"{self.email}: lifecycle failed")
+            return False
+        return True
+
+    def signup(self):
+        self.request(
+            "signup",
+            "POST",
+            self.api("users/sign-up/"),
+            (201,),
+            json={
+                "username": self.email.split("@")[0],
+                "email": self.email,
+                "password": PASSWORD,
+                "role_management": "CUSTOMER",
+            },
+        )
+
+    def verify(self):
+        # the code mail is sent by celery, not part of the verify latency
+        message, self.mail_count = self.mailed(
+            lambda m: m["subject"] == "Verify your email"
+        )
+        code = VERIFICATION_CODE.search(message["text"] or "")
+        if code is None:
+            raise StageError("no verification code in the mail")
+        response = self.request(
+            "verify",
+            "POST",
+            self.api("users/verify-code/validate/"),
+            (200,),
+            json={"email": self.email, "code": code.group(1)},
+        )
+        self.session.headers["Authorization"] = f"Bearer {response.json()['access']}"
+
+    def transact(self):
+        started = time.perf_counter()
+        response = self.request(
+            "transact",
+            "POST",
+            self.api("transactions/transaction/"),
+            (201, 202),
+            json={"amount": str(self.options.amount)},
+            headers={"Idempotency-Key": secrets.token_hex(16)},
+        )
+        data = response.json()
+        # asynchronous orchestration, poll until the order is created
+        while not data.get("order_id"):
+            if time.perf_counter() - started > self.options.mail_timeout:
+                raise StageError("order not created in time")
+            time.sleep(self.options.poll_interval)
+            merchant_order_id = data["merchant_order_id"]
+            data = self.session.get(
+                self.api(f"transactions/transaction/{merchant_order_id}/"),
+                timeout=self.options.timeout,
+            ).json()
+        return data["order_id"]
+
+    def pay(self, order_id):
+        """
+        Pay at the stand-in, its webhook to the app is timed as the webhook stage,
+        then wait for the state mail
+        """
+        paid_at = time.time()
+        result = requests.post(
+            f"{self.options.paymob_url}/sandbox/orders/{order_id}/pay",
+            json={"outcome": "success"},
+            timeout=self.options.timeout,
+        ).json()
+        status = result.get("webhook_status")
+        queries = result.get("webhook_queries")
+        self.record(
+            "webhook",
+            result.get("webhook_seconds") or 0,
+            status == 200,
+            status,
+            int(queries) if queries is not None else None,
+        )
+        if status != 200:
+            raise StageError(f"webhook answered {status}")
+        try:
+            message, _ = self.mailed(
+                lambda m: m["subject"] != "Verify your email", self.mail_count
+            )
+        except StageError:
+            self.record("email", time.time() - paid_at, False)
+            raise
+        # both clocks are the local machine's, the stand-in runs next to the script
+        self.record("email", max(0, message["accepted_at"] - paid_at), True)
+
+
+def run(options):
+    """Run the virtual users, return the report"""
+    recorder = Recorder()
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=options.concurrency) as pool:
+        list(
+            pool.map(
+                lambda _: VirtualUser(options, recorder).run(), range(options.users)
+            )
+        )
+    elapsed = time.perf_counter() - started
+    return summarize(recorder.samples, elapsed, options.users, options.concurrency)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--paymob-url", default="http://localhost:8081")
+    parser.add_argument("--mailgun-url", default="http://localhost:8082")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--amount", default="150.00")
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument(
+        "--mail-timeout",
+        type=float,
+        default=30,
+        help="seconds to wait for mails and asynchronous orders",
+    )
+    parser.add_argument("--poll-interval", type=float, default=0.05)
+    parser.add_argument("--report", default="loadtest-report.json")
+    parser.add_argument("--baseline", help="report of a previous run to compare to")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.2,
+        help="allowed p95/p99 slowdown against the baseline (0.2 = 20%%)",
+    )
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format="%(asctime)s %(message)s")
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "config.settings")
+    import django
+
+    django.setup()
+
+    report = run(options)
+    with open(options.report, "w") as f:
+        json.dump(report, f, indent=2)
+    for stage, values in report["stages"].items():
+        print(
+            f"{stage:<9} n={values['count']:<5} errors={values['errors']:<4} "
+            f"p50={values['p50']} p95={values['p95']} p99={values['p99']} "
+            f"queries={values['queries_max']}"
+        )
+    print(f"{report['requests_per_second']} req/s, report in {options.report}")
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = compare(report, json.load(f), options.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
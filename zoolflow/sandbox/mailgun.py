@@ -0,0 +1,107 @@
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+from .server import StandInHandler, StandInServer, post_callback, route
+
+
+class MailgunState:
+    """
+    Messages accepted by the Mailgun stand-in
+    """
+
+    def __init__(self, signing_key, events_url=None, event_delay=0):
+        self.signing_key = signing_key
+        self.events_url = events_url
+        # seconds between accepting a message and reporting it delivered
+        self.event_delay = event_delay
+        self.lock = threading.Lock()
+        self.messages = {}
+
+    def signature(self):
+        timestamp = str(int(time.time()))
+        token = secrets.token_hex(25)
+        signature = hmac.new(
+            self.signing_key.encode(), f"{timestamp}{token}".encode(), hashlib.sha256
+        ).hexdigest()
+        return {"timestamp": timestamp, "token": token, "signature": signature}
+
+    def send_event(self, message_id, event="delivered"):
+        """Send the signed event webhook of a message, return its status"""
+        if not self.events_url:
+            return None
+        payload = {
+            "signature": self.signature(),
+            "event-data": {
+                "id": secrets.token_urlsafe(16),
+                "event": event,
+                "timestamp": time.time(),
+                "message": {"headers": {"message-id": message_id}},
+            },
+        }
+        status = post_callback(self.events_url, payload).status
+        with self.lock:
+            self.messages[message_id]["events"].append(
+                {"event": event, "status": status}
+            )
+        return status
+
+    def deliver_later(self, message_id):
+        def deliver():
+            time.sleep(self.event_delay)
+            self.send_event(message_id)
+
+        threading.Thread(target=deliver, daemon=True).start()
+
+
+class MailgunHandler(StandInHandler):
+    """
+    Mailgun messages API stand-in
+    """
+
+    @property
+    def state(self) -> MailgunState:
+        return self.server.state
+
+    @route("POST", r"/v3/(?P<domain>[^/]+)/messages")
+    def send_message(self, domain):
+        if not self.headers.get("Authorization", "").startswith("Basic "):
+            return 401, {"message": "Invalid private key"}
+        message_id = f"{time.strftime('%Y%m%d%H%M%S')}.{secrets.token_hex(8)}@{domain}"
+        with self.state.lock:
+            self.state.messages[message_id] = {
+                "id": message_id,
+                "to": self.body.get("to"),
+                "subject": self.body.get("subject"),
+                "text": self.body.get("text"),
+                "accepted_at": time.time(),
+                "events": [],
+            }
+        self.state.deliver_later(message_id)
+        return 200, {"id": f"<{message_id}>", "message": "Queued. Thank you."}
+
+    @route("GET", "/sandbox/messages")
+    def find_messages(self):
+        """Messages sent to ?to=<recipient>, oldest first"""
+        recipient = self.query.get("to")
+        with self.state.lock:
+            messages = [
+                message
+                for message in self.state.messages.values()
+                if recipient is None or message["to"] == recipient
+            ]
+        return 200, {"items": messages}
+
+    @route("GET", r"/sandbox/messages/(?P<message_id>[^/]+)")
+    def message(self, message_id):
+        message = self.state.messages.get(message_id)
+        if message is None:
+            return 404, {"message": "Not found"}
+        return 200, message
+
+
+def mailgun_server(address, signing_key, events_url=None, event_delay=0, faults=None):
+    server = StandInServer(address, MailgunHandler, "Mailgun", faults)
+    server.state = MailgunState(signing_key, events_url, event_delay)
+    return server
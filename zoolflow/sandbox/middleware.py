@@ -0,0 +1,34 @@
+from contextlib import ExitStack
+from django.db import connections
+
+QUERY_COUNT_HEADER = "X-DB-Query-Count"
+
+
+class QueryCountMiddleware:
+    """
+    Answer the number of database queries run by the request
+    in the X-DB-Query-Count header, read by the load test.
+
+    Enabled with the QUERY_COUNT_HEADER setting, works without DEBUG
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        counter = _QueryCounter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(connections[alias].execute_wrapper(counter))
+            response = self.get_response(request)
+        response[QUERY_COUNT_HEADER] = str(counter.count)
+        return response
+
+
+class _QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
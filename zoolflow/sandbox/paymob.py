@@ -0,0 +1,188 @@
+import hashlib
+import hmac
+import itertools
+import secrets
+import threading
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+from zoolflow.transactions.services.webhook import WebhookService
+from .middleware import QUERY_COUNT_HEADER
+from .server import StandInHandler, StandInServer, post_callback, route
+
+
+class PayMobState:
+    """
+    Orders, payment keys and transactions known to the PayMob stand-in
+    """
+
+    def __init__(self, hmac_secret, webhook_url=None, integration_id=1):
+        self.hmac_secret = hmac_secret
+        self.webhook_url = webhook_url
+        self.integration_id = integration_id
+        self.lock = threading.Lock()
+        self.orders = {}
+        self.transactions = {}
+        self._ids = itertools.count(100000)
+
+    def next_id(self):
+        with self.lock:
+            return next(self._ids)
+
+    def transaction_payload(self, order, outcome):
+        """
+        Build the webhook "obj" of a payment of the order.
+        outcome: success, pending, auth, declined or error
+        """
+        flags = {
+            "success": outcome in ("success", "auth"),
+            "pending": outcome == "pending",
+            "is_auth": outcome == "auth",
+            "is_capture": False,
+            "is_standalone_payment": outcome == "success",
+            "error_occured": outcome == "error",
+        }
+        return {
+            "id": self.next_id(),
+            "amount_cents": order["amount_cents"],
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "currency": order["currency"],
+            "has_parent_transaction": False,
+            "integration_id": self.integration_id,
+            "is_3d_secure": True,
+            "is_refunded": False,
+            "is_voided": False,
+            "owner": 1,
+            "order": {
+                "id": order["id"],
+                "merchant_order_id": order["merchant_order_id"],
+            },
+            "source_data": {"pan": "2346", "sub_type": "MasterCard", "type": "card"},
+            **flags,
+        }
+
+    def sign(self, obj):
+        message = WebhookService.paymob_hmac_message(obj)
+        return hmac.new(
+            self.hmac_secret.encode(), message.encode(), hashlib.sha512
+        ).hexdigest()
+
+    def pay(self, order_id, outcome="success", webhook_url=None):
+        """
+        Record a payment of the order and send its signed webhook.
+        Return (transaction, webhook Callback or None when not sent)
+        """
+        order = self.orders.get(order_id)
+        if order is None:
+            return None, None
+        obj = self.transaction_payload(order, outcome)
+        with self.lock:
+            self.transactions[obj["id"]] = obj
+            order["transactions"].append(obj["id"])
+        url = webhook_url or self.webhook_url
+        if not url:
+            return obj, None
+        callback = post_callback(
+            url,
+            {"type": "TRANSACTION", "obj": obj},
+            urlencode({"hmac": self.sign(obj)}),
+        )
+        return obj, callback
+
+
+class PayMobHandler(StandInHandler):
+    """
+    PayMob accept API stand-in, paths mirror the real ones
+    """
+
+    @property
+    def state(self) -> PayMobState:
+        return self.server.state
+
+    def _authorized(self, token):
+        return token in self.server.tokens
+
+    @route("POST", "/api/auth/tokens")
+    def auth_token(self):
+        if not self.body.get("api_key"):
+            return 403, {"detail": "Incorrect credentials"}
+        token = secrets.token_hex(32)
+        self.server.tokens.add(token)
+        return 201, {"token": token}
+
+    @route("POST", "/api/ecommerce/orders")
+    def create_order(self):
+        if not self._authorized(self.body.get("auth_token")):
+            return 401, {"detail": "Invalid token"}
+        merchant_id = self.body.get("merchant_order_id")
+        with self.state.lock:
+            duplicate = any(
+                order["merchant_order_id"] == merchant_id
+                for order in self.state.orders.values()
+            )
+        if duplicate:
+            return 422, {"message": "duplicate"}
+        order = {
+            "id": self.state.next_id(),
+            "merchant_order_id": merchant_id,
+            "amount_cents": self.body.get("amount_cents"),
+            "currency": self.body.get("currency"),
+            "transactions": [],
+        }
+        with self.state.lock:
+            self.state.orders[order["id"]] = order
+        return 201, order
+
+    @route("POST", "/api/acceptance/payment_keys")
+    def payment_key(self):
+        if not self._authorized(self.body.get("auth_token")):
+            return 401, {"detail": "Invalid token"}
+        if int(self.body.get("order_id") or 0) not in self.state.orders:
+            return 404, {"detail": "Order not found"}
+        return 201, {"token": secrets.token_urlsafe(48)}
+
+    @route("GET", r"/api/acceptance/transactions/(?P<transaction_id>\d+)")
+    def transaction(self, transaction_id):
+        token = self.headers.get("Authorization", "").removeprefix("Bearer ")
+        if not self._authorized(token):
+            return 401, {"detail": "Invalid token"}
+        obj = self.state.transactions.get(int(transaction_id))
+        if obj is None:
+            return 404, {"detail": "Not found."}
+        return 200, obj
+
+    @route("POST", "/api/ecommerce/orders/transaction_inquiry")
+    def transaction_inquiry(self):
+        if not self._authorized(self.body.get("auth_token")):
+            return 401, {"detail": "Invalid token"}
+        order = self.state.orders.get(int(self.body.get("order_id") or 0))
+        if not order or not order["transactions"]:
+            return 404, {"detail": "Not found."}
+        return 200, self.state.transactions[order["transactions"][-1]]
+
+    @route("POST", r"/sandbox/orders/(?P<order_id>\d+)/pay")
+    def pay(self, order_id):
+        """
+        Pay the order as the customer would in the iframe,
+        the signed webhook is sent before answering
+        """
+        obj, callback = self.state.pay(
+            int(order_id),
+            outcome=self.body.get("outcome", "success"),
+            webhook_url=self.body.get("webhook_url"),
+        )
+        if obj is None:
+            return 404, {"detail": "Order not found"}
+        return 200, {
+            "transaction": obj,
+            "webhook_status": callback and callback.status,
+            "webhook_seconds": callback and callback.seconds,
+            # answered by the app when QUERY_COUNT_HEADER is on
+            "webhook_queries": callback and callback.headers.get(QUERY_COUNT_HEADER),
+        }
+
+
+def paymob_server(address, hmac_secret, webhook_url=None, faults=None):
+    server = StandInServer(address, PayMobHandler, "PayMob", faults)
+    server.state = PayMobState(hmac_secret, webhook_url)
+    server.tokens = set()
+    return server
@@ -0,0 +1,187 @@
+import json
+import logging
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import namedtuple
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class FaultProfile:
+    """
+    Latency and failures injected in every stand-in response
+    """
+
+    # added to every response, in milliseconds
+    latency_ms: float = 0
+    jitter_ms: float = 0
+    # share of requests answered 500 / 429
+    error_rate: float = 0
+    throttle_rate: float = 0
+    # Retry-After of the 429 answers, in seconds
+    retry_after: int = 1
+
+    def update(self, values):
+        for name, value in values.items():
+            if name in self.__dataclass_fields__:
+                setattr(self, name, type(getattr(self, name))(value))
+
+    def delay(self):
+        jitter = random.uniform(-self.jitter_ms, self.jitter_ms)
+        return max(0, self.latency_ms + jitter) / 1000
+
+    def failure(self):
+        """Return the injected (status, headers) or None to answer normally"""
+        roll = random.random()
+        if roll < self.throttle_rate:
+            return 429, {"Retry-After": str(self.retry_after)}
+        if roll < self.throttle_rate + self.error_rate:
+            return 500, {}
+        return None
+
+
+def route(method, pattern):
+    """Register a handler method for the method and path regex"""
+
+    def register(func):
+        func.route = (method, re.compile(f"^{pattern}$"))
+        return func
+
+    return register
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    JSON request handler dispatching to @route methods of the subclass.
+
+    Every provider route goes through the server fault profile,
+    the /sandbox/ routes control the stand-in and never fail
+    """
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.server.name}: {format % args}")
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_POST(self):
+        self._dispatch("POST")
+
+    def _dispatch(self, method):
+        url = urlsplit(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.body = self._read_body()
+        for func in self._routes():
+            route_method, pattern = func.route
+            match = pattern.match(url.path)
+            if route_method == method and match:
+                if not url.path.startswith("/sandbox/") and self._inject_fault():
+                    return
+                status, payload = func(self, **match.groupdict())
+                return self.send_json(status, payload)
+        self.send_json(404, {"detail": "Not found."})
+
+    @classmethod
+    def _routes(cls):
+        if "_route_table" not in cls.__dict__:
+            members = (getattr(cls, name) for name in dir(cls))
+            cls._route_table = [func for func in members if hasattr(func, "route")]
+        return cls._route_table
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        content_type = self.headers.get("Content-Type", "")
+        if "json" in content_type:
+            return json.loads(raw or b"{}")
+        # mailgun messages are form encoded
+        return {k: v[-1] for k, v in parse_qs(raw.decode()).items()}
+
+    def _inject_fault(self):
+        faults = self.server.faults
+        time.sleep(faults.delay())
+        failure = faults.failure()
+        if failure is None:
+            return False
+        status, headers = failure
+        self.send_json(status, {"detail": "Injected failure."}, headers)
+        return True
+
+    def send_json(self, status, payload, headers=None):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    @route("GET", "/sandbox/faults")
+    def get_faults(self):
+        return 200, asdict(self.server.faults)
+
+    @route("POST", "/sandbox/faults")
+    def set_faults(self):
+        self.server.faults.update(self.body)
+        return 200, asdict(self.server.faults)
+
+
+class StandInServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, name, faults=None):
+        super().__init__(address, handler)
+        self.name = name
+        self.faults = faults or FaultProfile()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """Serve on a daemon thread, return the thread"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        logger.info(f"{self.name} stand-in listening on {self.url}")
+        return thread
+
+
+Callback = namedtuple("Callback", "status seconds headers")
+
+
+def post_callback(url, payload, query=None, timeout=30):
+    """
+    POST a JSON callback (webhook) and return its Callback (status, seconds, headers)
+    """
+    if query:
+        url = f"{url}?{query}"
+    request = urllib.request.Request(
+        url,
+        data=json.dumps(payload).encode(),
+        headers={"Content-Type": "application/json"},
+        method="POST",
+    )
+    started = time.perf_counter()
+    headers = {}
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status, headers = response.status, dict(response.headers)
+    except urllib.error.HTTPError as e:
+        status, headers = e.code, dict(e.headers)
+    except urllib.error.URLError as e:
+        logger.error(f"Callback to {url} failed: {e.reason}")
+        status = None
+    return Callback(status, time.perf_counter() - started, headers)
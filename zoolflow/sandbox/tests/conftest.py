@@ -0,0 +1 @@
+from zoolflow.transactions.tests.conftest import customer_factory  # noqa: F401
@@ -0,0 +1,73 @@
+import pytest
+from django.conf import settings as django_settings
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from ..loadtest import VERIFICATION_CODE, Sample, compare, percentile, summarize
+from ..middleware import QUERY_COUNT_HEADER
+
+
+def test_percentile_nearest_rank():
+    values = [i / 100 for i in range(1, 101)]
+
+    assert percentile(values, 50) == 0.5
+    assert percentile(values, 99) == 0.99
+    assert percentile([0.3], 95) == 0.3
+    assert percentile([], 50) is None
+
+
+def test_summary_per_stage():
+    samples = [Sample("transact", 0.1 * i, True, 201, 12) for i in range(1, 11)]
+    samples.append(Sample("transact", 5, False, 500, 3))
+    samples.append(Sample("email", 1.5, True))
+
+    report = summarize(samples, elapsed=2, users=11, concurrency=4)
+    transact = report["stages"]["transact"]
+
+    assert transact["count"] == 11 and transact["errors"] == 1
+    # failures are left out of the latencies
+    assert transact["p99"] == pytest.approx(1.0)
+    assert transact["queries_max"] == 12
+    assert report["completed_lifecycles"] == 1
+    assert report["requests_per_second"] == 5.5
+
+
+def test_compare_flags_slower_percentiles_and_more_queries():
+    stage = {"p95": 0.2, "p99": 0.4, "queries_max": 12, "error_rate": 0}
+    baseline = {"stages": {"transact": stage, "webhook": stage}}
+    report = {
+        "stages": {
+            "transact": {**stage, "p95": 0.23, "queries_max": 14},
+            "webhook": {**stage, "p99": 0.6},
+        }
+    }
+
+    assert compare(report, baseline, tolerance=0.2) == [
+        "transact queries: 14 > 12",
+        "webhook p99: 0.600s > 0.400s",
+    ]
+
+
+def test_code_is_read_from_the_verification_mail():
+    body = (
+        '<style>h1 {color: #333333;}</style><div class="verification-code">482910</div>'
+    )
+
+    assert VERIFICATION_CODE.search(body).group(1) == "482910"
+
+
+@pytest.mark.django_db
+def test_query_count_header(settings, customer_factory):
+    settings.MIDDLEWARE = [
+        "zoolflow.sandbox.middleware.QueryCountMiddleware",
+        *django_settings.MIDDLEWARE,
+    ]
+
+    client = APIClient()
+    client.force_authenticate(customer_factory().user)
+
+    with CaptureQueriesContext(connection) as queries:
+        response = client.get("/api/v1/transactions/transaction/")
+
+    assert response.status_code == 200
+    assert int(response[QUERY_COUNT_HEADER]) == len(queries) > 0
@@ -0,0 +1,83 @@
+import pytest
+import requests
+from zoolflow.notifications.mailers.providers import MailGunProvider
+from zoolflow.transactions.services.auth_token import paymob_token_manager
+from zoolflow.transactions.services.http_client import registry as session_registry
+from zoolflow.transactions.services.paymob import PayMobClient
+from zoolflow.transactions.services.payloads import PaymentContext
+from zoolflow.transactions.services.webhook import WebhookService
+from ..mailgun import mailgun_server
+from ..paymob import paymob_server
+
+
+@pytest.fixture
+def paymob(settings):
+    server = paymob_server(("127.0.0.1", 0), hmac_secret="sandbox-secret")
+    server.start()
+    settings.HMAC_SECRET_KEY = "sandbox-secret"
+    settings.PAYMOB_API_KEY = "sandbox-key"
+    settings.AUTH_PAYMOB_TOKEN = f"{server.url}/api/auth/tokens"
+    settings.ORDER_PAYMOB_URL = f"{server.url}/api/ecommerce/orders"
+    settings.PAYMOB_PAYMENT_URL_KEY = f"{server.url}/api/acceptance/payment_keys"
+    settings.PAYMOB_TRANSACTIONS_URL = f"{server.url}/api/acceptance/transactions/"
+    settings.PROVIDER_RATE_LIMITS = {}
+    # tokens of other tests' fakes are unknown to the stand-in
+    paymob_token_manager._local = None
+    yield server
+    server.shutdown()
+    session_registry.reset()
+    paymob_token_manager._local = None
+
+
+@pytest.mark.django_db
+class TestPayMobStandIn:
+    def test_client_lifecycle_and_signed_webhook(self, paymob, customer_factory):
+        customer = customer_factory()
+        client = PayMobClient(
+            customer=customer,
+            amount_cents=2500,
+            context=PaymentContext.for_customer(customer),
+        )
+
+        order_id = client.create_order(merchant_id="ORD-sandbox-1")
+        assert client.payment_key_token(order_id=order_id)
+        obj, _ = paymob.state.pay(order_id, outcome="success")
+        flags = client.get_transaction_flags(obj["id"])
+
+        assert (
+            flags["success"] and flags["order"]["merchant_order_id"] == "ORD-sandbox-1"
+        )
+        # the stand-in signs exactly like PayMob, the webhook check accepts it
+        WebhookService(obj, "ORD-sandbox-1", obj["id"]).verify_paymob_hmac(
+            paymob.state.sign(obj)
+        )
+
+    def test_injected_throttling(self, paymob):
+        requests.post(f"{paymob.url}/sandbox/faults", json={"throttle_rate": 1})
+
+        response = requests.post(
+            f"{paymob.url}/api/auth/tokens", json={"api_key": "sandbox-key"}
+        )
+
+        assert response.status_code == 429
+        assert response.headers["Retry-After"] == "1"
+
+
+def test_mailgun_stand_in_queues_messages(settings):
+    server = mailgun_server(("127.0.0.1", 0), signing_key="sandbox-signing")
+    server.start()
+    settings.MAILGUN_BASE_URL = server.url
+    settings.PROVIDER_RATE_LIMITS = {}
+    try:
+        result = MailGunProvider().send_email(
+            "customer@example.com", "Transaction update", "Your transaction ..."
+        )
+        sent = requests.get(
+            f"{server.url}/sandbox/messages", params={"to": "customer@example.com"}
+        ).json()["items"]
+    finally:
+        server.shutdown()
+        session_registry.reset()
+
+    assert result["message"] == "Queued. Thank you."
+    assert sent[0]["id"] == result["id"].strip("<>")
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from zoolflow.transactions.services.archive import TransactionArchiveService
+
+
+class Command(BaseCommand):
+    help = "Move old FAILED/ERROR/REFUNDED/VOIDED transactions to the archive table."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument(
+            "--max-batches",
+            type=int,
+            default=None,
+            help="Stop after this many batches, the next run picks up the rest.",
+        )
+        parser.add_argument(
+            "--retention-days",
+            type=int,
+            default=None,
+            help="Keep transactions created within this many days in the hot table.",
+        )
+
+    def handle(self, *args, **options):
+        service = TransactionArchiveService(
+            batch_size=options["batch_size"],
+            retention_days=options["retention_days"],
+        )
+        stats = service.run(max_batches=options["max_batches"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Archived {archived} in {batches} batches, "
+                "finished {finished}.".format(**stats)
+            )
+        )
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from zoolflow.transactions.services.reconciliation import (
+    TransactionReconciliationService,
+)
+
+
+class Command(BaseCommand):
+    help = "Reconcile stuck PENDING/AUTHORIZED transactions with PayMob."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None)
+        parser.add_argument("--workers", type=int, default=None)
+        parser.add_argument(
+            "--max-batches",
+            type=int,
+            default=None,
+            help="Stop after this many batches, the next run resumes from there.",
+        )
+        parser.add_argument(
+            "--min-age",
+            type=int,
+            default=None,
+            help="Skip transactions updated within this many seconds.",
+        )
+        parser.add_argument(
+            "--reset",
+            action="store_true",
+            help="Drop the saved checkpoint and start from the first transaction.",
+        )
+
+    def handle(self, *args, **options):
+        service = TransactionReconciliationService(
+            batch_size=options["batch_size"],
+            max_workers=options["workers"],
+            min_age=options["min_age"],
+        )
+        if options["reset"]:
+            service.reset()
+        stats = service.run(max_batches=options["max_batches"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                "Scanned {scanned}, updated {updated}, failed {failed}, "
+                "unpaid {unpaid}, finished {finished}.".format(**stats)
+            )
+        )
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("transactions", "0008_transaction_idempotency_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="WebhookInbox",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("dedupe_key", models.CharField(max_length=128, unique=True)),
+                ("merchant_order_id", models.CharField(max_length=40)),
+                ("provider_transaction_id", models.CharField(max_length=64)),
+                ("payload", models.JSONField()),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("received", "Received"),
+                            ("processed", "Processed"),
+                            ("failed", "Failed"),
+                        ],
+                        default="received",
+                        max_length=20,
+                    ),
+                ),
+                ("attempts", models.PositiveSmallIntegerField(default=0)),
+                ("error", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("processed_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "ordering": ["id"],
+                "indexes": [
+                    models.Index(
+                        fields=["merchant_order_id", "status"],
+                        name="inbox_merchant_status_idx",
+                    )
+                ],
+            },
+        ),
+    ]
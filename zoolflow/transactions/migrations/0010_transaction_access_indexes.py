@@ -0,0 +1,34 @@
+# Generated by Django 5.2.5 on 2026-10-18 14:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("customers", "0013_alter_knowyourcustomer_document_file"),
+        ("transactions", "0009_webhookinbox"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["customer", "-created_at"], name="txn_customer_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                fields=["state", "created_at"], name="txn_state_created_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="transaction",
+            index=models.Index(
+                condition=models.Q(("state__in", ["pending", "authorized"])),
+                fields=["id"],
+                name="txn_unsettled_idx",
+            ),
+        ),
+    ]
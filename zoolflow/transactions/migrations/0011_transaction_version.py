@@ -0,0 +1,18 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("transactions", "0010_transaction_access_indexes"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="transaction",
+            name="version",
+            field=models.PositiveIntegerField(default=0, editable=False),
+        ),
+    ]
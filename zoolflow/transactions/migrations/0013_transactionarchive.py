@@ -0,0 +1,81 @@
+# Generated by Django 5.2.5 on 2026-10-18 15:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("customers", "0013_alter_knowyourcustomer_document_file"),
+        ("transactions", "0012_transaction_payment_token_expires_at"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="TransactionArchive",
+            fields=[
+                ("id", models.BigIntegerField(primary_key=True, serialize=False)),
+                ("amount", models.DecimalField(decimal_places=2, max_digits=12)),
+                (
+                    "payment_provider",
+                    models.CharField(choices=[("PayMob", "PayMob")], max_length=50),
+                ),
+                (
+                    "state",
+                    models.CharField(
+                        choices=[
+                            ("initiated", "Initiated"),
+                            ("pending", "Pending"),
+                            ("succeeded", "Succeeded"),
+                            ("failed", "Failed"),
+                            ("refunded", "Refunded"),
+                            ("error", "Error"),
+                            ("voided", "Voided"),
+                            ("authorized", "Authorized"),
+                        ],
+                        max_length=20,
+                    ),
+                ),
+                ("merchant_order_id", models.CharField(max_length=40, unique=True)),
+                (
+                    "idempotency_key",
+                    models.CharField(blank=True, max_length=64, null=True),
+                ),
+                (
+                    "transaction_id",
+                    models.CharField(blank=True, max_length=64, null=True),
+                ),
+                ("order_id", models.CharField(blank=True, max_length=200, null=True)),
+                ("payment_token", models.TextField(blank=True, null=True)),
+                (
+                    "payment_token_expires_at",
+                    models.DateTimeField(blank=True, null=True),
+                ),
+                ("version", models.PositiveIntegerField(default=0)),
+                ("created_at", models.DateTimeField()),
+                ("updated_at", models.DateTimeField()),
+                ("archived_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "customer",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="archived_transactions",
+                        to="customers.customer",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["customer", "-created_at"],
+                        name="txn_archive_customer_idx",
+                    ),
+                    models.Index(
+                        fields=["state", "created_at"], name="txn_archive_state_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
@@ -1,15 +1,46 @@
-import uuid
 from decimal import Decimal
 from django.db import models
-from django.db.models import Q
+from django.db.models import F, Q
+from django.utils import timezone
 from django.core.validators import MinValueValidator
 from zoolflow.customers.models import Customer
+from .services.ids import new_merchant_order_id
 
 # Create your models here.
 
 
 def dufault_merchant_order_id():
-    return "ORD-" + str(uuid.uuid4())
+    # referenced by migrations, the generator comes from MERCHANT_ORDER_ID_GENERATOR
+    return new_merchant_order_id()
+
+
+def _state_predecessors(transitions):
+    """
+    Map each state to the states allowed to move to it, itself included
+    """
+    predecessors = {state: {state} for state in transitions}
+    for state, next_states in transitions.items():
+        for next_state in next_states:
+            predecessors[next_state].add(state)
+    return {state: frozenset(states) for state, states in predecessors.items()}
+
+
+class TransactionQuerySet(models.QuerySet):
+    def transition(self, next_state, version=None, **fields):
+        """
+        Move the matching transactions to next_state with one conditional
+        UPDATE, only rows in a state allowed to reach it (and at the given
+        version) change. Return the number of rows updated, 0 is a conflict
+        """
+        queryset = self.filter(state__in=Transaction.STATE_PREDECESSORS[next_state])
+        if version is not None:
+            queryset = queryset.filter(version=version)
+        return queryset.update(
+            state=next_state,
+            version=F("version") + 1,
+            updated_at=timezone.now(),
+            **fields,
+        )
 
 
 class Transaction(models.Model):
@@ -53,6 +84,16 @@ class Transaction(models.Model):
         TransactionState.REFUNDED: set(),
         TransactionState.VOIDED: set(),
     }
+    # conditional UPDATEs of TransactionQuerySet.transition
+    STATE_PREDECESSORS = _state_predecessors(ALLOWED_STATE_TRANSITIONS)
+    # waiting on the provider, what reconciliation sweeps look for
+    UNSETTLED_STATES = (TransactionState.PENDING, TransactionState.AUTHORIZED)
+    # no way out, what archival moves to TransactionArchive
+    TERMINAL_STATES = tuple(
+        state
+        for state, next_states in ALLOWED_STATE_TRANSITIONS.items()
+        if not next_states
+    )
 
     customer = models.ForeignKey(
         Customer, on_delete=models.CASCADE, related_name="customer_transaction"
@@ -83,9 +124,15 @@ class Transaction(models.Model):
     transaction_id = models.CharField(max_length=64, unique=True, null=True, blank=True)
     order_id = models.CharField(max_length=200, unique=True, null=True, blank=True)
     payment_token = models.TextField(null=True, blank=True)
+    # the payment token is reused by checkout reloads until then
+    payment_token_expires_at = models.DateTimeField(null=True, blank=True)
+    # bumped by every state change, lets writers detect concurrent updates
+    version = models.PositiveIntegerField(default=0, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = TransactionQuerySet.as_manager()
+
     def __str__(self):
         return f"Transaction {self.merchant_order_id} ({self.state})"
 
@@ -101,6 +148,21 @@ class Transaction(models.Model):
 
     class Meta:
         ordering = ["-created_at"]
+        indexes = [
+            # customer listing newest first
+            models.Index(
+                fields=["customer", "-created_at"],
+                name="txn_customer_created_idx",
+            ),
+            # staff filtering by state and creation time
+            models.Index(fields=["state", "created_at"], name="txn_state_created_idx"),
+            # keyset sweeps over transactions still waiting on the provider
+            models.Index(
+                fields=["id"],
+                condition=Q(state__in=["pending", "authorized"]),
+                name="txn_unsettled_idx",
+            ),
+        ]
         constraints = [
             models.UniqueConstraint(
                 fields=["customer", "idempotency_key"],
@@ -108,3 +170,103 @@ class Transaction(models.Model):
                 name="uniq_customer_idempotency_key",
             )
         ]
+
+
+class TransactionArchive(models.Model):
+    """
+    Cold copy of terminal transactions moved out of the hot table.
+
+    Columns mirror Transaction in the same order (archived_at last) and the
+    original id is kept, so both tables can be read as one UNION
+    """
+
+    # Transaction columns carried over by the archival, in table order
+    TRANSACTION_FIELDS = (
+        "id",
+        "customer_id",
+        "amount",
+        "payment_provider",
+        "state",
+        "merchant_order_id",
+        "idempotency_key",
+        "transaction_id",
+        "order_id",
+        "payment_token",
+        "payment_token_expires_at",
+        "version",
+        "created_at",
+        "updated_at",
+    )
+
+    id = models.BigIntegerField(primary_key=True)
+    customer = models.ForeignKey(
+        Customer, on_delete=models.CASCADE, related_name="archived_transactions"
+    )
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    payment_provider = models.CharField(
+        max_length=50, choices=Transaction.SupportedPaymentProviders.choices
+    )
+    state = models.CharField(
+        max_length=20, choices=Transaction.TransactionState.choices
+    )
+    merchant_order_id = models.CharField(max_length=40, unique=True)
+    idempotency_key = models.CharField(max_length=64, null=True, blank=True)
+    transaction_id = models.CharField(max_length=64, null=True, blank=True)
+    order_id = models.CharField(max_length=200, null=True, blank=True)
+    payment_token = models.TextField(null=True, blank=True)
+    payment_token_expires_at = models.DateTimeField(null=True, blank=True)
+    version = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField()
+    updated_at = models.DateTimeField()
+    archived_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f"Archived transaction {self.merchant_order_id} ({self.state})"
+
+    class Meta:
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(
+                fields=["customer", "-created_at"],
+                name="txn_archive_customer_idx",
+            ),
+            models.Index(fields=["state", "created_at"], name="txn_archive_state_idx"),
+        ]
+
+
+class WebhookInbox(models.Model):
+    """
+    Verified provider webhooks waiting to be applied to their transaction
+    """
+
+    class InboxStatus(models.TextChoices):
+        RECEIVED = "received", "Received"
+        PROCESSED = "processed", "Processed"
+        FAILED = "failed", "Failed"
+
+    # the verified HMAC, unique per distinct webhook body
+    dedupe_key = models.CharField(max_length=128, unique=True)
+    merchant_order_id = models.CharField(max_length=40)
+    provider_transaction_id = models.CharField(max_length=64)
+    payload = models.JSONField()
+    status = models.CharField(
+        max_length=20,
+        choices=InboxStatus.choices,
+        default=InboxStatus.RECEIVED,
+    )
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"Webhook {self.provider_transaction_id} ({self.status})"
+
+    class Meta:
+        ordering = ["id"]
+        indexes = [
+            models.Index(
+                fields=["merchant_order_id", "status"],
+                name="inbox_merchant_status_idx",
+            )
+        ]
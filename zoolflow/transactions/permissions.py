@@ -1,3 +1,5 @@
+import hmac
+from django.conf import settings
 from rest_framework.permissions import BasePermission
 
 
@@ -18,3 +20,22 @@ class IsVerifiedCustomer(BasePermission):
                 and request.user.customer_profile.is_verified
             )
         return True
+
+
+class IsMetricsScraper(BasePermission):
+    """
+    Allow the metrics scraper holding METRICS_AUTH_TOKEN
+    (sent as "Authorization: Metrics <token>") or staff users.
+    """
+
+    message = "Metrics token or staff user required."
+
+    def has_permission(self, request, view):
+        token = getattr(settings, "METRICS_AUTH_TOKEN", "")
+        header = request.headers.get("Authorization", "")
+        if token and header.startswith("Metrics "):
+            return hmac.compare_digest(header[len("Metrics ") :], token)
+        return request.user.is_authenticated and request.user.role_management in [
+            "ADMIN",
+            "STAFF",
+        ]
@@ -12,6 +12,8 @@ class TransactionSerializer(serializers.ModelSerializer):
             "transaction_id",
             "merchant_order_id",
             "order_id",
+            "payment_token",
+            "payment_token_expires_at",
             "amount",
             "state_display",
             "created_at",
@@ -20,6 +22,8 @@ class TransactionSerializer(serializers.ModelSerializer):
             "customer",
             "transaction_id",
             "order_id",
+            "payment_token",
+            "payment_token_expires_at",
             "merchant_order_id",
         )
         extra_kwargs = {"amount": {"required": True}}
@@ -0,0 +1,76 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from ..models import Transaction, TransactionArchive
+
+logger = logging.getLogger(__name__)
+
+# states no webhook or reconciliation can move a transaction out of
+ARCHIVABLE_STATES = Transaction.TERMINAL_STATES
+
+
+class TransactionArchiveService:
+    """
+    Move terminal transactions older than the retention window from the hot
+    table to TransactionArchive, batch by batch.
+
+    Each batch is copied and deleted in one database transaction, so a row is
+    always in exactly one of the tables and an interrupted run just leaves
+    the rest for the next one
+    """
+
+    def __init__(self, batch_size=None, retention_days=None):
+        self.batch_size = batch_size or getattr(
+            settings, "TRANSACTION_ARCHIVE_BATCH_SIZE", 1000
+        )
+        self.retention_days = (
+            retention_days
+            if retention_days is not None
+            else getattr(settings, "TRANSACTION_ARCHIVE_RETENTION_DAYS", 90)
+        )
+
+    def run(self, max_batches=None):
+        """
+        Archive batches until no old terminal transaction is left or
+        max_batches is hit.
+
+        Return counters of the run
+        """
+        stats = {"archived": 0, "batches": 0, "finished": False}
+        cutoff = timezone.now() - timedelta(days=self.retention_days)
+        while max_batches is None or stats["batches"] < max_batches:
+            archived = self.archive_batch(cutoff)
+            if not archived:
+                stats["finished"] = True
+                break
+            stats["archived"] += archived
+            stats["batches"] += 1
+            logger.info(f"Archived {archived} transactions created before {cutoff}.")
+        return stats
+
+    def archive_batch(self, cutoff):
+        """
+        Copy one batch of terminal transactions created before cutoff to the
+        archive and delete them. Return the number of rows moved
+        """
+        with db_transaction.atomic():
+            # rows locked by another mover are left to it
+            ids = list(
+                Transaction.objects.select_for_update(skip_locked=True)
+                .filter(state__in=ARCHIVABLE_STATES, created_at__lt=cutoff)
+                .order_by("created_at")
+                .values_list("id", flat=True)[: self.batch_size]
+            )
+            if not ids:
+                return 0
+            rows = Transaction.objects.filter(id__in=ids).values(
+                *TransactionArchive.TRANSACTION_FIELDS
+            )
+            TransactionArchive.objects.bulk_create(
+                (TransactionArchive(**row) for row in rows),
+                batch_size=self.batch_size,
+            )
+            deleted, _ = Transaction.objects.filter(id__in=ids).delete()
+        return deleted
@@ -0,0 +1,118 @@
+import logging
+import os
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+
+class AuthTokenManager:
+    """
+    Stale-while-revalidate holder of a provider authentication token.
+
+    The token and its expiry live in redis (shared) and in a process local copy.
+    Close to expiry the current token keeps being served while one background
+    thread, across all processes, fetches the next one.
+    """
+
+    def __init__(self, cache_key):
+        self.cache_key = cache_key
+        self._local = None
+        self._fetch_lock = threading.Lock()
+        self._refresh_thread = None
+
+    @property
+    def lifetime(self):
+        return getattr(settings, "CACHE_LIFETIME")
+
+    @property
+    def refresh_margin(self):
+        return getattr(settings, "PAYMOB_AUTH_REFRESH_MARGIN", 60 * 5)
+
+    def get_token(self, fetch):
+        """
+        Return a valid token, calling fetch() only when none is known yet
+        or the known one is already expired
+        """
+        now = time.time()
+        entry = self._local
+        if not self._is_valid(entry, now):
+            entry = self._shared_entry()
+            if not self._is_valid(entry, now):
+                entry = self._fetch_once(fetch)
+            self._local = entry
+
+        if entry["expires_at"] - self.refresh_margin <= now:
+            self._revalidate(fetch, now)
+        return entry["token"]
+
+    async def get_token_async(self, fetch):
+        """
+        get_token() for coroutines. The process local token is served without
+        leaving the event loop, redis reads and fetches run in a thread
+        """
+        entry = self._local
+        if self._is_valid(entry, time.time() + self.refresh_margin):
+            return entry["token"]
+        return await sync_to_async(self.get_token, thread_sensitive=False)(fetch)
+
+    def refresh(self, fetch):
+        """Fetch a new token and publish it to redis and the local copy"""
+        token = fetch()
+        entry = {"token": token, "expires_at": time.time() + self.lifetime}
+        cache.set(self.cache_key, entry, timeout=self.lifetime)
+        self._local = entry
+        logger.info("provider authentication token refreshed.")
+        return entry
+
+    def _fetch_once(self, fetch):
+        # single-flight inside the process, the first caller fetches for everyone
+        with self._fetch_lock:
+            entry = self._local
+            if self._is_valid(entry, time.time()):
+                return entry
+            return self.refresh(fetch)
+
+    def _revalidate(self, fetch, now):
+        # another process may have refreshed already
+        shared = self._shared_entry()
+        if self._is_valid(shared, now + self.refresh_margin):
+            self._local = shared
+            return
+        if self._refresh_thread is not None and self._refresh_thread.is_alive():
+            return
+        # only one process refreshes, the rest keep serving the current token
+        if not cache.add(f"{self.cache_key}:refreshing", 1, timeout=30):
+            return
+        self._refresh_thread = threading.Thread(
+            target=self._background_refresh, args=(fetch,), daemon=True
+        )
+        self._refresh_thread.start()
+
+    def _background_refresh(self, fetch):
+        try:
+            self.refresh(fetch)
+        except Exception as e:
+            logger.error(f"Background refresh of authentication token failed: {e}")
+        finally:
+            cache.delete(f"{self.cache_key}:refreshing")
+
+    def _shared_entry(self):
+        entry = cache.get(self.cache_key)
+        return entry if isinstance(entry, dict) else None
+
+    @staticmethod
+    def _is_valid(entry, at):
+        return entry is not None and entry["expires_at"] > at
+
+    def after_fork(self):
+        self._fetch_lock = threading.Lock()
+        self._refresh_thread = None
+
+
+paymob_token_manager = AuthTokenManager(getattr(settings, "PAYMOB_AUTH_CACH_KEY"))
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=paymob_token_manager.after_fork)
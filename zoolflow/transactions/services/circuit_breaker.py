@@ -0,0 +1,197 @@
+import logging
+import time
+from contextlib import asynccontextmanager, contextmanager
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+# every breaker created in this process, by name
+_registry = {}
+
+
+class CircuitOpenError(Exception):
+    # Raised when a call is refused because the endpoint's circuit is open
+    def __init__(self, name, retry_after):
+        super().__init__(f"Circuit {name} is open.")
+        self.name = name
+        self.retry_after = retry_after
+
+
+def is_upstream_failure(exc):
+    """
+    Return True when the exception tells the upstream is unhealthy.
+    Client errors (4xx other than 429) are our fault and don't count
+    """
+    if (
+        isinstance(exc, (requests.HTTPError, httpx.HTTPStatusError))
+        and exc.response is not None
+    ):
+        code = exc.response.status_code
+        return code >= 500 or code == 429
+    return isinstance(exc, (requests.RequestException, httpx.TransportError))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker whose state is shared by every process through the cache.
+
+    Calls and failures are counted in fixed windows. The circuit opens when the
+    error rate or the slow call rate of a window crosses its threshold, refuses
+    calls while open, then lets a single probe through (half open) whose
+    outcome closes or re-opens it
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.key = f"circuit:{name}"
+
+    @property
+    def config(self):
+        defaults = {
+            "window": 30,
+            "min_calls": 10,
+            "error_rate": 0.5,
+            "slow_call_seconds": 5,
+            "slow_call_rate": 0.5,
+            "open_seconds": 30,
+        }
+        return {**defaults, **getattr(settings, "PAYMOB_CIRCUIT_BREAKER", {})}
+
+    def state(self):
+        """Return the current state and the seconds left before a probe is allowed"""
+        entry = cache.get(f"{self.key}:state")
+        if not entry:
+            return CLOSED, 0
+        remaining = entry["opened_at"] + self.config["open_seconds"] - time.time()
+        if remaining > 0:
+            return OPEN, remaining
+        return HALF_OPEN, 0
+
+    def before_call(self):
+        """
+        Raise CircuitOpenError unless the call may go to the upstream.
+        Return True when the call is the half open probe
+        """
+        state, remaining = self.state()
+        if state == CLOSED:
+            return False
+        if state == HALF_OPEN and cache.add(
+            f"{self.key}:probe", 1, timeout=self.config["open_seconds"]
+        ):
+            logger.info(f"Circuit {self.name} half open, probing upstream.")
+            return True
+        raise CircuitOpenError(self.name, max(remaining, 1))
+
+    def record_success(self, duration, probe=False):
+        if probe:
+            self.close()
+            return
+        self._count(failed=False, slow=duration >= self.config["slow_call_seconds"])
+
+    def record_failure(self, probe=False):
+        if probe:
+            self.open()
+            return
+        self._count(failed=True, slow=False)
+
+    @contextmanager
+    def guard(self):
+        """Run the wrapped upstream call through the breaker"""
+        probe = self.before_call()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if is_upstream_failure(e):
+                self.record_failure(probe)
+            elif probe:
+                # upstream answered, even if it refused this request
+                self.close()
+            raise
+        self.record_success(time.monotonic() - started, probe)
+
+    @asynccontextmanager
+    async def guard_async(self):
+        """guard() for coroutines, the redis bookkeeping runs in a thread"""
+        probe = await sync_to_async(self.before_call, thread_sensitive=False)()
+        started = time.monotonic()
+        try:
+            yield
+        except Exception as e:
+            if is_upstream_failure(e):
+                await sync_to_async(self.record_failure, thread_sensitive=False)(probe)
+            elif probe:
+                await sync_to_async(self.close, thread_sensitive=False)()
+            raise
+        await sync_to_async(self.record_success, thread_sensitive=False)(
+            time.monotonic() - started, probe
+        )
+
+    def open(self):
+        cache.set(f"{self.key}:state", {"opened_at": time.time()}, timeout=None)
+        cache.delete(f"{self.key}:probe")
+        logger.error(f"Circuit {self.name} opened.")
+
+    def close(self):
+        if cache.get(f"{self.key}:state"):
+            logger.info(f"Circuit {self.name} closed.")
+        cache.delete_many([f"{self.key}:state", f"{self.key}:probe"])
+
+    def _window_key(self, counter):
+        window = self.config["window"]
+        return f"{self.key}:{int(time.time() // window)}:{counter}"
+
+    def _incr(self, counter):
+        key = self._window_key(counter)
+        cache.add(key, 0, timeout=self.config["window"] * 2)
+        return cache.incr(key)
+
+    def _count(self, failed, slow):
+        config = self.config
+        calls = self._incr("calls")
+        failures = (
+            self._incr("failures")
+            if failed
+            else cache.get(self._window_key("failures"), 0)
+        )
+        slow_calls = (
+            self._incr("slow") if slow else cache.get(self._window_key("slow"), 0)
+        )
+        if calls < config["min_calls"]:
+            return
+        if (
+            failures / calls >= config["error_rate"]
+            or slow_calls / calls >= config["slow_call_rate"]
+        ):
+            if self.state()[0] == CLOSED:
+                self.open()
+
+    def snapshot(self):
+        state, remaining = self.state()
+        return {
+            "name": self.name,
+            "state": state,
+            "retry_after": round(remaining, 2),
+            "calls": cache.get(self._window_key("calls"), 0),
+            "failures": cache.get(self._window_key("failures"), 0),
+            "slow_calls": cache.get(self._window_key("slow"), 0),
+        }
+
+
+def get_breaker(name):
+    """Return the breaker of an upstream endpoint"""
+    if name not in _registry:
+        _registry[name] = CircuitBreaker(name)
+    return _registry[name]
+
+
+def breaker_snapshots():
+    return [breaker.snapshot() for breaker in _registry.values()]
@@ -0,0 +1,56 @@
+import csv
+import json
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+# columns of a transaction export, in file order
+EXPORT_FIELDS = (
+    "id",
+    "merchant_order_id",
+    "customer_id",
+    "amount",
+    "state",
+    "payment_provider",
+    "transaction_id",
+    "order_id",
+    "created_at",
+    "updated_at",
+)
+
+
+class _Echo:
+    # file-like object handing the written line back to the csv writer caller
+    def write(self, value):
+        return value
+
+
+def export_rows(queryset):
+    """
+    Yield the export columns of the queryset rows as tuples.
+
+    Rows come through a server-side cursor in chunks, never as model instances
+    """
+    chunk_size = getattr(settings, "TRANSACTION_EXPORT_CHUNK_SIZE", 2000)
+    return (
+        queryset.order_by("id")
+        .values_list(*EXPORT_FIELDS)
+        .iterator(chunk_size=chunk_size)
+    )
+
+
+def stream_csv(queryset):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for row in export_rows(queryset):
+        yield writer.writerow(row)
+
+
+def stream_ndjson(queryset):
+    for row in export_rows(queryset):
+        yield json.dumps(dict(zip(EXPORT_FIELDS, row)), cls=DjangoJSONEncoder) + "\n"
+
+
+EXPORT_FORMATS = {
+    "csv": (stream_csv, "text/csv"),
+    "ndjson": (stream_ndjson, "application/x-ndjson"),
+}
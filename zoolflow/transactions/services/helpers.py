@@ -4,17 +4,10 @@ from ..models import Transaction
 logger = logging.getLogger(__name__)
 
 
-def retrieve_transaction_for_update(**kwargs) -> Transaction | None:
-    """
-    Retrieve a copy of transaction with select_for_update,
-    to avoid race conditions"""
-    return Transaction.objects.select_for_update().filter(**kwargs).first()
-
-
 def bring_transaction(**kwargs) -> Transaction | None:
     """Fetch transaction based on given kwargs"""
-    transaction = Transaction.objects.filter(**kwargs)
-    if not transaction.exists():
+    transaction = Transaction.objects.filter(**kwargs).first()
+    if transaction is None:
         id = (
             kwargs.get("transaction_id")
             if kwargs.get("transaction_id")
@@ -24,4 +17,17 @@ def bring_transaction(**kwargs) -> Transaction | None:
             f"Transaction with id {id} doesn't exist.",
         )
         return None
-    return transaction.first()
+    return transaction
+
+
+def transaction_email_details(transaction: Transaction) -> dict:
+    """
+    Return what the state email needs, transaction must carry customer__user
+    """
+    user = transaction.customer.user
+    return {
+        "email": user.email,
+        "username": user.username,
+        "state": transaction.state,
+        "state_display": transaction.get_state_display(),
+    }
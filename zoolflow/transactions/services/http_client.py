@@ -1,19 +1,219 @@
+import asyncio
+import os
+import threading
+import time
+import weakref
+from urllib.parse import urlsplit
+import httpx
 import requests
+from django.conf import settings
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+# only used when HTTP_CLIENT_RETRY_POLICIES isn't set, the policies live there
+DEFAULT_RETRY_POLICY = {
+    "total": 3,
+    # backoff_seconds = backoff_factor * (2 ** (retry_number - 1))
+    "backoff_factor": 1,
+    "status_forcelist": [500, 502, 503, 504, 429],
+    "allowed_methods": ["POST"],
+}
 
-def get_session_with_retries():
-    max_retry = Retry(
-        total=3,
-        # backoff_seconds = backoff_factor * (2 ** (retry_number - 1))
-        backoff_factor=1,
-        status_forcelist=[500, 502, 503, 504, 429],
-        allowed_methods=["POST"],
-    )
 
-    adapter = HTTPAdapter(max_retries=max_retry)
-    session = requests.Session()
+def _retry_policy(host):
+    """
+    Return urllib3 Retry for the host, its HTTP_CLIENT_RETRY_POLICIES
+    entry over the "default" one
+    """
+    policies = getattr(settings, "HTTP_CLIENT_RETRY_POLICIES", None)
+    if policies is None:
+        policies = {"default": DEFAULT_RETRY_POLICY}
+    return Retry(**{**policies.get("default", {}), **policies.get(host, {})})
+
+
+class PooledSession(requests.Session):
+    """
+    Session counting its requests in flight, so idle reaping never closes
+    a connection another thread is using
+    """
+
+    def __init__(self):
+        super().__init__()
+        self._in_flight_lock = threading.Lock()
+        self.in_flight = 0
+
+    def request(self, *args, **kwargs):
+        with self._in_flight_lock:
+            self.in_flight += 1
+        try:
+            return super().request(*args, **kwargs)
+        finally:
+            with self._in_flight_lock:
+                self.in_flight -= 1
+
+    def close_if_idle(self):
+        """Close the pooled connections unless a request is in flight"""
+        with self._in_flight_lock:
+            if self.in_flight:
+                return False
+            self.close()
+            return True
+
+
+def _build_session(host):
+    adapter = HTTPAdapter(
+        pool_connections=getattr(settings, "HTTP_CLIENT_POOL_CONNECTIONS", 10),
+        pool_maxsize=getattr(settings, "HTTP_CLIENT_POOL_MAXSIZE", 20),
+        max_retries=_retry_policy(host),
+    )
+    session = PooledSession()
     session.mount("https://", adapter)
     session.mount("http://", adapter)
     return session
+
+
+class SessionRegistry:
+    """
+    Process-wide registry holding one pooled keep-alive session per upstream host.
+
+    Sessions are dropped after a fork so children never share sockets with
+    their parent, and idle sessions get their connections closed before reuse.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._last_used = {}
+        self._pid = os.getpid()
+
+    def get(self, host):
+        idle_timeout = getattr(settings, "HTTP_CLIENT_IDLE_TIMEOUT", 60)
+        now = time.monotonic()
+        with self._lock:
+            if self._pid != os.getpid():
+                self._forget()
+            session = self._sessions.get(host)
+            if session is None:
+                session = self._sessions[host] = _build_session(host)
+            elif now - self._last_used[host] > idle_timeout:
+                # reap pooled connections the upstream has most likely dropped
+                session.close_if_idle()
+            self._last_used[host] = now
+            return session
+
+    def reset(self):
+        """Close and forget every pooled session"""
+        with self._lock:
+            for session in self._sessions.values():
+                session.close()
+            self._forget()
+
+    def _forget(self):
+        # never close inherited sockets, the parent process still owns them
+        self._sessions = {}
+        self._last_used = {}
+        self._pid = os.getpid()
+
+    def after_fork(self):
+        self._lock = threading.Lock()
+        self._forget()
+
+
+registry = SessionRegistry()
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=registry.after_fork)
+
+
+def get_session_with_retries(url=None):
+    """
+    Return the shared pooled session for the host of the given url
+    """
+    host = urlsplit(url).netloc if url else "default"
+    return registry.get(host or "default")
+
+
+def worst_case_call_seconds(url):
+    """
+    Return the longest a call to the url can take through the pooled
+    sessions: every attempt of its host's retry policy timing out, plus
+    the backoffs between them
+    """
+    retry = _retry_policy(urlsplit(url).netloc)
+    retries = retry.total or 0
+    timeout = getattr(settings, "CONNECTION_TIMEOUT", (5, 5))
+    if isinstance(timeout, (tuple, list)):
+        timeout = sum(timeout)
+    backoff = sum(
+        min(retry.backoff_factor * 2**n, Retry.DEFAULT_BACKOFF_MAX)
+        for n in range(retries)
+    )
+    return (retries + 1) * timeout + backoff
+
+
+def _async_timeout():
+    # CONNECTION_TIMEOUT is (connect, read) as for requests, or one number
+    timeout = getattr(settings, "CONNECTION_TIMEOUT", (5, 5))
+    if isinstance(timeout, (tuple, list)):
+        connect, read = timeout
+        return httpx.Timeout(read, connect=connect)
+    return httpx.Timeout(timeout)
+
+
+def _build_async_client():
+    limits = httpx.Limits(
+        max_connections=getattr(settings, "HTTP_ASYNC_CLIENT_MAX_CONNECTIONS", 200),
+        max_keepalive_connections=getattr(
+            settings, "HTTP_ASYNC_CLIENT_MAX_KEEPALIVE", 50
+        ),
+        keepalive_expiry=getattr(settings, "HTTP_CLIENT_IDLE_TIMEOUT", 60),
+    )
+    return httpx.AsyncClient(limits=limits, timeout=_async_timeout())
+
+
+# one pooled client per event loop, its connections can't move between loops
+_async_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_client():
+    """
+    Return the pooled httpx client shared by every coroutine of the running
+    event loop (one per ASGI worker process)
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None or client.is_closed:
+        client = _async_clients[loop] = _build_async_client()
+    return client
+
+
+async def send_with_retries(client, method, url, **kwargs):
+    """
+    Send the request through the async client, retrying as the host's
+    HTTP_CLIENT_RETRY_POLICIES would for the sync sessions: connection
+    failures always, status_forcelist answers for allowed_methods only,
+    with the same exponential backoff.
+
+    Return (response, retries), the last answer once retries are exhausted
+    """
+    # urllib3 fills in the kwargs the policy leaves out
+    policy = _retry_policy(urlsplit(url).netloc)
+    total = policy.total or 0
+    retryable = policy.allowed_methods is None or method.upper() in {
+        m.upper() for m in policy.allowed_methods
+    }
+    retries = 0
+    while True:
+        try:
+            response = await client.request(method, url, **kwargs)
+        except (httpx.ConnectError, httpx.ConnectTimeout):
+            if retries >= total:
+                raise
+        else:
+            if (
+                not retryable
+                or retries >= total
+                or response.status_code not in (policy.status_forcelist or ())
+            ):
+                return response, retries
+        retries += 1
+        await asyncio.sleep(policy.backoff_factor * (2 ** (retries - 1)))
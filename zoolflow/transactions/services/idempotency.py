@@ -0,0 +1,79 @@
+import logging
+import time
+from django.conf import settings
+from django.core.cache import cache
+from .http_client import worst_case_call_seconds
+from .locks import CacheLock
+
+logger = logging.getLogger(__name__)
+
+
+def in_flight_timeout():
+    """
+    Return IDEMPOTENCY_IN_FLIGHT_TTL, by default the longest a create can
+    take: the auth, order and payment key calls each waiting for their
+    rate budget and timing out on every retry
+    """
+    timeout = getattr(settings, "IDEMPOTENCY_IN_FLIGHT_TTL", None)
+    if timeout:
+        return timeout
+    rate_wait = getattr(settings, "PROVIDER_RATE_LIMIT_MAX_WAIT", 2)
+    urls = ("AUTH_PAYMOB_TOKEN", "ORDER_PAYMOB_URL", "PAYMOB_PAYMENT_URL_KEY")
+    return int(
+        sum(
+            rate_wait + worst_case_call_seconds(getattr(settings, url, ""))
+            for url in urls
+        )
+    )
+
+
+class IdempotentResponseCache:
+    """
+    Serialized create responses, with their status, kept in the cache per
+    (customer, Idempotency-Key).
+
+    The first request holds an in-flight marker, concurrent duplicates wait
+    for its result instead of racing it to the unique constraint
+    """
+
+    def __init__(self, customer_id, key):
+        prefix = f"transactions:idempotency:{customer_id}:{key}"
+        self.result_key = f"{prefix}:response"
+        self.in_flight = CacheLock(f"{prefix}:in-flight", timeout=in_flight_timeout())
+
+    def get(self):
+        """Return the stored {"status", "data"} of the response, or None"""
+        return cache.get(self.result_key)
+
+    def store(self, response):
+        timeout = getattr(settings, "IDEMPOTENCY_RESPONSE_TTL", 60 * 60 * 24)
+        cache.set(
+            self.result_key,
+            {"status": response.status_code, "data": response.data},
+            timeout=timeout,
+        )
+
+    def acquire(self):
+        """Return True when this request is the one allowed to create"""
+        return self.in_flight.acquire()
+
+    def release(self):
+        self.in_flight.release()
+
+    def wait(self):
+        """
+        Wait for the in-flight request to store its response.
+
+        Return the stored response, or None if it didn't show up in time
+        """
+        deadline = time.monotonic() + getattr(settings, "IDEMPOTENCY_WAIT_TIMEOUT", 5)
+        while time.monotonic() < deadline:
+            stored = self.get()
+            if stored is not None:
+                return stored
+            if cache.get(self.in_flight.key) is None:
+                # first request finished without a storable response
+                return self.get()
+            time.sleep(0.05)
+        logger.warning(f"Timed out waiting for {self.result_key}.")
+        return None
@@ -0,0 +1,68 @@
+import os
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+MERCHANT_ORDER_ID_PREFIX = "ORD-"
+DEFAULT_MERCHANT_ORDER_ID_GENERATOR = (
+    "zoolflow.transactions.services.ids.uuid7_merchant_order_id"
+)
+
+_lock = threading.Lock()
+_last_ms = 0
+_sequence = 0
+
+
+def uuid7() -> uuid.UUID:
+    """
+    Return a time-ordered UUID version 7 (RFC 9562).
+
+    48 bits of unix milliseconds lead, the 12 bits after them count the
+    ids of the same millisecond (from a random start) so ids of a process
+    keep increasing, the last 62 bits are random
+    """
+    global _last_ms, _sequence
+    with _lock:
+        now_ms = time.time_ns() // 1_000_000
+        if now_ms > _last_ms:
+            _last_ms, _sequence = now_ms, int.from_bytes(os.urandom(2)) & 0x7FF
+        else:
+            # same millisecond (or the clock went back), borrow the next one
+            # when the counter is spent
+            _sequence += 1
+            if _sequence > 0xFFF:
+                _last_ms, _sequence = _last_ms + 1, 0
+        unix_ms, sequence = _last_ms, _sequence
+    rand_b = int.from_bytes(os.urandom(8)) & 0x3FFF_FFFF_FFFF_FFFF
+    value = (
+        (unix_ms & 0xFFFF_FFFF_FFFF) << 80
+        | 0x7 << 76
+        | sequence << 64
+        | 0b10 << 62
+        | rand_b
+    )
+    return uuid.UUID(int=value)
+
+
+def uuid4_merchant_order_id():
+    """Random merchant order id, scatters inserts across the unique index"""
+    return MERCHANT_ORDER_ID_PREFIX + str(uuid.uuid4())
+
+
+def uuid7_merchant_order_id():
+    """
+    Time-ordered merchant order id, new rows land on the right edge of the
+    unique index and recent ids (the webhook lookups) share its hot pages
+    """
+    return MERCHANT_ORDER_ID_PREFIX + str(uuid7())
+
+
+def new_merchant_order_id():
+    """Return an id from the MERCHANT_ORDER_ID_GENERATOR callable"""
+    path = (
+        getattr(settings, "MERCHANT_ORDER_ID_GENERATOR", None)
+        or DEFAULT_MERCHANT_ORDER_ID_GENERATOR
+    )
+    return import_string(path)()
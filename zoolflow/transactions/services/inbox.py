@@ -0,0 +1,127 @@
+import logging
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from ..models import WebhookInbox
+from .locks import CacheLock
+from .orchestration import (
+    TransactionOrchestrationService,
+    TransactionOrchestrationServiceError,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class WebhookInboxBusy(Exception):
+    # Raised when another worker is draining the same merchant order inbox
+    pass
+
+
+def store_webhook(data, merchant_id, transaction_id, received_hmac):
+    """
+    Persist a verified webhook and queue its processing on commit.
+
+    Return False when the same webhook has already been received
+    """
+    from ..tasks import process_webhook_inbox_task
+
+    _, created = WebhookInbox.objects.get_or_create(
+        dedupe_key=received_hmac,
+        defaults={
+            "merchant_order_id": merchant_id,
+            "provider_transaction_id": str(transaction_id),
+            "payload": data,
+        },
+    )
+    if not created:
+        logger.warning(f"Webhook for transaction {transaction_id} already received.")
+        return False
+    db_transaction.on_commit(lambda: process_webhook_inbox_task.delay(merchant_id))
+    return True
+
+
+def drain_merchant_inbox(merchant_id):
+    """
+    Apply every received webhook of a merchant order, oldest first.
+
+    One worker drains a merchant order at a time so its webhooks
+    are applied in the order they arrived. Its lock is extended before
+    each webhook, a drainer that lost it stops
+    """
+    lock = CacheLock(
+        f"webhook:inbox:{merchant_id}:lock",
+        timeout=getattr(settings, "PAYMOB_WEBHOOK_INBOX_LOCK_SECONDS", 60),
+    )
+    if not lock.acquire():
+        raise WebhookInboxBusy(merchant_id)
+    try:
+        processed = 0
+        while True:
+            if not lock.extend():
+                # expired during a slow webhook, another drainer took over
+                logger.warning(f"Lost the webhook inbox lock of {merchant_id}.")
+                return processed
+            entry = (
+                WebhookInbox.objects.filter(
+                    merchant_order_id=merchant_id,
+                    status=WebhookInbox.InboxStatus.RECEIVED,
+                )
+                .order_by("id")
+                .first()
+            )
+            if entry is None:
+                return processed
+            _apply_entry(entry)
+            processed += 1
+    finally:
+        lock.release()
+
+
+def _apply_entry(entry: WebhookInbox):
+    entry.attempts += 1
+    trusted = TransactionOrchestrationService.is_webhook_payload_trusted()
+    try:
+        state = TransactionOrchestrationService.update_and_mail_state(
+            entry.merchant_order_id,
+            entry.provider_transaction_id,
+            flags=entry.payload if trusted else None,
+        )
+        if trusted:
+            TransactionOrchestrationService.sample_state_reconciliation(
+                entry.merchant_order_id, entry.provider_transaction_id, state
+            )
+    except TransactionOrchestrationServiceError as e:
+        # unknown transaction or invalid transition, retrying won't help
+        logger.error(f"Webhook {entry.id} rejected: {e.details}:{e.message}")
+        entry.status = WebhookInbox.InboxStatus.FAILED
+        entry.error = f"{e.details}:{e.message}"
+    except Exception as e:
+        max_attempts = getattr(settings, "PAYMOB_WEBHOOK_INBOX_MAX_ATTEMPTS", 5)
+        if entry.attempts < max_attempts:
+            # keep it RECEIVED so the task retry or the sweeper picks it again
+            entry.save(update_fields=["attempts"])
+            raise
+        logger.error(f"Webhook {entry.id} gave up after {entry.attempts} attempts.")
+        entry.status = WebhookInbox.InboxStatus.FAILED
+        entry.error = str(e)
+    else:
+        entry.status = WebhookInbox.InboxStatus.PROCESSED
+    entry.processed_at = timezone.now()
+    entry.save(update_fields=["attempts", "status", "error", "processed_at"])
+
+
+def stale_merchant_ids(older_than_seconds):
+    """
+    Return merchant orders whose received webhooks have waited too long
+    """
+    threshold = timezone.now() - timedelta(seconds=older_than_seconds)
+    return (
+        WebhookInbox.objects.filter(
+            status=WebhookInbox.InboxStatus.RECEIVED,
+            created_at__lt=threshold,
+        )
+        .order_by()
+        .values_list("merchant_order_id", flat=True)
+        .distinct()
+    )
@@ -0,0 +1,65 @@
+import secrets
+from django.core.cache import cache
+
+# Delete or extend the lock only while it still holds this owner's token,
+# so a holder whose lock expired can't touch the next holder's lock
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('EXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+
+def _redis():
+    """Return the redis connection of the default cache, or None"""
+    try:
+        from django_redis import get_redis_connection
+
+        return get_redis_connection("default")
+    except (ImportError, NotImplementedError):
+        return None
+
+
+class CacheLock:
+    """
+    Expiring lock in the cache, owned by the token its holder stored.
+
+    Long holders extend() it while they work. Release and extension are
+    atomic on redis, other caches (tests, dev) compare then act
+    """
+
+    def __init__(self, key, timeout):
+        self.key = key
+        self.timeout = timeout
+        # an int, stored as is by django-redis so the scripts can compare it
+        self.token = secrets.randbits(62)
+
+    def acquire(self):
+        """Return True when the lock was free and is now held"""
+        return cache.add(self.key, self.token, timeout=self.timeout)
+
+    def extend(self):
+        """Restart the timeout, return False when the lock is no longer held"""
+        return bool(self._owned_call(EXTEND_SCRIPT, self.timeout))
+
+    def release(self):
+        """Release the lock unless it expired and someone else took it"""
+        self._owned_call(RELEASE_SCRIPT)
+
+    def _owned_call(self, script, timeout=None):
+        connection = _redis()
+        if connection is not None:
+            args = [self.token] if timeout is None else [self.token, int(timeout)]
+            return connection.eval(script, 1, cache.make_key(self.key), *args)
+        if cache.get(self.key) != self.token:
+            return 0
+        if timeout is None:
+            return cache.delete(self.key)
+        return cache.touch(self.key, timeout)
@@ -0,0 +1,253 @@
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+import httpx
+import requests
+from asgiref.sync import sync_to_async
+
+logger = logging.getLogger(__name__)
+
+# upper bounds (seconds) of the provider latency histogram buckets
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 15, 30)
+
+METRICS_KEY = "metrics"
+
+
+def _number(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+
+def _labels_field(labels):
+    """Render labels as the prometheus label set, used as the storage field"""
+    return ",".join(f'{name}="{value}"' for name, value in sorted(labels.items()))
+
+
+class _LocalStore:
+    """
+    Process local metric values, used when the cache isn't redis (tests, dev)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._types = {}
+        self._values = {}
+
+    def incr(self, increments, types):
+        with self._lock:
+            self._types.update(types)
+            for (name, field), value in increments.items():
+                series = self._values.setdefault(name, {})
+                series[field] = series.get(field, 0) + value
+
+    def read(self):
+        with self._lock:
+            return dict(self._types), {
+                name: dict(series) for name, series in self._values.items()
+            }
+
+
+class _RedisStore:
+    """
+    Metric values in redis hashes, one per metric, shared by every process
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def incr(self, increments, types):
+        pipe = self.connection.pipeline(transaction=False)
+        pipe.hset(f"{METRICS_KEY}:types", mapping=types)
+        for (name, field), value in increments.items():
+            pipe.hincrbyfloat(f"{METRICS_KEY}:{name}", field, value)
+        pipe.execute()
+
+    def read(self):
+        types = {
+            k.decode(): v.decode()
+            for k, v in self.connection.hgetall(f"{METRICS_KEY}:types").items()
+        }
+        values = {}
+        for name in types:
+            series = self.connection.hgetall(f"{METRICS_KEY}:{name}")
+            values[name] = {k.decode(): float(v) for k, v in series.items()}
+        return types, values
+
+
+class MetricsRegistry:
+    """
+    Prometheus style counters and histograms aggregated across gunicorn
+    workers and celery processes through redis
+    """
+
+    def __init__(self):
+        self._store = None
+
+    @property
+    def store(self):
+        if self._store is None:
+            try:
+                from django_redis import get_redis_connection
+
+                self._store = _RedisStore(get_redis_connection("default"))
+            except (ImportError, NotImplementedError):
+                self._store = _LocalStore()
+        return self._store
+
+    def inc(self, name, labels, value=1):
+        self._write({(name, _labels_field(labels)): value}, {name: "counter"})
+
+    def observe(self, name, labels, value, buckets=LATENCY_BUCKETS):
+        increments = {
+            (f"{name}_sum", _labels_field(labels)): value,
+            (f"{name}_count", _labels_field(labels)): 1,
+        }
+        for bound in (*buckets, "+Inf"):
+            if bound == "+Inf" or value <= bound:
+                field = _labels_field({**labels, "le": bound})
+                increments[(f"{name}_bucket", field)] = 1
+        histogram = {
+            f"{name}_{part}": "histogram" for part in ("sum", "count", "bucket")
+        }
+        self._write(increments, histogram)
+
+    def _write(self, increments, types):
+        # metrics must never break the call they describe
+        try:
+            self.store.incr(increments, types)
+        except Exception as e:
+            logger.warning(f"Recording metrics failed: {e}")
+
+    def render(self, gauges=()):
+        """
+        Return the prometheus text exposition of every metric,
+        followed by the given (name, labels, value) gauges
+        """
+        types, values = self.store.read()
+        lines, declared = [], set()
+        for name in sorted(values):
+            family = types.get(name, "counter")
+            base = name.rsplit("_", 1)[0] if family == "histogram" else name
+            if base not in declared:
+                lines.append(f"# TYPE {base} {family}")
+                declared.add(base)
+            for field, value in sorted(values[name].items()):
+                lines.append(f"{name}{{{field}}} {_number(value)}")
+        for name, labels, value in gauges:
+            if name not in declared:
+                lines.append(f"# TYPE {name} gauge")
+                declared.add(name)
+            lines.append(f"{name}{{{_labels_field(labels)}}} {_number(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+
+class ProviderCall:
+    # Holds the provider response so the tracker can read status, retries and size
+    response = None
+    # set by async calls, requests responses carry their urllib3 retries
+    retries = None
+
+
+def _retries(response):
+    retries = getattr(getattr(response, "raw", None), "retries", None)
+    return len(retries.history) if retries is not None else 0
+
+
+def _outcome(exc):
+    if (
+        isinstance(exc, (requests.HTTPError, httpx.HTTPStatusError))
+        and exc.response is not None
+    ):
+        return str(exc.response.status_code), exc.response
+    if isinstance(exc, (requests.Timeout, httpx.TimeoutException)):
+        return "timeout", None
+    if isinstance(exc, requests.exceptions.RetryError):
+        return "retries_exhausted", None
+    if isinstance(exc, (requests.ConnectionError, httpx.TransportError)):
+        return "connection_error", None
+    return "error", None
+
+
+@contextmanager
+def track_provider_call(upstream, endpoint):
+    """
+    Record latency, status, retries and bytes of the wrapped provider call.
+
+    Set the response on the yielded ProviderCall for status, retries and bytes
+    """
+    call = ProviderCall()
+    started = time.perf_counter()
+    status = None
+    try:
+        yield call
+    except Exception as e:
+        status, response = _outcome(e)
+        call.response = call.response or response
+        raise
+    finally:
+        _record_call(
+            upstream,
+            endpoint,
+            time.perf_counter() - started,
+            status,
+            call.response,
+            call.retries,
+        )
+
+
+@asynccontextmanager
+async def track_provider_call_async(upstream, endpoint):
+    """track_provider_call() for coroutines, the metrics are written in a thread"""
+    call = ProviderCall()
+    started = time.perf_counter()
+    status = None
+    try:
+        yield call
+    except Exception as e:
+        status, response = _outcome(e)
+        call.response = call.response or response
+        raise
+    finally:
+        await sync_to_async(_record_call, thread_sensitive=False)(
+            upstream,
+            endpoint,
+            time.perf_counter() - started,
+            status,
+            call.response,
+            call.retries,
+        )
+
+
+def _record_call(upstream, endpoint, duration, status, response, retries=None):
+    try:
+        if status is None:
+            status = str(response.status_code) if response is not None else "ok"
+        labels = {"upstream": upstream, "endpoint": endpoint}
+        registry.observe("provider_request_duration_seconds", labels, duration)
+        registry.inc("provider_requests_total", {**labels, "status": status})
+        if response is not None:
+            if retries is None:
+                retries = _retries(response)
+            if retries:
+                registry.inc("provider_request_retries_total", labels, retries)
+            registry.inc(
+                "provider_response_bytes_total", labels, len(response.content or b"")
+            )
+            # requests keep the sent body on .body, httpx on .content
+            request = response.request
+            body = getattr(request, "body", None) or getattr(request, "content", b"")
+            registry.inc("provider_request_bytes_total", labels, len(body))
+    except Exception as e:
+        # metrics must never break the call they describe
+        logger.warning(f"Recording {endpoint} call metrics failed: {e}")
+
+
+def count_refused_call(upstream, endpoint, reason):
+    """Count a provider call refused before it was sent (open circuit, rate limit)"""
+    registry.inc(
+        "provider_requests_total",
+        {"upstream": upstream, "endpoint": endpoint, "status": reason},
+    )
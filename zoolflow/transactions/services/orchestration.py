@@ -1,8 +1,21 @@
 import logging
-from django.db import transaction as db_transaction
-from .paymob import PayMobClient, ProviderServiceError
+import random
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import connections, transaction as db_transaction
+from django.utils import timezone
+from zoolflow.customers.services.helpers import SupportedCountryError
+from .paymob import (
+    AsyncPayMobClient,
+    PayMobClient,
+    ProviderServiceError,
+    ProviderUnavailableError,
+)
+from .payloads import PaymentContext
 from ..models import Transaction
-from .helpers import retrieve_transaction_for_update
+from .helpers import transaction_email_details
 
 logger = logging.getLogger(__name__)
 
@@ -19,6 +32,73 @@ class TransactionOrchestrationService:
     def __init__(self, customer):
         self.customer = customer
 
+    @staticmethod
+    def is_asynchronous():
+        """
+        Return True when provider interaction runs on a celery worker
+        instead of the request that created the transaction
+        """
+        return getattr(settings, "TRANSACTION_ORCHESTRATION_ASYNC", False)
+
+    @staticmethod
+    def is_payment_key_lazy():
+        """
+        Return True when the payment key is requested by the checkout
+        instead of the transaction creation
+        """
+        return getattr(settings, "PAYMOB_LAZY_PAYMENT_KEY", False)
+
+    @staticmethod
+    def _payment_key_expiry():
+        lifetime = getattr(settings, "PAYMOB_PAYMENT_KEY_LIFETIME", 60 * 50)
+        return timezone.now() + timedelta(seconds=lifetime)
+
+    def checkout_payment_token(self, transaction: Transaction):
+        """
+        Return a payment token of the PENDING transaction for the checkout iframe.
+
+        The stored token is reused until it expires, otherwise a new one is
+        requested from PayMob and stored on the transaction.
+        Raise ProviderUnavailableError while PayMob can't be called
+        """
+        merchant_id = transaction.merchant_order_id
+        pending = Transaction.TransactionState.PENDING
+        # before the reuse, a settled transaction may still hold an unexpired key
+        if transaction.state != pending or not transaction.order_id:
+            raise TransactionOrchestrationServiceError(
+                f"Transaction {merchant_id} can't be paid while {transaction.state}.",
+                details="Checkout",
+            )
+        expires_at = transaction.payment_token_expires_at
+        if transaction.payment_token and expires_at and expires_at > timezone.now():
+            return transaction.payment_token
+
+        provider = PayMobClient(
+            customer=self.customer, amount_cents=int(transaction.amount * 100)
+        )
+        try:
+            payment_token = provider.payment_key_token(order_id=transaction.order_id)
+        except ProviderUnavailableError:
+            raise
+        except ProviderServiceError as e:
+            raise TransactionOrchestrationServiceError(e.message, details="Provider")
+
+        expires_at = self._payment_key_expiry()
+        # paid or failed in the meantime, the key is useless
+        updated = Transaction.objects.filter(id=transaction.id, state=pending).update(
+            payment_token=payment_token,
+            payment_token_expires_at=expires_at,
+            updated_at=timezone.now(),
+        )
+        if not updated:
+            raise TransactionOrchestrationServiceError(
+                f"Transaction {merchant_id} is no longer pending.", details="Checkout"
+            )
+        transaction.payment_token = payment_token
+        transaction.payment_token_expires_at = expires_at
+        logger.info(f"Payment key of transaction {merchant_id} requested at checkout.")
+        return payment_token
+
     def create_transaction(self, validated_data):
         """
         Create transaction with approbiate filed,
@@ -39,6 +119,15 @@ class TransactionOrchestrationService:
                 f"Transaction {transaction.merchant_order_id} created successfully."
             ).replace("\n", "")
         )
+        if self.is_asynchronous():
+            from ..tasks import orchestrate_transaction_task
+
+            # Leave the row INITIATED, the orchestration worker moves it to PENDING
+            db_transaction.on_commit(
+                lambda: orchestrate_transaction_task.delay(transaction.id),
+            )
+            return transaction
+
         # Interact with provider to create order and payment token on commit
         db_transaction.on_commit(
             lambda: self._interact_with_provider(transaction),
@@ -46,7 +135,126 @@ class TransactionOrchestrationService:
         transaction.refresh_from_db()
         return transaction
 
-    def _interact_with_provider(self, transaction: Transaction):
+    async def create_transaction_async(self, validated_data):
+        """
+        create_transaction for the async views. The provider is called on the
+        event loop, only the database work runs in the sync thread
+        """
+        transaction = await Transaction.objects.acreate(
+            customer=self.customer, **validated_data
+        )
+        logger.info(
+            f"Transaction {transaction.merchant_order_id} created successfully."
+        )
+        if self.is_asynchronous():
+            from ..tasks import orchestrate_transaction_task
+
+            # publishing to the broker blocks, keep it off the event loop
+            await sync_to_async(orchestrate_transaction_task.delay)(transaction.id)
+            return transaction
+
+        await self._interact_with_provider_async(transaction)
+        await transaction.arefresh_from_db()
+        return transaction
+
+    def create_transactions(self, items):
+        """
+        Create a batch of transactions with one insert, then interact with
+        the provider for all of them concurrently.
+
+        Items are validated data, optionally holding an idempotency_key.
+        Items whose key already exists are replayed, not created again.
+        Return (transaction, replayed, error) per item, in items order
+        """
+        keys = [
+            item["idempotency_key"] for item in items if item.get("idempotency_key")
+        ]
+        existing = {}
+        if keys:
+            existing = {
+                tx.idempotency_key: tx
+                for tx in Transaction.objects.filter(
+                    customer=self.customer, idempotency_key__in=keys
+                )
+            }
+        new = [
+            Transaction(customer=self.customer, **item)
+            for item in items
+            if item.get("idempotency_key") not in existing
+        ]
+        with db_transaction.atomic():
+            Transaction.objects.bulk_create(new)
+        logger.info(
+            f"{len(new)} transaction(s) created for customer with ID {self.customer.id}, "
+            f"{len(items) - len(new)} replayed."
+        )
+
+        errors = {}
+        if new and self.is_asynchronous():
+            from ..tasks import orchestrate_transaction_task
+
+            for tx in new:
+                db_transaction.on_commit(
+                    lambda pk=tx.id: orchestrate_transaction_task.delay(pk)
+                )
+        elif new:
+            errors = self._interact_with_provider_many(new)
+            new = list(Transaction.objects.in_bulk([tx.id for tx in new]).values())
+
+        created = iter(sorted(new, key=lambda tx: tx.id))
+        results = []
+        for item in items:
+            key = item.get("idempotency_key")
+            if key in existing:
+                results.append((existing[key], True, None))
+            else:
+                tx = next(created)
+                results.append((tx, False, errors.get(tx.id)))
+        return results
+
+    def _interact_with_provider_many(self, transactions):
+        """
+        Interact with PayMob for many transactions of this customer on a
+        bounded worker pool.
+
+        Return {transaction id: TransactionOrchestrationServiceError} for the failed ones
+        """
+        max_workers = getattr(settings, "TRANSACTION_BATCH_MAX_WORKERS", 8)
+        try:
+            # shared by every worker instead of being rebuilt per transaction
+            context = PaymentContext.for_customer(self.customer)
+            # a valid token up front, so workers don't queue behind its fetch
+            PayMobClient(context=context)._get_auth_token()
+        except (SupportedCountryError, ProviderServiceError) as e:
+            logger.error(f"Batch orchestration setup failed: {e.message}")
+            # every transaction reports (and fails on) the error by itself
+            context = None
+
+        def orchestrate(tx):
+            try:
+                self._interact_with_provider(tx, context=context)
+            except TransactionOrchestrationServiceError as e:
+                return e
+            return None
+
+        def orchestrate_in_thread(tx):
+            try:
+                return orchestrate(tx)
+            finally:
+                connections.close_all()
+
+        if max_workers <= 1:
+            outcomes = [orchestrate(tx) for tx in transactions]
+        else:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                outcomes = list(executor.map(orchestrate_in_thread, transactions))
+        return {
+            tx.id: error
+            for tx, error in zip(transactions, outcomes)
+            if error is not None
+        }
+
+    def _interact_with_provider(self, transaction: Transaction, context=None):
         """
         Interact with PayMob to create order and payment keym
         and set them in transaction passed object
@@ -56,62 +264,152 @@ class TransactionOrchestrationService:
         provider = PayMobClient(
             customer=self.customer,
             amount_cents=amount_cents,
+            context=context,
         )
+        # kept from an earlier deferred attempt, PayMob rejects a second order
+        order_id = transaction.order_id
         try:
             # Create order and payment key token with provider
             # Return order id and payment token
-            order_id = provider.create_order(merchant_id=merchant_id)
-            payment_token = provider.payment_key_token(order_id=order_id)
+            if not order_id:
+                order_id = provider.create_order(merchant_id=merchant_id)
+            # lazily, the checkout requests the payment key when it opens
+            payment_token = None
+            if not self.is_payment_key_lazy():
+                payment_token = provider.payment_key_token(order_id=order_id)
             # Update transaction fields with provider returned values
             TransactionOrchestrationService._define_provider_attribute(
                 transaction, order_id, payment_token
             )
+        except ProviderUnavailableError as e:
+            if getattr(settings, "PAYMOB_CIRCUIT_OPEN_DEFER", True):
+                self._defer_orchestration(transaction, e.retry_after, order_id)
+                return
+            self._fail_on_provider_error(transaction, e)
         except ProviderServiceError as e:
-            with db_transaction.atomic():
-                tx = retrieve_transaction_for_update(id=transaction.id)
-                if not tx:
-                    raise TransactionOrchestrationServiceError(
-                        "Transaction was not found while handling provider failure.",
-                        details="Transaction",
-                    )
-                try:
-                    tx.transition_to(Transaction.TransactionState.FAILED)
-                except ValueError as exc:
-                    raise TransactionOrchestrationServiceError(
-                        str(exc),
-                        details="Transition",
-                    )
-                tx.save(update_fields=["state"])
-            logger.error(
-                f"Transaction {merchant_id} failed during provider interaction: {e.message}"
+            self._fail_on_provider_error(transaction, e)
+
+    async def _interact_with_provider_async(self, transaction: Transaction):
+        """
+        _interact_with_provider through AsyncPayMobClient
+        """
+        try:
+            context = await sync_to_async(PaymentContext.for_customer)(self.customer)
+        except SupportedCountryError as e:
+            # as the sync client reports a payload it can't build, raises
+            await sync_to_async(self._fail_on_provider_error)(
+                transaction,
+                ProviderServiceError("Failed to handle order payload", e.message),
             )
-            raise TransactionOrchestrationServiceError(
-                details="Provider interaction failed", message=e.message
+        provider = AsyncPayMobClient(
+            amount_cents=int(transaction.amount * 100), context=context
+        )
+        order_id = transaction.order_id
+        try:
+            if not order_id:
+                order_id = await provider.create_order(
+                    merchant_id=transaction.merchant_order_id
+                )
+            payment_token = None
+            if not self.is_payment_key_lazy():
+                payment_token = await provider.payment_key_token(order_id=order_id)
+            await sync_to_async(self._define_provider_attribute)(
+                transaction, order_id, payment_token
             )
+        except ProviderUnavailableError as e:
+            if getattr(settings, "PAYMOB_CIRCUIT_OPEN_DEFER", True):
+                await sync_to_async(self._defer_orchestration)(
+                    transaction, e.retry_after, order_id
+                )
+                return
+            await sync_to_async(self._fail_on_provider_error)(transaction, e)
+        except ProviderServiceError as e:
+            await sync_to_async(self._fail_on_provider_error)(transaction, e)
+
+    @staticmethod
+    def _defer_orchestration(transaction, retry_after, order_id=None):
+        """
+        Leave the transaction INITIATED and orchestrate it again on the
+        worker once the provider circuit may accept calls
+        """
+        from ..tasks import orchestrate_transaction_task
+
+        if order_id and order_id != transaction.order_id:
+            Transaction.objects.filter(id=transaction.id).update(order_id=order_id)
+        countdown = max(int(retry_after or 0), 1)
+        logger.warning(
+            f"Provider unavailable, transaction {transaction.merchant_order_id} "
+            f"orchestration deferred by {countdown}s."
+        )
+        db_transaction.on_commit(
+            lambda: orchestrate_transaction_task.apply_async(
+                (transaction.id,), countdown=countdown
+            )
+        )
+
+    @staticmethod
+    def _fail_on_provider_error(transaction, e):
+        """
+        Move the transaction to FAILED after a provider error and raise it
+        as an orchestration error
+        """
+        merchant_id = transaction.merchant_order_id
+        failed = Transaction.TransactionState.FAILED
+        queryset = Transaction.objects.filter(id=transaction.id)
+        if not queryset.transition(failed):
+            TransactionOrchestrationService._transition_conflict(
+                queryset,
+                failed,
+                "Transaction was not found while handling provider failure.",
+            )
+        logger.error(
+            f"Transaction {merchant_id} failed during provider interaction: {e.message}"
+        )
+        raise TransactionOrchestrationServiceError(
+            details="Provider interaction failed", message=e.message
+        )
 
     @staticmethod
     def _define_provider_attribute(transaction, provider_id, payment_token):
         """
         Set provider related fields in transaction instance
         """
-        with db_transaction.atomic():
-            tx = retrieve_transaction_for_update(id=transaction.id)
-            if not tx:
-                raise TransactionOrchestrationServiceError(
-                    "Transaction was not found while storing provider fields.",
-                    details="Transaction",
-                )
-            tx.order_id = provider_id
-            tx.payment_token = payment_token
-            try:
-                tx.transition_to(Transaction.TransactionState.PENDING)
-            except ValueError as exc:
-                raise TransactionOrchestrationServiceError(
-                    str(exc),
-                    details="Transition",
-                )
-            tx.save(update_fields=["order_id", "payment_token", "state"])
-        logger.info(f"Transaction {tx.merchant_order_id} updated with provider fields.")
+        pending = Transaction.TransactionState.PENDING
+        queryset = Transaction.objects.filter(id=transaction.id)
+        updated = queryset.transition(
+            pending,
+            order_id=provider_id,
+            payment_token=payment_token,
+            payment_token_expires_at=(
+                TransactionOrchestrationService._payment_key_expiry()
+                if payment_token
+                else None
+            ),
+        )
+        if not updated:
+            TransactionOrchestrationService._transition_conflict(
+                queryset,
+                pending,
+                "Transaction was not found while storing provider fields.",
+            )
+        logger.info(
+            f"Transaction {transaction.merchant_order_id} updated with provider fields."
+        )
+
+    @staticmethod
+    def _transition_conflict(queryset, next_state, missing_message):
+        """
+        Raise the error of a conditional transition that updated no row,
+        reading the row to tell a missing transaction from a refused transition
+        """
+        tx = queryset.only("state").first()
+        if not tx:
+            raise TransactionOrchestrationServiceError(
+                missing_message, details="Transaction"
+            )
+        raise TransactionOrchestrationServiceError(
+            f"invalid transition {tx.state} -> {next_state}", details="Transition"
+        )
 
     @staticmethod
     def transaction_current_state(transaction_id):
@@ -120,6 +418,13 @@ class TransactionOrchestrationService:
         """
 
         current_data = PayMobClient().get_transaction_flags(transaction_id)
+        return TransactionOrchestrationService.state_from_flags(current_data)
+
+    @staticmethod
+    def state_from_flags(current_data):
+        """
+        Map PayMob transaction flags to our transaction state
+        """
         # check fail at gateway level
         error_occured = current_data["error_occured"]
         if error_occured:
@@ -152,9 +457,35 @@ class TransactionOrchestrationService:
         return Transaction.TransactionState.FAILED
 
     @staticmethod
-    def update_and_mail_state(merchant_id, transaction_id):
+    def is_webhook_payload_trusted():
+        """
+        Return True when HMAC verified webhook flags are used as the state source
+        """
+        return getattr(settings, "PAYMOB_TRUST_WEBHOOK_PAYLOAD", True)
+
+    @staticmethod
+    def sample_state_reconciliation(merchant_id, transaction_id, state):
+        """
+        Queue a check of a sample of webhook derived states against PayMob
+        """
+        from ..tasks import reconcile_webhook_state_task
+
+        rate = getattr(settings, "PAYMOB_WEBHOOK_RECONCILE_SAMPLE_RATE", 0)
+        if state is None or random.random() >= rate:
+            return
+        db_transaction.on_commit(
+            lambda: reconcile_webhook_state_task.delay(
+                merchant_id, transaction_id, state
+            )
+        )
+
+    @staticmethod
+    def update_and_mail_state(merchant_id, transaction_id, flags=None):
         """
-        Update transaction id, state and forward these update to the user email
+        Update transaction id, state and forward these update to the user email.
+
+        The state is derived from flags when given (verified webhook body),
+        otherwise from the provider. Return the derived state
         """
 
         from zoolflow.notifications.tasks import transaction_state_email_task
@@ -165,34 +496,34 @@ class TransactionOrchestrationService:
                 details="Transaction",
             )
 
-        state = TransactionOrchestrationService.transaction_current_state(
-            transaction_id
-        )
-        with db_transaction.atomic():
-            tx = retrieve_transaction_for_update(merchant_order_id=merchant_id)
-            if not tx:
-                raise TransactionOrchestrationServiceError(
-                    f"Transaction {merchant_id} does not exist.",
-                    details="Transaction",
-                )
-
-            is_same_state = tx.state == state
-            is_same_provider_txn = str(tx.transaction_id) == str(transaction_id)
-            if is_same_state and is_same_provider_txn:
+        if flags is not None:
+            state = TransactionOrchestrationService.state_from_flags(flags)
+        else:
+            state = TransactionOrchestrationService.transaction_current_state(
+                transaction_id
+            )
+        transaction_id = str(transaction_id)
+        queryset = Transaction.objects.filter(merchant_order_id=merchant_id)
+        # a duplicate webhook (same state and provider transaction) matches no row
+        updated = queryset.exclude(
+            state=state, transaction_id=transaction_id
+        ).transition(state, transaction_id=transaction_id)
+        if not updated:
+            tx = queryset.only("state", "transaction_id").first()
+            if tx and tx.state == state and tx.transaction_id == transaction_id:
                 logger.warning(
                     f"Transaction {transaction_id} already processed with state {tx.state}",
                 )
-                return
-            try:
-                tx.transition_to(state)
-            except ValueError as exc:
-                raise TransactionOrchestrationServiceError(
-                    str(exc),
-                    details="Transition",
-                )
-            tx.transaction_id = transaction_id
-            tx.save(update_fields=["state", "transaction_id"])
-            logger.info(f"Transaction {tx.transaction_id} updated to {tx.state}.")
+                return state
+            TransactionOrchestrationService._transition_conflict(
+                queryset, state, f"Transaction {merchant_id} does not exist."
+            )
+        logger.info(f"Transaction {transaction_id} updated to {state}.")
+        # customer and user for the notification payload
+        tx = queryset.select_related("customer__user").get()
+        tx.state = state
+        details = transaction_email_details(tx)
         db_transaction.on_commit(
-            lambda: transaction_state_email_task.delay(transaction_id)
+            lambda: transaction_state_email_task.delay(transaction_id, details)
         )
+        return state
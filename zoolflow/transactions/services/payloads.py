@@ -1,34 +1,76 @@
+import logging
+from dataclasses import dataclass
 from django.conf import settings
-from zoolflow.customers.services.helpers import currency_and_address
+from zoolflow.customers.models import Address, Customer
+from zoolflow.customers.services.helpers import (
+    SupportedCountryError,
+    currency_for_address,
+)
 
+logger = logging.getLogger(__name__)
 
-def order_payload(amount_cents, token, merchant_id, customer):
+
+@dataclass(frozen=True)
+class PaymentContext:
+    """
+    Customer, user and main address data shared by the provider payloads
+    """
+
+    customer: Customer
+    address: Address
+    currency: str
+
+    @classmethod
+    def for_customer(cls, customer):
+        """
+        Build the context with a single query joining the main address,
+        its customer and the customer's user
+        """
+        address = (
+            Address.objects.select_related("customer__user")
+            .filter(customer_id=customer.id, main_address=True)
+            .first()
+        )
+        if not address:
+            logger.error(
+                f"There is no main address specified for customer {customer.id}."
+            )
+            raise SupportedCountryError(
+                message="There is no main address specified", details="Address"
+            )
+        return cls(
+            customer=address.customer,
+            address=address,
+            currency=currency_for_address(address),
+        )
+
+
+def order_payload(amount_cents, token, merchant_id, context: PaymentContext):
     """
     Set payload for creating an order in provider
     """
 
-    currency, _ = currency_and_address(customer)
     payload = {
         "auth_token": token,
         "delivery_needed": "false",
         "merchant_order_id": merchant_id,
         "amount_cents": amount_cents,
-        "currency": currency,
+        "currency": context.currency,
         "items": [],
     }
     return payload
 
 
-def payment_token_payload(amount_cents, token, order_id, customer):
+def payment_token_payload(amount_cents, token, order_id, context: PaymentContext):
     """
     Set payload for requesting the payment key token
     """
 
-    currency, address = currency_and_address(customer=customer)
+    customer, address = context.customer, context.address
     payload = {
         "auth_token": token,
         "amount_cents": amount_cents,
-        "currency": currency,
+        "currency": context.currency,
         "order_id": order_id,
         "billing_data": {
             "apartment": address.apartment_number or "NA",
@@ -1,12 +1,20 @@
 import logging
+import httpx
 import requests
 import json
-import time
-from django.core.cache import cache
+from contextlib import contextmanager, nullcontext
+from asgiref.sync import sync_to_async
 from django.conf import settings
-from redis.exceptions import LockError
-from .http_client import get_session_with_retries
-from .payloads import order_payload, payment_token_payload
+from .auth_token import paymob_token_manager
+from .circuit_breaker import CircuitOpenError, get_breaker
+from .rate_limiter import RateLimitExceeded, get_limiter
+from .http_client import get_async_client, get_session_with_retries, send_with_retries
+from .metrics import (
+    count_refused_call,
+    track_provider_call,
+    track_provider_call_async,
+)
+from .payloads import PaymentContext, order_payload, payment_token_payload
 
 logger = logging.getLogger(__name__)
 
@@ -19,25 +27,97 @@ class ProviderServiceError(Exception):
         self.details = details
 
 
+class ProviderUnavailableError(ProviderServiceError):
+    # Raised without calling the provider while its endpoint circuit is open
+    # or its rate budget is spent, retry_after tells when to try again
+    def __init__(self, message, details=None, retry_after=None):
+        super().__init__(message, details)
+        self.retry_after = retry_after
+
+
+# one breaker per PayMob endpoint, a failing endpoint doesn't block the others
+AUTH_BREAKER = get_breaker("paymob:auth")
+ORDER_BREAKER = get_breaker("paymob:order")
+PAYMENT_KEY_BREAKER = get_breaker("paymob:payment_key")
+TRANSACTION_BREAKER = get_breaker("paymob:transaction")
+INQUIRY_BREAKER = get_breaker("paymob:inquiry")
+
+
+def _refusal(e, endpoint):
+    """
+    Count the open circuit or spent rate budget refusal e of a call and
+    return it as ProviderUnavailableError
+    """
+    if isinstance(e, CircuitOpenError):
+        logger.warning(f"Circuit {e.name} open, provider call skipped.")
+        count_refused_call("paymob", endpoint, "circuit_open")
+        message = "provider temporarily unavailable"
+    else:
+        count_refused_call("paymob", endpoint, "rate_limited")
+        message = "provider rate limit reached"
+    return ProviderUnavailableError(message, details=e.name, retry_after=e.retry_after)
+
+
+@contextmanager
+def _refused_calls(endpoint):
+    """
+    Raise the open circuit and spent rate budget refusals of the wrapped
+    call as ProviderUnavailableError, counted as refused calls
+    """
+    try:
+        yield
+    except (CircuitOpenError, RateLimitExceeded) as e:
+        raise _refusal(e, endpoint)
+
+
 class PayMobClient:
     def __init__(self, *args, **kwargs):
         self.customer = kwargs.get("customer", None)
         self.amount_cents = kwargs.get("amount_cents", None)
-        self.session = get_session_with_retries()
+        self.context = kwargs.get("context", None)
+        self.session = get_session_with_retries(getattr(settings, "ORDER_PAYMOB_URL"))
+
+    def _payment_context(self) -> PaymentContext:
+        """
+        Return the payment context, built once and reused by every payload
+        """
+        if self.context is None:
+            self.context = PaymentContext.for_customer(self.customer)
+        return self.context
+
+    def _send(self, breaker, method, url, **kwargs):
+        """
+        Send a request through the endpoint rate limiter and circuit breaker.
+
+        Return the response, raising requests errors for non 2xx answers
+        and ProviderUnavailableError, without any call, while the circuit is open
+        or the endpoint budget stays spent past the wait deadline
+        """
+        endpoint = breaker.name if breaker else "paymob"
+        with _refused_calls(endpoint):
+            if breaker:
+                # the endpoint budget is named after its breaker
+                get_limiter(breaker.name).acquire()
+            with breaker.guard() if breaker else nullcontext():
+                with track_provider_call("paymob", endpoint) as call:
+                    response = call.response = getattr(self.session, method)(
+                        url=url,
+                        timeout=getattr(settings, "CONNECTION_TIMEOUT", (5, 5)),
+                        **kwargs,
+                    )
+                    response.raise_for_status()
+        return response
 
-    def _request_field(self, payload, endpoint, requested_field, field_name):
+    def _request_field(
+        self, payload, endpoint, requested_field, field_name, breaker=None
+    ):
         """
         It's a POST request pattern.
 
         Return the requested field from the endpoint provided
         """
         try:
-            response = self.session.post(
-                url=endpoint,
-                json=payload,
-                timeout=getattr(settings, "CONNECTION_TIMEOUT", (5, 5)),
-            )
-            response.raise_for_status()
+            response = self._send(breaker, "post", endpoint, json=payload)
 
             data = response.json()
             result = data.get(requested_field)
@@ -59,46 +139,28 @@ class PayMobClient:
     def _get_auth_token(self):
         """
         Return the PayMob authentication token.
-        By passing there API key
-        """
-        # loop to handle worker's who didn't acquire lock
-        for retries in range(3):
-            cache_key = getattr(settings, "PAYMOB_AUTH_CACH_KEY")
-            # check for existing token in cache
-            token = cache.get(cache_key)
-            if token:
-                logger.info("provider authentication token returned.")
-                return token
-            try:
-                # lock to prevent race-condition with workers
-                with cache.lock(f"{cache_key}:lock", timeout=15, blocking_timeout=2):
-                    # check if their is a worker fetch the token yet
-                    token = cache.get(cache_key)
-                    if token:
-                        logger.info("provider authentication token returned.")
-                        return token
-                    # request for the token
-                    payload = {"api_key": getattr(settings, "PAYMOB_API_KEY")}
-                    token = self._request_field(
-                        payload=payload,
-                        endpoint=getattr(settings, "AUTH_PAYMOB_TOKEN"),
-                        requested_field="token",
-                        field_name="authentication token",
-                    )
+        Served from the token manager, which refreshes it ahead of expiry
+        """
+        return paymob_token_manager.get_token(self._fetch_auth_token)
 
-                    timeout = getattr(settings, "CACHE_LIFETIME")
-                    cache.set(cache_key, token, timeout=timeout)
-                    return token
+    def refresh_auth_token(self):
+        """
+        Fetch a fresh authentication token and share it with every worker
+        """
+        return paymob_token_manager.refresh(self._fetch_auth_token)["token"]
 
-            except LockError:
-                if retries >= 2:
-                    logger.error(
-                        "Failed to acquire lock for payment authentication token."
-                    )
-                    raise ProviderServiceError(
-                        "Failed to acquire lock for authentication token."
-                    )
-                time.sleep(0.5)
+    def _fetch_auth_token(self):
+        """
+        Request a new authentication token by passing our API key
+        """
+        payload = {"api_key": getattr(settings, "PAYMOB_API_KEY")}
+        return self._request_field(
+            payload=payload,
+            endpoint=getattr(settings, "AUTH_PAYMOB_TOKEN"),
+            requested_field="token",
+            field_name="authentication token",
+            breaker=AUTH_BREAKER,
+        )
 
     def create_order(self, merchant_id):
         """
@@ -113,8 +175,11 @@ class PayMobClient:
                 self.amount_cents,
                 token,
                 merchant_id,
-                self.customer,
+                self._payment_context(),
             )
+        except ProviderUnavailableError:
+            # token endpoint circuit is open, keep the retry hint
+            raise
         except Exception as e:
             logger.error("failed on configure order payload")
             raise ProviderServiceError("Failed to handle order payload", str(e))
@@ -124,6 +189,7 @@ class PayMobClient:
             endpoint=getattr(settings, "ORDER_PAYMOB_URL"),
             requested_field="id",
             field_name="order ID",
+            breaker=ORDER_BREAKER,
         )
         return order_id
 
@@ -137,8 +203,11 @@ class PayMobClient:
                 self.amount_cents,
                 token,
                 order_id,
-                self.customer,
+                self._payment_context(),
             )
+        except ProviderUnavailableError:
+            # token endpoint circuit is open, keep the retry hint
+            raise
         except Exception as e:
             logger.error("failed on configure payment token payload")
             raise ProviderServiceError("Failed to handle payment token payload", str(e))
@@ -148,6 +217,7 @@ class PayMobClient:
             endpoint=getattr(settings, "PAYMOB_PAYMENT_URL_KEY"),
             requested_field="token",
             field_name="payment token",
+            breaker=PAYMENT_KEY_BREAKER,
         )
 
         return payment_token
@@ -162,10 +232,9 @@ class PayMobClient:
         header = {
             "Authorization": f"Bearer {token}",
         }
-        url = f"https://accept.paymob.com/api/acceptance/transactions/{transaction_id}"
+        url = f"{getattr(settings, 'PAYMOB_TRANSACTIONS_URL')}{transaction_id}"
         try:
-            response = self.session.get(url=url, headers=header)
-            response.raise_for_status()
+            response = self._send(TRANSACTION_BREAKER, "get", url, headers=header)
         except requests.RequestException as e:
             logger.error("Provider fail to return transaction current state")
             raise ProviderServiceError(
@@ -173,3 +242,145 @@ class PayMobClient:
             )
         data = json.loads(response.content)
         return data
+
+    def inquire_order_transaction(self, order_id):
+        """
+        Return the latest transaction (flags) PayMob holds for an order.
+
+        Used when no webhook told us the provider transaction ID yet
+        """
+        payload = {"auth_token": self._get_auth_token(), "order_id": order_id}
+        try:
+            response = self._send(
+                INQUIRY_BREAKER,
+                "post",
+                getattr(settings, "PAYMOB_INQUIRY_URL"),
+                json=payload,
+            )
+        except requests.RequestException as e:
+            logger.error(f"Provider fail to return order {order_id} transaction")
+            raise ProviderServiceError(
+                "Provider fail to return order transaction", str(e)
+            )
+        return response.json()
+
+
+class AsyncPayMobClient:
+    """
+    PayMobClient for the async views. Calls share the event loop's pooled
+    httpx client, so a slow PayMob answer holds a coroutine, not a worker.
+
+    The payment context is built by the caller (it reads the database).
+    Breakers, rate budgets and metrics are the ones of PayMobClient, their
+    redis round trips run in threads
+    """
+
+    def __init__(self, amount_cents=None, context: PaymentContext = None):
+        self.amount_cents = amount_cents
+        self.context = context
+
+    async def _send(self, breaker, method, url, **kwargs):
+        """
+        PayMobClient._send for coroutines, raising httpx errors
+        for non 2xx answers
+        """
+        endpoint = breaker.name if breaker else "paymob"
+        try:
+            if breaker:
+                await get_limiter(breaker.name).acquire_async()
+            async with breaker.guard_async() if breaker else nullcontext():
+                async with track_provider_call_async("paymob", endpoint) as call:
+                    response, call.retries = await send_with_retries(
+                        get_async_client(), method, url, **kwargs
+                    )
+                    call.response = response
+                    response.raise_for_status()
+        except (CircuitOpenError, RateLimitExceeded) as e:
+            raise await sync_to_async(_refusal, thread_sensitive=False)(e, endpoint)
+        return response
+
+    async def _request_field(
+        self, payload, endpoint, requested_field, field_name, breaker=None
+    ):
+        try:
+            response = await self._send(breaker, "POST", endpoint, json=payload)
+            result = response.json().get(requested_field)
+        # ValueError: an answer that isn't JSON, as requests' JSONDecodeError
+        except (httpx.HTTPError, ValueError) as pe:
+            logger.error(f"Provider failed with error: {str(pe)}")
+            raise ProviderServiceError("provider API fail", details=str(pe))
+        if not result:
+            logger.error(f"No {field_name} returned from provider.")
+            raise ProviderServiceError(
+                f"The API did not return the {field_name}.",
+                f"{field_name.capitalize()}",
+            )
+        logger.info(f"{field_name} has been successfully returned.")
+        return result
+
+    async def _get_auth_token(self):
+        # fetched (rarely) through the sync client, in a thread
+        return await paymob_token_manager.get_token_async(
+            PayMobClient()._fetch_auth_token
+        )
+
+    async def create_order(self, merchant_id):
+        """
+        Return order ID from provider.
+
+        Raises:
+            ProviderServiceError if the API fails or returns no order ID.
+        """
+        token = await self._get_auth_token()
+        try:
+            payload = order_payload(self.amount_cents, token, merchant_id, self.context)
+        except Exception as e:
+            logger.error("failed on configure order payload")
+            raise ProviderServiceError("Failed to handle order payload", str(e))
+        return await self._request_field(
+            payload=payload,
+            endpoint=getattr(settings, "ORDER_PAYMOB_URL"),
+            requested_field="id",
+            field_name="order ID",
+            breaker=ORDER_BREAKER,
+        )
+
+    async def payment_key_token(self, order_id):
+        """
+        Return the payment token specialized to who pay. Used to return an iframe
+        """
+        token = await self._get_auth_token()
+        try:
+            payload = payment_token_payload(
+                self.amount_cents, token, order_id, self.context
+            )
+        except Exception as e:
+            logger.error("failed on configure payment token payload")
+            raise ProviderServiceError("Failed to handle payment token payload", str(e))
+        return await self._request_field(
+            payload=payload,
+            endpoint=getattr(settings, "PAYMOB_PAYMENT_URL_KEY"),
+            requested_field="token",
+            field_name="payment token",
+            breaker=PAYMENT_KEY_BREAKER,
+        )
+
+    async def get_transaction_flags(self, transaction_id):
+        """
+        Return transaction status(flags) from paymob
+        """
+        token = await self._get_auth_token()
+        url = f"{getattr(settings, 'PAYMOB_TRANSACTIONS_URL')}{transaction_id}"
+        try:
+            response = await self._send(
+                TRANSACTION_BREAKER,
+                "GET",
+                url,
+                headers={"Authorization": f"Bearer {token}"},
+            )
+        except httpx.HTTPError as e:
+            logger.error("Provider fail to return transaction current state")
+            raise ProviderServiceError(
+                "Provider fail to return transaction current state", str(e)
+            )
+        return response.json()
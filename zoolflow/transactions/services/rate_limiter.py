@@ -0,0 +1,158 @@
+import asyncio
+import logging
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Refill the bucket for the time elapsed since its last use, then take the
+# requested tokens. Return 0 when granted, or the seconds until they are.
+# Time comes from redis so every host agrees on it.
+TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(bucket[1]) or burst
+local ts = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+local wait = 0
+if tokens >= requested then
+    tokens = tokens - requested
+else
+    wait = (requested - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return tostring(wait)
+"""
+
+# every limiter created in this process, by name
+_registry = {}
+
+
+class RateLimitExceeded(Exception):
+    # Raised when the provider budget has no token left within the caller's deadline
+    def __init__(self, name, retry_after):
+        super().__init__(f"Rate limit of {name} exceeded.")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class _LocalBuckets:
+    """
+    Process local token buckets, used when the cache isn't redis (tests, dev)
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buckets = {}
+
+    def take(self, key, rate, burst, requested):
+        now = time.monotonic()
+        with self._lock:
+            tokens, ts = self._buckets.get(key, (burst, now))
+            tokens = min(burst, tokens + max(0, now - ts) * rate)
+            wait = 0
+            if tokens >= requested:
+                tokens -= requested
+            else:
+                wait = (requested - tokens) / rate
+            self._buckets[key] = (tokens, now)
+        return wait
+
+
+_local_buckets = _LocalBuckets()
+
+
+def _redis_script():
+    """
+    Return the registered token bucket script, or None when the default
+    cache isn't backed by redis
+    """
+    try:
+        from django_redis import get_redis_connection
+
+        return get_redis_connection("default").register_script(TOKEN_BUCKET_SCRIPT)
+    except (ImportError, NotImplementedError):
+        return None
+
+
+class RateLimiter:
+    """
+    Token bucket budget of an upstream (provider or provider endpoint),
+    shared by every web and celery process through redis.
+
+    The budget of "paymob:order" falls back to the "paymob" one,
+    an upstream without budget isn't limited
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.key = f"ratelimit:{name}"
+        self._script = None
+
+    @property
+    def budget(self):
+        budgets = getattr(settings, "PROVIDER_RATE_LIMITS", {})
+        return budgets.get(self.name) or budgets.get(self.name.split(":")[0])
+
+    def try_acquire(self, tokens=1):
+        """Take tokens if available. Return 0 on success, else the seconds to wait"""
+        budget = self.budget
+        if not budget:
+            return 0
+        rate, burst = budget["rate"], budget.get("burst", budget["rate"])
+        if self._script is None:
+            self._script = _redis_script() or False
+        if self._script:
+            return float(self._script(keys=[self.key], args=[rate, burst, tokens]))
+        return _local_buckets.take(self.key, rate, burst, tokens)
+
+    def acquire(self, tokens=1, timeout=None):
+        """
+        Block until tokens are taken, for up to timeout seconds.
+
+        Raises:
+            RateLimitExceeded with the seconds to wait when the deadline would pass
+        """
+        if timeout is None:
+            timeout = getattr(settings, "PROVIDER_RATE_LIMIT_MAX_WAIT", 2)
+        deadline = time.monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                logger.warning(f"Rate limit of {self.name} hit, retry in {wait:.2f}s.")
+                raise RateLimitExceeded(self.name, wait)
+            time.sleep(wait)
+
+    async def acquire_async(self, tokens=1, timeout=None):
+        """
+        acquire() for coroutines, the redis script and the waits don't block
+        the event loop
+        """
+        if timeout is None:
+            timeout = getattr(settings, "PROVIDER_RATE_LIMIT_MAX_WAIT", 2)
+        deadline = time.monotonic() + timeout
+        try_acquire = sync_to_async(self.try_acquire, thread_sensitive=False)
+        while True:
+            wait = await try_acquire(tokens)
+            if not wait:
+                return
+            if time.monotonic() + wait > deadline:
+                logger.warning(f"Rate limit of {self.name} hit, retry in {wait:.2f}s.")
+                raise RateLimitExceeded(self.name, wait)
+            await asyncio.sleep(wait)
+
+
+def get_limiter(name):
+    """Return the rate limiter of an upstream"""
+    if name not in _registry:
+        _registry[name] = RateLimiter(name)
+    return _registry[name]
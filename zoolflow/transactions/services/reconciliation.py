@@ -0,0 +1,187 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction as db_transaction
+from django.utils import timezone
+from ..models import Transaction
+from .helpers import transaction_email_details
+from .orchestration import TransactionOrchestrationService
+from .paymob import PayMobClient, ProviderServiceError
+
+logger = logging.getLogger(__name__)
+
+# states a missing webhook can leave a transaction stuck in
+RECONCILABLE_STATES = Transaction.UNSETTLED_STATES
+
+
+class TransactionReconciliationService:
+    """
+    Bring stuck transactions in line with PayMob, batch by batch.
+
+    Transactions are scanned in primary key order from a checkpoint kept in
+    the cache, so an interrupted run resumes where it stopped.
+
+    PENDING orders PayMob holds no transaction for (abandoned checkouts) fail
+    once RECONCILIATION_ABANDON_AFTER has passed, nothing created more than
+    RECONCILIATION_MAX_AGE ago is queried again
+    """
+
+    def __init__(self, batch_size=None, max_workers=None, min_age=None):
+        self.batch_size = batch_size or getattr(
+            settings, "RECONCILIATION_BATCH_SIZE", 500
+        )
+        self.max_workers = max_workers or getattr(
+            settings, "RECONCILIATION_MAX_WORKERS", 8
+        )
+        # leave recent transactions to their webhooks
+        self.min_age = (
+            min_age
+            if min_age is not None
+            else getattr(settings, "RECONCILIATION_MIN_AGE", 60 * 15)
+        )
+        self.abandon_after = getattr(
+            settings, "RECONCILIATION_ABANDON_AFTER", 60 * 60 * 24
+        )
+        self.max_age = getattr(settings, "RECONCILIATION_MAX_AGE", 60 * 60 * 24 * 7)
+        self.checkpoint_key = getattr(
+            settings,
+            "RECONCILIATION_CHECKPOINT_KEY",
+            "transactions:reconciliation:checkpoint",
+        )
+        self.client = PayMobClient()
+
+    def run(self, max_batches=None):
+        """
+        Reconcile batches until the table is exhausted or max_batches is hit.
+
+        Return counters of the run
+        """
+        stats = {
+            "scanned": 0,
+            "updated": 0,
+            "failed": 0,
+            "unpaid": 0,
+            "finished": False,
+        }
+        cursor = cache.get(self.checkpoint_key, 0)
+        batches = 0
+        while max_batches is None or batches < max_batches:
+            batch = list(self._next_batch(cursor))
+            if not batch:
+                # full pass done, next run starts over
+                cache.delete(self.checkpoint_key)
+                stats["finished"] = True
+                break
+            updated, failed, unpaid = self.reconcile_batch(batch)
+            stats["scanned"] += len(batch)
+            stats["updated"] += updated
+            stats["failed"] += failed
+            stats["unpaid"] += unpaid
+            cursor = batch[-1].id
+            cache.set(self.checkpoint_key, cursor, timeout=None)
+            batches += 1
+            logger.info(
+                f"Reconciliation checkpoint {cursor}: {updated} updated, {failed} failed."
+            )
+        return stats
+
+    def reset(self):
+        cache.delete(self.checkpoint_key)
+
+    def _next_batch(self, cursor):
+        now = timezone.now()
+        return (
+            Transaction.objects.filter(
+                id__gt=cursor,
+                state__in=RECONCILABLE_STATES,
+                updated_at__lt=now - timedelta(seconds=self.min_age),
+                created_at__gte=now - timedelta(seconds=self.max_age),
+            )
+            .only("id", "state", "transaction_id", "order_id", "created_at")
+            .order_by("id")[: self.batch_size]
+        )
+
+    def reconcile_batch(self, batch):
+        """
+        Query PayMob for the batch concurrently and apply changed states.
+
+        Return (updated, failed, unpaid) counts, unpaid are the orders PayMob
+        holds no transaction for yet
+        """
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = list(executor.map(self._provider_flags, batch))
+
+        failed = unpaid = 0
+        changes = {}
+        abandoned_before = timezone.now() - timedelta(seconds=self.abandon_after)
+        for tx, flags in zip(batch, results):
+            if flags is not None and not tx.transaction_id and not flags.get("id"):
+                # the customer never paid the order
+                unpaid += 1
+                if (
+                    tx.state == Transaction.TransactionState.PENDING
+                    and tx.created_at < abandoned_before
+                ):
+                    changes[tx.id] = (
+                        tx.state,
+                        Transaction.TransactionState.FAILED,
+                        None,
+                    )
+                continue
+            try:
+                state = TransactionOrchestrationService.state_from_flags(flags)
+            except (KeyError, TypeError):
+                # provider call failed or answered without transaction flags
+                failed += 1
+                continue
+            provider_id = flags.get("id") or tx.transaction_id
+            provider_id = str(provider_id) if provider_id else None
+            if state != tx.state or provider_id != tx.transaction_id:
+                changes[tx.id] = (tx.state, state, provider_id)
+        return self._apply(changes), failed, unpaid
+
+    def _provider_flags(self, tx):
+        try:
+            if tx.transaction_id:
+                return self.client.get_transaction_flags(tx.transaction_id)
+            if tx.order_id:
+                return self.client.inquire_order_transaction(tx.order_id)
+        except ProviderServiceError as e:
+            logger.warning(f"Reconciliation of {tx.id} skipped: {e.message}")
+        return None
+
+    def _apply(self, changes):
+        from zoolflow.notifications.tasks import transaction_state_batch_email_task
+
+        if not changes:
+            return 0
+        now = timezone.now()
+        updated, emails = [], []
+        with db_transaction.atomic():
+            locked = (
+                Transaction.objects.select_for_update(of=("self",))
+                .select_related("customer__user")
+                .filter(id__in=changes.keys())
+            )
+            for tx in locked:
+                scanned_state, state, provider_id = changes[tx.id]
+                # a webhook got there first
+                if tx.state != scanned_state or not tx.can_transition_to(state):
+                    continue
+                tx.state = state
+                tx.transaction_id = provider_id
+                tx.version += 1
+                tx.updated_at = now
+                updated.append(tx)
+                if provider_id and state != scanned_state:
+                    emails.append((provider_id, transaction_email_details(tx)))
+            Transaction.objects.bulk_update(
+                updated, ["state", "transaction_id", "version", "updated_at"]
+            )
+        if emails:
+            db_transaction.on_commit(
+                lambda: transaction_state_batch_email_task.delay(emails)
+            )
+        return len(updated)
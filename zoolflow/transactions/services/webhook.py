@@ -2,7 +2,6 @@ import logging
 import hashlib
 import hmac
 from django.conf import settings
-from .helpers import bring_transaction
 
 logger = logging.getLogger(__name__)
 
@@ -18,41 +17,11 @@ class WebhookServiceError(Exception):
 class WebhookService:
     def __init__(self, data, merchant_id, transaction_id):
         self.data = data
-        self.transaction = bring_transaction(merchant_order_id=merchant_id)
+        self.merchant_id = merchant_id
         self.transaction_id = transaction_id
 
     def verify_paymob_hmac(self, received_hmac):
-        try:
-            concatenate_fields = str.join(
-                "",
-                [
-                    str(self.data["amount_cents"]),
-                    str(self.data["created_at"]),
-                    str(self.data["currency"]),
-                    str(self.data["error_occured"]).lower(),
-                    str(self.data["has_parent_transaction"]).lower(),
-                    str(self.data["id"]),
-                    str(self.data["integration_id"]),
-                    str(self.data["is_3d_secure"]).lower(),
-                    str(self.data["is_auth"]).lower(),
-                    str(self.data["is_capture"]).lower(),
-                    str(self.data["is_refunded"]).lower(),
-                    str(self.data["is_standalone_payment"]).lower(),
-                    str(self.data["is_voided"]).lower(),
-                    str(self.data["order"]["id"]),
-                    str(self.data["owner"]),
-                    str(self.data["pending"]).lower(),
-                    str(self.data["source_data"]["pan"]),
-                    str(self.data["source_data"]["sub_type"]),
-                    str(self.data["source_data"]["type"]),
-                    str(self.data["success"]).lower(),
-                ],
-            )
-        except (KeyError, TypeError) as exc:
-            raise WebhookServiceError(
-                "Invalid webhook payload structure.",
-                details=f"PAYLOAD:{exc}",
-            )
+        concatenate_fields = WebhookService.paymob_hmac_message(self.data)
 
         secret_key = getattr(settings, "HMAC_SECRET_KEY")
         WebhookService.verify_signature(
@@ -64,6 +33,44 @@ class WebhookService:
             f"PayMob HMAC for transaction ({self.transaction_id}) verified successfully.",
         )
 
+    @staticmethod
+    def paymob_hmac_message(data):
+        """
+        Return the PayMob transaction fields concatenated in HMAC order
+        Raise WebhookServiceError if the payload misses any of them
+        """
+        try:
+            return str.join(
+                "",
+                [
+                    str(data["amount_cents"]),
+                    str(data["created_at"]),
+                    str(data["currency"]),
+                    str(data["error_occured"]).lower(),
+                    str(data["has_parent_transaction"]).lower(),
+                    str(data["id"]),
+                    str(data["integration_id"]),
+                    str(data["is_3d_secure"]).lower(),
+                    str(data["is_auth"]).lower(),
+                    str(data["is_capture"]).lower(),
+                    str(data["is_refunded"]).lower(),
+                    str(data["is_standalone_payment"]).lower(),
+                    str(data["is_voided"]).lower(),
+                    str(data["order"]["id"]),
+                    str(data["owner"]),
+                    str(data["pending"]).lower(),
+                    str(data["source_data"]["pan"]),
+                    str(data["source_data"]["sub_type"]),
+                    str(data["source_data"]["type"]),
+                    str(data["success"]).lower(),
+                ],
+            )
+        except (KeyError, TypeError) as exc:
+            raise WebhookServiceError(
+                "Invalid webhook payload structure.",
+                details=f"PAYLOAD:{exc}",
+            )
+
     @staticmethod
     def verify_signature(**kwargs):
         """
@@ -0,0 +1,150 @@
+import logging
+from celery import shared_task
+from django.conf import settings
+from django.core.cache import cache
+from .models import Transaction
+from .services.inbox import WebhookInboxBusy, drain_merchant_inbox, stale_merchant_ids
+from .services.paymob import PayMobClient, ProviderServiceError
+from .services.reconciliation import TransactionReconciliationService
+from .services.archive import TransactionArchiveService
+from .services.orchestration import (
+    TransactionOrchestrationService,
+    TransactionOrchestrationServiceError,
+)
+
+logger = logging.getLogger(__name__)
+
+
+@shared_task
+def orchestrate_transaction_task(transaction_pk):
+    """
+    Background task for creating the provider order and payment key
+    of an INITIATED transaction
+    """
+    transaction = (
+        Transaction.objects.select_related("customer")
+        .filter(pk=transaction_pk, state=Transaction.TransactionState.INITIATED)
+        .first()
+    )
+    if not transaction:
+        logger.warning(
+            f"Transaction {transaction_pk} is missing or already orchestrated."
+        )
+        return
+
+    logger.info(f"Start orchestrating transaction {transaction.merchant_order_id}...")
+    service = TransactionOrchestrationService(transaction.customer)
+    try:
+        service._interact_with_provider(transaction)
+    except TransactionOrchestrationServiceError as e:
+        # the transaction has already been moved to FAILED, nothing to retry
+        logger.error(
+            f"Orchestration of transaction {transaction.merchant_order_id} failed: {e.message}"
+        )
+
+
+@shared_task
+def refresh_paymob_auth_token_task():
+    """
+    Periodic task refreshing the PayMob authentication token before it expires
+    """
+    try:
+        PayMobClient().refresh_auth_token()
+    except ProviderServiceError as e:
+        # request path falls back to fetching on demand
+        logger.error(f"Scheduled PayMob token refresh failed: {e.message}")
+
+
+@shared_task
+def reconcile_webhook_state_task(merchant_id, transaction_id, webhook_state):
+    """
+    Compare a webhook derived state with PayMob and apply PayMob's on mismatch
+    """
+    try:
+        flags = PayMobClient().get_transaction_flags(transaction_id)
+    except ProviderServiceError as e:
+        logger.error(
+            f"Reconciliation of transaction {transaction_id} failed: {e.message}"
+        )
+        return
+
+    provider_state = TransactionOrchestrationService.state_from_flags(flags)
+    if provider_state == webhook_state:
+        logger.info(
+            f"Transaction {transaction_id} webhook state confirmed by provider."
+        )
+        return
+
+    logger.error(
+        f"Transaction {transaction_id} webhook state {webhook_state} "
+        f"differs from provider state {provider_state}."
+    )
+    try:
+        TransactionOrchestrationService.update_and_mail_state(
+            merchant_id, transaction_id, flags=flags
+        )
+    except TransactionOrchestrationServiceError as e:
+        logger.error(f"Applying provider state to {transaction_id} failed: {e.message}")
+
+
+@shared_task(bind=True)
+def process_webhook_inbox_task(self, merchant_id):
+    """
+    Background task applying the received webhooks of a merchant order
+    """
+    try:
+        processed = drain_merchant_inbox(merchant_id)
+    except WebhookInboxBusy:
+        # the current drainer may miss rows committed after its last read.
+        # past the last retry the sweeper picks what is left
+        raise self.retry(
+            countdown=min(2**self.request.retries, 30),
+            max_retries=getattr(settings, "PAYMOB_WEBHOOK_INBOX_BUSY_RETRIES", 8),
+        )
+    except Exception as e:
+        logger.error(f"Webhook inbox of {merchant_id} failed: {e}")
+        raise self.retry(countdown=5, max_retries=5)
+    logger.info(f"{processed} webhook(s) of {merchant_id} processed.")
+
+
+@shared_task
+def sweep_webhook_inbox_task():
+    """
+    Periodic task re-queuing merchant orders with webhooks left unprocessed
+    """
+    older_than = getattr(settings, "PAYMOB_WEBHOOK_INBOX_STALE_AFTER", 60)
+    for merchant_id in stale_merchant_ids(older_than):
+        process_webhook_inbox_task.delay(merchant_id)
+
+
+@shared_task
+def reconcile_transactions_task(max_batches=None):
+    """
+    Periodic task reconciling stuck transactions whose webhook never arrived
+    """
+    lock_key = "transactions:reconciliation:lock"
+    # one run at a time, a long pass simply continues on the next beat
+    if not cache.add(lock_key, 1, timeout=60 * 30):
+        logger.info("Transaction reconciliation already running.")
+        return
+    try:
+        stats = TransactionReconciliationService().run(max_batches=max_batches)
+    finally:
+        cache.delete(lock_key)
+    logger.info(f"Transaction reconciliation finished with {stats}.")
+
+
+@shared_task
+def archive_transactions_task(max_batches=None):
+    """
+    Periodic task moving old terminal transactions to the archive table
+    """
+    lock_key = "transactions:archive:lock"
+    if not cache.add(lock_key, 1, timeout=60 * 30):
+        logger.info("Transaction archival already running.")
+        return
+    try:
+        stats = TransactionArchiveService().run(max_batches=max_batches)
+    finally:
+        cache.delete(lock_key)
+    logger.info(f"Transaction archival finished with {stats}.")
@@ -0,0 +1,40 @@
+import os
+import pytest
+from .harness import measure, write_results
+
+BENCHMARKS_ENABLED = os.environ.get("ZOOLFLOW_BENCHMARKS") == "1"
+
+
+def pytest_collection_modifyitems(config, items):
+    # opt-in, the suite takes a while and its numbers need a quiet machine
+    if BENCHMARKS_ENABLED:
+        return
+    skip = pytest.mark.skip(reason="set ZOOLFLOW_BENCHMARKS=1 to run benchmarks")
+    here = os.path.dirname(__file__)
+    for item in items:
+        if str(item.path).startswith(here):
+            item.add_marker(skip)
+
+
+@pytest.fixture(scope="session")
+def benchmark_results():
+    results = []
+    yield results
+    if results:
+        path = os.environ.get("ZOOLFLOW_BENCHMARK_OUTPUT", "benchmark-results.json")
+        write_results(results, path)
+
+
+@pytest.fixture
+def benchmark(benchmark_results):
+    """
+    Measure a callable and keep its result for the JSON output,
+    benchmark(name, func, rounds=5, params=None) returns the Result
+    """
+
+    def run(name, func, **kwargs):
+        result = measure(name, func, **kwargs)
+        benchmark_results.append(result)
+        return result
+
+    return run
@@ -0,0 +1,143 @@
+"""
+Micro-benchmark harness of the transaction hot paths.
+
+Compare two saved runs:
+
+    python -m zoolflow.transactions.tests.benchmarks.harness before.json after.json
+"""
+
+import json
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+
+
+@dataclass
+class Result:
+    name: str
+    # calls per timed round, calibrated to fill min_round_time
+    loops: int
+    rounds: int
+    best_us: float
+    median_us: float
+    ops_per_sec: float
+    # memory of one call traced by tracemalloc, None for throughput runs
+    peak_bytes: int | None
+    retained_blocks: int | None
+    params: dict = field(default_factory=dict)
+
+
+def measure(name, func, rounds=5, min_round_time=0.1, params=None):
+    """
+    Time func() over rounds of calibrated loops, then trace one call's allocations
+    """
+    func()  # warm up caches and imports
+    loops = 1
+    while True:
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        elapsed = time.perf_counter() - started
+        if elapsed >= min_round_time:
+            break
+        loops *= 10 if elapsed < min_round_time / 10 else 2
+
+    timings = [elapsed / loops]
+    for _ in range(rounds - 1):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - started) / loops)
+
+    peak_bytes, blocks = _allocations(func)
+    best, median = min(timings), statistics.median(timings)
+    return Result(
+        name=name,
+        loops=loops,
+        rounds=rounds,
+        best_us=round(best * 1e6, 3),
+        median_us=round(median * 1e6, 3),
+        ops_per_sec=round(1 / median, 2),
+        peak_bytes=peak_bytes,
+        retained_blocks=blocks,
+        params=params or {},
+    )
+
+
+def throughput(name, operations, seconds, params=None):
+    """Result of a single timed run of many operations (bulk inserts, scans)"""
+    per_op = seconds / operations
+    return Result(
+        name=name,
+        loops=operations,
+        rounds=1,
+        best_us=round(per_op * 1e6, 3),
+        median_us=round(per_op * 1e6, 3),
+        ops_per_sec=round(operations / seconds, 2),
+        peak_bytes=None,
+        retained_blocks=None,
+        params=params or {},
+    )
+
+
+def _allocations(func):
+    """Return (peak bytes, blocks still allocated) of one func() call"""
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        before = tracemalloc.take_snapshot()
+        tracemalloc.reset_peak()
+        baseline, _ = tracemalloc.get_traced_memory()
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+        after = tracemalloc.take_snapshot()
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    # leave out the snapshots' own allocations
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    before, after = before.filter_traces(ignore), after.filter_traces(ignore)
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "lineno"))
+    return peak - baseline, blocks
+
+
+def write_results(results, path):
+    report = {
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "results": {result.name: asdict(result) for result in results},
+    }
+    with open(path, "w") as f:
+        json.dump(report, f, indent=2)
+    return report
+
+
+def compare(before, after):
+    """Return (name, ops/sec before, ops/sec after, speedup) of the common benchmarks"""
+    rows = []
+    for name, old in before["results"].items():
+        new = after["results"].get(name)
+        if new is not None:
+            speedup = new["ops_per_sec"] / old["ops_per_sec"]
+            rows.append((name, old["ops_per_sec"], new["ops_per_sec"], speedup))
+    return rows
+
+
+def main(argv=None):
+    before_path, after_path = (argv or sys.argv[1:])[:2]
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+    for name, old, new, speedup in compare(before, after):
+        print(f"{name:<45} {old:>14,.1f} {new:>14,.1f} ops/s  x{speedup:.2f}")
+
+
+if __name__ == "__main__":
+    main()
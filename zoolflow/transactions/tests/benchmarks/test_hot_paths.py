@@ -0,0 +1,156 @@
+import hashlib
+import hmac
+import json
+import time
+from decimal import Decimal
+import pytest
+import requests
+from django.contrib.auth import get_user_model
+from django.utils import timezone
+from zoolflow.customers.models import Address, Customer
+from zoolflow.customers.services.normalizers import normalize_phone_number
+from ...models import Transaction
+from ...serializers import TransactionSerializer
+from ...services.auth_token import paymob_token_manager
+from ...services.orchestration import TransactionOrchestrationService
+from ...services.payloads import PaymentContext, order_payload, payment_token_payload
+from ...services.webhook import WebhookService
+
+User = get_user_model()
+
+HMAC_SECRET = "bench-hmac-secret"
+
+FLAGS = {
+    "id": 373906621,
+    "amount_cents": 15000,
+    "created_at": "2024-05-01T10:00:00.000000",
+    "currency": "EGP",
+    "error_occured": False,
+    "has_parent_transaction": False,
+    "integration_id": 4512345,
+    "is_3d_secure": True,
+    "is_auth": False,
+    "is_capture": False,
+    "is_refunded": False,
+    "is_standalone_payment": True,
+    "is_voided": False,
+    "order": {"id": 281234567, "merchant_order_id": "ORD-bench"},
+    "owner": 1,
+    "pending": False,
+    "source_data": {"pan": "2346", "sub_type": "MasterCard", "type": "card"},
+    "success": True,
+}
+
+
+@pytest.fixture
+def context():
+    # in memory, payload building never touches the database
+    customer = Customer(
+        user=User(email="bench@example.com"),
+        first_name="Ali",
+        last_name="Ahmed",
+        phone_number="+201001234567",
+    )
+    address = Address(customer=customer, city="Cairo", line="Tahrir st")
+    return PaymentContext(customer=customer, address=address, currency="EGP")
+
+
+def test_verify_paymob_hmac(benchmark, settings):
+    settings.HMAC_SECRET_KEY = HMAC_SECRET
+    message = WebhookService.paymob_hmac_message(FLAGS)
+    signature = hmac.new(
+        HMAC_SECRET.encode(), message.encode(), hashlib.sha512
+    ).hexdigest()
+    service = WebhookService(FLAGS, "ORD-bench", FLAGS["id"])
+
+    benchmark(
+        "webhook.verify_paymob_hmac",
+        lambda: service.verify_paymob_hmac(signature),
+    )
+
+
+def test_transaction_current_state(benchmark, settings, mocker):
+    """Our side of the inquiry: token, rate limit, breaker, metrics and mapping"""
+    settings.PROVIDER_RATE_LIMITS = {}
+    url = f"{settings.PAYMOB_TRANSACTIONS_URL}{FLAGS['id']}"
+    response = requests.Response()
+    response.status_code = 200
+    response._content = json.dumps(FLAGS).encode()
+    response.request = requests.Request("GET", url).prepare()
+    session = mocker.Mock()
+    session.get.return_value = response
+    mocker.patch(
+        "zoolflow.transactions.services.paymob.get_session_with_retries",
+        return_value=session,
+    )
+    paymob_token_manager._local = {
+        "token": "bench-token",
+        "expires_at": time.time() + 3600,
+    }
+    try:
+        benchmark(
+            "orchestration.transaction_current_state",
+            lambda: TransactionOrchestrationService.transaction_current_state(
+                FLAGS["id"]
+            ),
+        )
+    finally:
+        paymob_token_manager._local = None
+
+
+def test_transition_to(benchmark):
+    transaction = Transaction(amount=Decimal("150.00"))
+
+    def transition():
+        transaction.state = Transaction.TransactionState.PENDING
+        transaction.transition_to(Transaction.TransactionState.SUCCEEDED)
+
+    benchmark("models.Transaction.transition_to", transition)
+
+
+@pytest.mark.parametrize("rows", [1_000, 100_000])
+def test_transaction_serializer(benchmark, rows):
+    now = timezone.now()
+    transactions = [
+        Transaction(
+            customer_id=1,
+            amount=Decimal("150.00"),
+            state=Transaction.TransactionState.SUCCEEDED,
+            transaction_id=str(373906621 + i),
+            order_id=str(281234567 + i),
+            payment_token="ZXlKaGJHY2lPaUpJVXpVeE1pSXNJblI1Y0NJNklrcFhWQ0o5",
+            created_at=now,
+        )
+        for i in range(rows)
+    ]
+
+    benchmark(
+        f"serializers.TransactionSerializer[{rows}]",
+        lambda: TransactionSerializer(transactions, many=True).data,
+        rounds=3 if rows > 10_000 else 5,
+        params={"rows": rows},
+    )
+
+
+def test_order_payload(benchmark, context):
+    benchmark(
+        "payloads.order_payload",
+        lambda: order_payload(15000, "bench-token", "ORD-bench", context),
+    )
+
+
+def test_payment_token_payload(benchmark, context):
+    benchmark(
+        "payloads.payment_token_payload",
+        lambda: payment_token_payload(15000, "bench-token", 281234567, context),
+    )
+
+
+@pytest.mark.parametrize(
+    "number", ["+201001234567", "01001234567"], ids=["e164", "national"]
+)
+def test_normalize_phone_number(benchmark, number):
+    benchmark(
+        f"normalizers.normalize_phone_number[{number}]",
+        lambda: normalize_phone_number(number),
+    )
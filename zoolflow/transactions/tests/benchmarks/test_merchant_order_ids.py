@@ -0,0 +1,79 @@
+import os
+import time
+import pytest
+from django.db import connection
+from ...services.ids import uuid4_merchant_order_id, uuid7_merchant_order_id
+from .harness import throughput
+
+GENERATORS = {"uuid4": uuid4_merchant_order_id, "uuid7": uuid7_merchant_order_id}
+
+# a few million on a real database, e.g. ZOOLFLOW_BENCHMARK_ID_ROWS=3000000
+ROWS = int(os.environ.get("ZOOLFLOW_BENCHMARK_ID_ROWS", 200_000))
+BATCH = 10_000
+# webhook lookups hit the newest ids
+LOOKUPS = 10_000
+
+TABLE = "bench_merchant_order_ids"
+
+
+def _index_bytes():
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            cursor.execute(f"SELECT pg_relation_size('{TABLE}_key')")
+        elif connection.vendor == "sqlite":
+            cursor.execute(
+                "SELECT SUM(pgsize) FROM dbstat WHERE name LIKE %s",
+                [f"sqlite_autoindex_{TABLE}%"],
+            )
+        else:
+            return None
+        return cursor.fetchone()[0]
+
+
+@pytest.mark.parametrize("generator", GENERATORS)
+def test_merchant_order_id_generation(benchmark, generator):
+    benchmark(f"ids.{generator}_merchant_order_id", GENERATORS[generator])
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.parametrize("generator", GENERATORS)
+def test_merchant_order_id_inserts_and_index_size(benchmark_results, generator):
+    """
+    Insert ROWS ids into a table shaped like the merchant_order_id unique
+    index, then look up the newest ones as webhooks do
+    """
+    new_id = GENERATORS[generator]
+    ids = [new_id() for _ in range(ROWS)]
+    with connection.cursor() as cursor:
+        cursor.execute(f"DROP TABLE IF EXISTS {TABLE}")
+        cursor.execute(
+            f"CREATE TABLE {TABLE} (merchant_order_id varchar(40) NOT NULL, "
+            f"CONSTRAINT {TABLE}_key UNIQUE (merchant_order_id))"
+        )
+        try:
+            started = time.perf_counter()
+            for start in range(0, ROWS, BATCH):
+                cursor.executemany(
+                    f"INSERT INTO {TABLE} (merchant_order_id) VALUES (%s)",
+                    [(value,) for value in ids[start : start + BATCH]],
+                )
+            inserted = time.perf_counter() - started
+            index_bytes = _index_bytes()
+
+            started = time.perf_counter()
+            for value in ids[-LOOKUPS:]:
+                cursor.execute(
+                    f"SELECT 1 FROM {TABLE} WHERE merchant_order_id = %s", [value]
+                )
+                cursor.fetchone()
+            looked_up = time.perf_counter() - started
+        finally:
+            cursor.execute(f"DROP TABLE {TABLE}")
+
+    params = {"rows": ROWS, "vendor": connection.vendor, "index_bytes": index_bytes}
+    benchmark_results.append(
+        throughput(f"ids.{generator}.insert", ROWS, inserted, params)
+    )
+    benchmark_results.append(
+        throughput(f"ids.{generator}.recent_lookup", LOOKUPS, looked_up, params)
+    )
@@ -1,11 +1,18 @@
 import pytest
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
 from ..services.paymob import PayMobClient
 from zoolflow.customers.models import Customer, Address
 
 User = get_user_model()
 
 
+@pytest.fixture(autouse=True)
+def clear_cache():
+    # idempotency responses and locks must not leak between tests
+    cache.clear()
+
+
 @pytest.fixture()
 def customer_factory(db):
     def create_customer(with_address=True, **kwargs):
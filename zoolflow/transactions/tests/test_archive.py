@@ -0,0 +1,158 @@
+import json
+from datetime import timedelta
+import pytest
+from django.core.management import call_command
+from django.urls import reverse
+from django.utils import timezone
+from ..models import Transaction, TransactionArchive
+from ..services.archive import TransactionArchiveService
+
+
+def create_transaction(customer, state, days_old=0, **kwargs):
+    tx = Transaction.objects.create(customer=customer, amount=20, state=state, **kwargs)
+    # created_at is auto_now_add, age it after the insert
+    Transaction.objects.filter(pk=tx.pk).update(
+        created_at=timezone.now() - timedelta(days=days_old)
+    )
+    tx.refresh_from_db()
+    return tx
+
+
+@pytest.mark.django_db
+class TestTransactionArchiveService:
+    def test_old_terminal_transactions_are_moved(self, customer_factory):
+        customer = customer_factory()
+        old_failed = create_transaction(
+            customer, Transaction.TransactionState.FAILED, days_old=100
+        )
+        recent_failed = create_transaction(
+            customer, Transaction.TransactionState.FAILED, days_old=1
+        )
+        old_succeeded = create_transaction(
+            customer, Transaction.TransactionState.SUCCEEDED, days_old=100
+        )
+
+        stats = TransactionArchiveService(retention_days=90).run()
+
+        assert stats == {"archived": 1, "batches": 1, "finished": True}
+        assert set(Transaction.objects.values_list("id", flat=True)) == {
+            recent_failed.id,
+            old_succeeded.id,
+        }
+        archived = TransactionArchive.objects.get()
+        assert archived.id == old_failed.id
+        assert archived.merchant_order_id == old_failed.merchant_order_id
+        assert archived.created_at == old_failed.created_at
+        assert archived.archived_at is not None
+
+    def test_max_batches_leaves_the_rest_for_the_next_run(self, customer_factory):
+        customer = customer_factory()
+        for state in Transaction.TERMINAL_STATES:
+            create_transaction(customer, state, days_old=100)
+        service = TransactionArchiveService(batch_size=3, retention_days=90)
+
+        stats = service.run(max_batches=1)
+        assert stats == {"archived": 3, "batches": 1, "finished": False}
+        assert Transaction.objects.count() == 1
+
+        stats = service.run()
+        assert stats == {"archived": 1, "batches": 1, "finished": True}
+        assert TransactionArchive.objects.count() == 4
+
+    def test_command_reports_the_run(self, customer_factory, capsys):
+        customer = customer_factory()
+        create_transaction(customer, Transaction.TransactionState.VOIDED, days_old=100)
+
+        call_command("archive_transactions", "--retention-days", "90")
+
+        assert "Archived 1 in 1 batches" in capsys.readouterr().out
+        assert not Transaction.objects.exists()
+
+
+@pytest.mark.django_db
+class TestArchivedTransactionsApi:
+    @pytest.fixture
+    def customer(self, customer_factory):
+        customer = customer_factory(
+            username="archive_customer",
+            email="archive_customer@example.com",
+            role_management="CUSTOMER",
+        )
+        create_transaction(customer, Transaction.TransactionState.PENDING)
+        self.archived = create_transaction(
+            customer, Transaction.TransactionState.REFUNDED, days_old=100
+        )
+        TransactionArchiveService(retention_days=90).run()
+        return customer
+
+    def test_list_excludes_archive_unless_asked(self, api_client, customer):
+        api_client.force_authenticate(user=customer.user)
+        url = reverse("transactions:transaction-list")
+
+        hot = api_client.get(url)
+        everything = api_client.get(url, {"include_archived": "true"})
+
+        assert len(hot.data["results"]) == 1
+        assert everything.status_code == 200
+        assert everything.data["count"] == 2
+        assert [row["state_display"] for row in everything.data["results"]] == [
+            "Pending",
+            "Refunded",
+        ]
+
+    def test_list_filters_apply_to_the_archive(self, api_client, customer):
+        api_client.force_authenticate(user=customer.user)
+
+        response = api_client.get(
+            reverse("transactions:transaction-list"),
+            {"include_archived": "true", "state": "refunded"},
+        )
+
+        assert response.data["count"] == 1
+        assert (
+            response.data["results"][0]["merchant_order_id"]
+            == self.archived.merchant_order_id
+        )
+
+    def test_retrieve_falls_back_to_archive_when_asked(
+        self, api_client, customer, customer_factory
+    ):
+        url = reverse(
+            "transactions:transaction-detail",
+            args=[self.archived.merchant_order_id],
+        )
+        api_client.force_authenticate(user=customer.user)
+
+        assert api_client.get(url).status_code == 404
+        response = api_client.get(url, {"include_archived": "true"})
+        assert response.status_code == 200
+        assert response.data["state_display"] == "Refunded"
+
+        other = customer_factory(
+            username="other_customer",
+            email="other_customer@example.com",
+            role_management="CUSTOMER",
+        )
+        api_client.force_authenticate(user=other.user)
+        assert api_client.get(url, {"include_archived": "true"}).status_code == 404
+
+    def test_staff_export_includes_archive_when_asked(
+        self, api_client, customer, customer_factory
+    ):
+        staff_customer = customer_factory(
+            username="archive_staff",
+            email="archive_staff@example.com",
+            role_management="STAFF",
+        )
+        api_client.force_authenticate(user=staff_customer.user)
+
+        response = api_client.get(
+            reverse("transactions:transaction-export", args=["ndjson"]),
+            {"include_archived": "true"},
+        )
+        rows = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+
+        assert sorted(row["state"] for row in rows) == ["pending", "refunded"]
@@ -0,0 +1,254 @@
+import json
+import threading
+import time
+import httpx
+import pytest
+from asgiref.sync import async_to_sync
+from django.urls import reverse
+from config.db_router import is_pinned_to_primary
+from ..models import Transaction, WebhookInbox
+from ..services import metrics
+from ..services.auth_token import paymob_token_manager
+from ..services.circuit_breaker import CircuitBreaker
+from ..services.idempotency import IdempotentResponseCache
+from ..services.rate_limiter import RateLimiter
+from ..services.http_client import send_with_retries
+from .test_webhook import _signed_webhook
+
+
+@pytest.fixture
+def paymob_transport(mocker, settings):
+    """
+    Answer the async client's PayMob calls from a handler, return the
+    requests it received
+    """
+    settings.PROVIDER_RATE_LIMITS = {}
+    settings.HTTP_CLIENT_RETRY_POLICIES = {"default": {"total": 0}}
+    received = []
+    answers = {
+        settings.ORDER_PAYMOB_URL: (201, {"id": 281234567}),
+        settings.PAYMOB_PAYMENT_URL_KEY: (201, {"token": "payment-token"}),
+    }
+
+    def handler(request):
+        request.extensions["thread"] = threading.get_ident()
+        received.append(request)
+        status, body = answers[str(request.url)]
+        return httpx.Response(status, json=body)
+
+    # a client per call, pooled connections can't outlive the test's event loop
+    mocker.patch(
+        "zoolflow.transactions.services.paymob.get_async_client",
+        side_effect=lambda: httpx.AsyncClient(transport=httpx.MockTransport(handler)),
+    )
+    paymob_token_manager._local = {
+        "token": "auth-token",
+        "expires_at": time.time() + 3600,
+    }
+    yield answers, received
+    paymob_token_manager._local = None
+
+
+@pytest.fixture
+def verified_customer(customer_factory):
+    customer = customer_factory(
+        username="async_customer",
+        email="async_customer@example.com",
+        role_management="CUSTOMER",
+    )
+    customer.is_verified = True
+    customer.save(update_fields=["is_verified"])
+    return customer
+
+
+@pytest.mark.django_db
+class TestAsyncTransactionCreateView:
+    url = reverse("transactions:transaction_create_async")
+
+    def test_create_calls_paymob_from_the_event_loop(
+        self, api_client, verified_customer, paymob_transport
+    ):
+        _, received = paymob_transport
+        api_client.force_authenticate(user=verified_customer.user)
+
+        response = api_client.post(self.url, {"amount": "150.00"}, format="json")
+
+        assert response.status_code == 201
+        assert response.data["order_id"] == "281234567"
+        assert response.data["payment_token"] == "payment-token"
+        transaction = Transaction.objects.get()
+        assert transaction.state == Transaction.TransactionState.PENDING
+        order = json.loads(received[0].content)
+        assert order["merchant_order_id"] == transaction.merchant_order_id
+        assert order["amount_cents"] == 15000
+
+    def test_redis_bookkeeping_runs_off_the_event_loop(
+        self, api_client, verified_customer, paymob_transport, mocker
+    ):
+        _, received = paymob_transport
+        bookkeeping_threads = set()
+
+        def on_thread(func):
+            def wrapper(*args, **kwargs):
+                bookkeeping_threads.add(threading.get_ident())
+                return func(*args, **kwargs)
+
+            return wrapper
+
+        for owner, name in [
+            (RateLimiter, "try_acquire"),
+            (CircuitBreaker, "before_call"),
+            (CircuitBreaker, "record_success"),
+            (IdempotentResponseCache, "get"),
+            (IdempotentResponseCache, "store"),
+            (IdempotentResponseCache, "release"),
+        ]:
+            mocker.patch.object(owner, name, on_thread(getattr(owner, name)))
+        mocker.patch.object(metrics, "_record_call", on_thread(metrics._record_call))
+        api_client.force_authenticate(user=verified_customer.user)
+
+        response = api_client.post(
+            self.url,
+            {"amount": "150.00"},
+            format="json",
+            HTTP_IDEMPOTENCY_KEY="off-loop-key",
+        )
+
+        # PayMob is answered on the thread running the event loop
+        loop_threads = {request.extensions["thread"] for request in received}
+        assert response.status_code == 201
+        assert len(loop_threads) == 1 and bookkeeping_threads
+        assert not loop_threads & bookkeeping_threads
+
+    def test_create_pins_the_user_to_the_primary(
+        self, api_client, verified_customer, paymob_transport
+    ):
+        api_client.force_authenticate(user=verified_customer.user)
+
+        response = api_client.post(self.url, {"amount": "150.00"}, format="json")
+
+        assert response.status_code == 201
+        assert is_pinned_to_primary(verified_customer.user)
+
+    def test_provider_failure_fails_the_transaction(
+        self, api_client, verified_customer, paymob_transport, settings
+    ):
+        answers, _ = paymob_transport
+        answers[settings.ORDER_PAYMOB_URL] = (400, {"message": "bad request"})
+        api_client.force_authenticate(user=verified_customer.user)
+
+        response = api_client.post(self.url, {"amount": "150.00"}, format="json")
+
+        assert response.status_code == 400
+        assert Transaction.objects.get().state == Transaction.TransactionState.FAILED
+
+    def test_idempotency_key_replays_existing_transaction(
+        self, api_client, verified_customer, paymob_transport
+    ):
+        _, received = paymob_transport
+        existing = Transaction.objects.create(
+            customer=verified_customer, amount=120, idempotency_key="async-key"
+        )
+        api_client.force_authenticate(user=verified_customer.user)
+
+        response = api_client.post(
+            self.url,
+            {"amount": "120.00"},
+            format="json",
+            HTTP_IDEMPOTENCY_KEY="async-key",
+        )
+
+        assert response.status_code == 200
+        assert response.data["merchant_order_id"] == existing.merchant_order_id
+        assert not received
+
+    def test_unverified_customer_is_refused(self, api_client, customer_factory):
+        customer = customer_factory(role_management="CUSTOMER")
+        api_client.force_authenticate(user=customer.user)
+
+        response = api_client.post(self.url, {"amount": "150.00"}, format="json")
+
+        assert response.status_code == 403
+
+
+@pytest.mark.django_db
+class TestAsyncPayMobWebHookView:
+    def test_verified_webhook_is_stored_in_the_inbox(
+        self,
+        api_client,
+        customer_factory,
+        settings,
+        mocker,
+        django_capture_on_commit_callbacks,
+    ):
+        settings.PAYMOB_WEBHOOK_INBOX = True
+        drain = mocker.patch(
+            "zoolflow.transactions.tasks.process_webhook_inbox_task.delay"
+        )
+        transaction = Transaction.objects.create(
+            customer=customer_factory(),
+            amount=50,
+            state=Transaction.TransactionState.PENDING,
+        )
+        payload, signature = _signed_webhook(
+            transaction.merchant_order_id, settings.HMAC_SECRET_KEY
+        )
+        url = reverse("transactions:transaction_webhook_async")
+
+        with django_capture_on_commit_callbacks(execute=True):
+            response = api_client.post(
+                f"{url}?hmac={signature}", payload, format="json"
+            )
+        forged = api_client.post(f"{url}?hmac=forged", payload, format="json")
+
+        assert response.status_code == 200
+        assert forged.status_code == 400
+        assert WebhookInbox.objects.get().merchant_order_id == (
+            transaction.merchant_order_id
+        )
+        drain.assert_called_once_with(transaction.merchant_order_id)
+
+
+class TestSendWithRetries:
+    def test_retries_retryable_answers_with_backoff(self, settings):
+        settings.HTTP_CLIENT_RETRY_POLICIES = {
+            "default": {
+                "total": 2,
+                "backoff_factor": 0,
+                "status_forcelist": [503, 429],
+                "allowed_methods": ["POST"],
+            }
+        }
+        statuses = iter([503, 429, 201])
+        client = httpx.AsyncClient(
+            transport=httpx.MockTransport(
+                lambda request: httpx.Response(next(statuses))
+            )
+        )
+
+        response, retries = async_to_sync(send_with_retries)(
+            client, "POST", "http://paymob.test/orders"
+        )
+
+        assert response.status_code == 201
+        assert retries == 2
+
+    def test_methods_outside_the_policy_are_not_retried(self, settings):
+        settings.HTTP_CLIENT_RETRY_POLICIES = {
+            "default": {
+                "total": 2,
+                "backoff_factor": 0,
+                "status_forcelist": [503, 429],
+                "allowed_methods": ["POST"],
+            }
+        }
+        client = httpx.AsyncClient(
+            transport=httpx.MockTransport(lambda request: httpx.Response(503))
+        )
+
+        response, retries = async_to_sync(send_with_retries)(
+            client, "GET", "http://paymob.test/transactions/1"
+        )
+
+        assert response.status_code == 503
+        assert retries == 0
@@ -0,0 +1,53 @@
+import time
+import pytest
+from django.core.cache import cache
+from ..services.auth_token import AuthTokenManager
+
+
+@pytest.fixture
+def token_manager():
+    cache.delete("test:token")
+    cache.delete("test:token:refreshing")
+    return AuthTokenManager("test:token")
+
+
+class TestAuthTokenManager:
+    def test_token_fetched_once_and_served_locally(self, token_manager, mocker):
+        fetch = mocker.Mock(return_value="token-1")
+        cache_get = mocker.spy(cache, "get")
+
+        assert token_manager.get_token(fetch) == "token-1"
+        calls = cache_get.call_count
+        assert token_manager.get_token(fetch) == "token-1"
+
+        assert fetch.call_count == 1
+        # second call never reaches redis
+        assert cache_get.call_count == calls
+
+    def test_token_shared_between_managers(self, token_manager, mocker):
+        token_manager.get_token(mocker.Mock(return_value="token-1"))
+        other_process = AuthTokenManager("test:token")
+        fetch = mocker.Mock()
+
+        assert other_process.get_token(fetch) == "token-1"
+        assert not fetch.called
+
+    def test_near_expiry_serves_stale_token_while_refreshing(
+        self, token_manager, settings, mocker
+    ):
+        settings.PAYMOB_AUTH_REFRESH_MARGIN = 60
+        cache.set("test:token", {"token": "old", "expires_at": time.time() + 30})
+        fetch = mocker.Mock(return_value="new")
+
+        assert token_manager.get_token(fetch) == "old"
+        token_manager._refresh_thread.join(timeout=2)
+
+        assert fetch.call_count == 1
+        assert token_manager.get_token(fetch) == "new"
+        assert cache.get("test:token")["token"] == "new"
+
+    def test_expired_token_is_fetched_synchronously(self, token_manager, mocker):
+        cache.set("test:token", {"token": "old", "expires_at": time.time() - 1})
+        fetch = mocker.Mock(return_value="new")
+
+        assert token_manager.get_token(fetch) == "new"
@@ -0,0 +1,130 @@
+import pytest
+import requests
+from django.core.cache import cache
+from ..models import Transaction
+from ..services import circuit_breaker
+from ..services.circuit_breaker import CircuitBreaker, CircuitOpenError
+from ..services.orchestration import TransactionOrchestrationService as tos
+from ..services.paymob import ProviderUnavailableError
+
+
+@pytest.fixture
+def breaker(settings):
+    settings.PAYMOB_CIRCUIT_BREAKER = {
+        "window": 60,
+        "min_calls": 4,
+        "error_rate": 0.5,
+        "slow_call_seconds": 5,
+        "slow_call_rate": 0.5,
+        "open_seconds": 30,
+    }
+    cache.clear()
+    return CircuitBreaker("test:endpoint")
+
+
+def _fail(breaker):
+    with pytest.raises(requests.ConnectionError):
+        with breaker.guard():
+            raise requests.ConnectionError("upstream down")
+
+
+class TestCircuitBreaker:
+    def test_opens_when_error_rate_crosses_threshold(self, breaker):
+        with breaker.guard():
+            pass
+        _fail(breaker)
+        _fail(breaker)
+        assert breaker.state()[0] == circuit_breaker.CLOSED
+
+        _fail(breaker)
+
+        assert breaker.state()[0] == circuit_breaker.OPEN
+        with pytest.raises(CircuitOpenError) as exc:
+            with breaker.guard():
+                pytest.fail("call went through an open circuit")
+        assert exc.value.retry_after > 0
+
+    def test_client_errors_do_not_trip(self, breaker):
+        response = requests.Response()
+        response.status_code = 400
+        for _ in range(5):
+            with pytest.raises(requests.HTTPError):
+                with breaker.guard():
+                    raise requests.HTTPError(response=response)
+
+        assert breaker.state()[0] == circuit_breaker.CLOSED
+
+    def test_opens_on_slow_calls(self, breaker, mocker):
+        mocker.patch.object(circuit_breaker.time, "monotonic", side_effect=[0, 6] * 4)
+        for _ in range(4):
+            with breaker.guard():
+                pass
+
+        assert breaker.state()[0] == circuit_breaker.OPEN
+
+    def test_half_open_allows_one_probe_and_closes_on_success(self, breaker, mocker):
+        breaker.open()
+        now = circuit_breaker.time.time()
+        mocker.patch.object(circuit_breaker.time, "time", return_value=now + 31)
+        assert breaker.state()[0] == circuit_breaker.HALF_OPEN
+
+        with breaker.guard():
+            # a second caller is refused while the probe runs
+            with pytest.raises(CircuitOpenError):
+                breaker.before_call()
+
+        assert breaker.state()[0] == circuit_breaker.CLOSED
+
+    def test_failed_probe_reopens(self, breaker, mocker):
+        breaker.open()
+        now = circuit_breaker.time.time()
+        mocker.patch.object(circuit_breaker.time, "time", return_value=now + 31)
+
+        _fail(breaker)
+
+        state, remaining = breaker.state()
+        assert state == circuit_breaker.OPEN
+        assert remaining == pytest.approx(30)
+
+
+@pytest.mark.django_db
+def test_open_circuit_defers_orchestration(mocker, customer_factory):
+    customer = customer_factory()
+    transaction = Transaction.objects.create(customer=customer, amount=40)
+    mock_paymob = mocker.patch(
+        "zoolflow.transactions.services.orchestration.PayMobClient",
+    )
+    mock_paymob.return_value.create_order.return_value = "paymob-order-7"
+    mock_paymob.return_value.payment_key_token.side_effect = ProviderUnavailableError(
+        "unavailable", retry_after=12
+    )
+    deferred = mocker.patch(
+        "zoolflow.transactions.tasks.orchestrate_transaction_task.apply_async"
+    )
+    mocker.patch(
+        "zoolflow.transactions.services.orchestration.db_transaction.on_commit",
+        lambda func: func(),
+    )
+
+    tos(customer=customer)._interact_with_provider(transaction)
+
+    transaction.refresh_from_db()
+    assert transaction.state == Transaction.TransactionState.INITIATED
+    # the created order is kept so the retry doesn't create a second one
+    assert transaction.order_id == "paymob-order-7"
+    deferred.assert_called_once_with((transaction.id,), countdown=12)
+
+
+@pytest.mark.django_db
+def test_staff_reads_circuit_states(api_client, customer_factory):
+    staff = customer_factory(
+        username="circuit_staff",
+        email="circuit_staff@example.com",
+        role_management="STAFF",
+    )
+    api_client.force_authenticate(user=staff.user)
+
+    response = api_client.get("/api/v1/transactions/circuits/")
+
+    assert response.status_code == 200
+    assert "paymob:order" in {item["name"] for item in response.data}
@@ -0,0 +1,92 @@
+import pytest
+from django.urls import reverse
+from config import db_router
+from config.db_router import (
+    ReplicaRouter,
+    is_pinned_to_primary,
+    pin_to_primary,
+    use_replica,
+)
+from ..models import Transaction
+
+
+class TestReplicaRouter:
+    def test_reads_go_to_a_replica_only_inside_use_replica(self, settings):
+        settings.DATABASE_REPLICAS = ["replica_0", "replica_1"]
+        router = ReplicaRouter()
+
+        assert router.db_for_read(Transaction) is None
+        with use_replica():
+            assert router.db_for_read(Transaction) in settings.DATABASE_REPLICAS
+        assert router.db_for_read(Transaction) is None
+
+    def test_primary_only_without_replicas(self, settings):
+        settings.DATABASE_REPLICAS = []
+
+        with use_replica():
+            assert ReplicaRouter().db_for_read(Transaction) is None
+
+    def test_writes_and_migrations_stay_on_the_primary(self, settings):
+        settings.DATABASE_REPLICAS = ["replica_0"]
+        router = ReplicaRouter()
+
+        with use_replica():
+            assert router.db_for_write(Transaction) == "default"
+        assert router.allow_migrate("default", "transactions")
+        assert not router.allow_migrate("replica_0", "transactions")
+
+
+@pytest.mark.django_db
+class TestReplicaReadMixin:
+    @pytest.fixture
+    def customer(self, customer_factory, settings):
+        # the primary stands in for the replica, the routing is what's checked
+        settings.DATABASE_REPLICAS = ["default"]
+        customer = customer_factory(
+            username="replica_customer",
+            email="replica_customer@example.com",
+            role_management="CUSTOMER",
+        )
+        customer.is_verified = True
+        customer.save(update_fields=["is_verified"])
+        return customer
+
+    def test_safe_requests_read_from_a_replica(self, api_client, customer, mocker):
+        Transaction.objects.create(customer=customer, amount=10)
+        choice = mocker.spy(db_router.random, "choice")
+
+        api_client.force_authenticate(user=customer.user)
+        response = api_client.get(reverse("transactions:transaction-list"))
+
+        assert response.status_code == 200
+        assert len(response.data["results"]) == 1
+        assert choice.called
+        # the scope ends with the request
+        assert ReplicaRouter().db_for_read(Transaction) is None
+
+    def test_write_pins_the_user_to_the_primary(self, api_client, customer, mocker):
+        Transaction.objects.create(
+            customer=customer, amount=120, idempotency_key="replica-key"
+        )
+        api_client.force_authenticate(user=customer.user)
+
+        response = api_client.post(
+            reverse("transactions:transaction-list"),
+            {"amount": "120.00"},
+            format="json",
+            HTTP_IDEMPOTENCY_KEY="replica-key",
+        )
+        assert response.status_code == 200
+        assert is_pinned_to_primary(customer.user)
+
+        choice = mocker.spy(db_router.random, "choice")
+        response = api_client.get(reverse("transactions:transaction-list"))
+        assert response.status_code == 200
+        assert not choice.called
+
+    def test_pin_expires(self, customer, settings):
+        settings.DATABASE_PRIMARY_PIN_SECONDS = 0
+
+        pin_to_primary(customer.user)
+
+        assert not is_pinned_to_primary(customer.user)
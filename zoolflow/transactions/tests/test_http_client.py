@@ -0,0 +1,62 @@
+from ..services.http_client import SessionRegistry, get_session_with_retries
+
+
+class TestSessionRegistry:
+    def test_same_host_shares_one_session(self):
+        first = get_session_with_retries("https://accept.paymob.com/api/auth/tokens")
+        second = get_session_with_retries("https://accept.paymob.com/api/ecommerce")
+        other = get_session_with_retries("https://api.mailgun.net")
+
+        assert first is second
+        assert first is not other
+
+    def test_host_retry_policy_overrides_default(self, settings):
+        settings.HTTP_CLIENT_RETRY_POLICIES = {
+            "default": {"total": 3},
+            "api.mailgun.net": {"total": 1},
+        }
+        registry = SessionRegistry()
+
+        mailgun = registry.get("api.mailgun.net").get_adapter("https://api.mailgun.net")
+        paymob = registry.get("accept.paymob.com").get_adapter("https://paymob")
+
+        assert mailgun.max_retries.total == 1
+        assert paymob.max_retries.total == 3
+
+    def test_default_policy_only_fills_in_a_missing_setting(self, settings):
+        del settings.HTTP_CLIENT_RETRY_POLICIES
+        fallback = SessionRegistry().get("accept.paymob.com")
+        settings.HTTP_CLIENT_RETRY_POLICIES = {"default": {"total": 1}}
+        configured = SessionRegistry().get("accept.paymob.com")
+
+        assert fallback.get_adapter("https://paymob").max_retries.total == 3
+        retry = configured.get_adapter("https://paymob").max_retries
+        # not merged with the fallback, no status is retried
+        assert retry.total == 1 and not retry.status_forcelist
+
+    def test_idle_session_connections_are_reaped(self, settings, mocker):
+        settings.HTTP_CLIENT_IDLE_TIMEOUT = -1
+        registry = SessionRegistry()
+        session = registry.get("accept.paymob.com")
+        close = mocker.patch.object(session, "close")
+
+        assert registry.get("accept.paymob.com") is session
+        assert close.called
+
+    def test_session_in_use_is_not_reaped(self, settings, mocker):
+        settings.HTTP_CLIENT_IDLE_TIMEOUT = -1
+        registry = SessionRegistry()
+        session = registry.get("accept.paymob.com")
+        close = mocker.patch.object(session, "close")
+        # another thread is waiting on the upstream's answer
+        session.in_flight = 1
+
+        assert registry.get("accept.paymob.com") is session
+        assert not close.called
+
+    def test_forked_process_builds_new_sessions(self, mocker):
+        registry = SessionRegistry()
+        parent_session = registry.get("accept.paymob.com")
+        mocker.patch("os.getpid", return_value=-1)
+
+        assert registry.get("accept.paymob.com") is not parent_session
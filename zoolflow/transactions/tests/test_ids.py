@@ -0,0 +1,31 @@
+import uuid
+import pytest
+from ..models import Transaction
+from ..services.ids import uuid7, uuid7_merchant_order_id
+
+
+def test_uuid7_is_versioned_and_time_ordered():
+    ids = [uuid7() for _ in range(5000)]
+
+    assert all(value.version == 7 for value in ids)
+    assert all(value.variant == uuid.RFC_4122 for value in ids)
+    # strictly increasing within the process, even inside one millisecond
+    assert ids == sorted(ids) and len(set(ids)) == len(ids)
+
+
+def test_merchant_order_ids_sort_as_text_in_creation_order():
+    ids = [uuid7_merchant_order_id() for _ in range(1000)]
+
+    assert ids == sorted(ids)
+    assert all(value.startswith("ORD-") and len(value) == 40 for value in ids)
+
+
+@pytest.mark.django_db
+def test_generator_is_pluggable(settings, customer_factory):
+    settings.MERCHANT_ORDER_ID_GENERATOR = (
+        "zoolflow.transactions.services.ids.uuid4_merchant_order_id"
+    )
+
+    transaction = Transaction.objects.create(customer=customer_factory(), amount=10)
+
+    assert uuid.UUID(transaction.merchant_order_id[4:]).version == 4
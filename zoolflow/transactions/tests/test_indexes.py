@@ -0,0 +1,58 @@
+import pytest
+from django.db import connection
+from ..models import Transaction
+
+STATES = [choice for choice, _ in Transaction.TransactionState.choices]
+
+
+@pytest.fixture
+def seeded_transactions(customer_factory):
+    """Seed enough rows over a few customers for the planner to prefer indexes"""
+    customers = [
+        customer_factory(username=f"planner_{index}", email=f"planner_{index}@x.com")
+        for index in range(5)
+    ]
+    Transaction.objects.bulk_create(
+        Transaction(
+            customer=customers[index % len(customers)],
+            amount=index + 1,
+            state=STATES[index % len(STATES)],
+        )
+        for index in range(2000)
+    )
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+        if connection.vendor == "postgresql":
+            # table is still small, make the planner show whether an index fits
+            cursor.execute("SET LOCAL enable_seqscan = off")
+    return customers
+
+
+@pytest.mark.django_db
+class TestTransactionIndexes:
+    def test_customer_listing_uses_customer_created_index(self, seeded_transactions):
+        plan = Transaction.objects.filter(customer=seeded_transactions[0]).explain()
+
+        assert "txn_customer_created_idx" in plan
+
+    def test_staff_state_filter_uses_state_created_index(self, seeded_transactions):
+        plan = (
+            Transaction.objects.filter(state=Transaction.TransactionState.FAILED)
+            .order_by("created_at")
+            .explain()
+        )
+
+        assert "txn_state_created_idx" in plan
+
+    @pytest.mark.skipif(
+        connection.vendor != "postgresql",
+        reason="sqlite only matches partial indexes against literal predicates",
+    )
+    def test_unsettled_sweep_uses_partial_index(self, seeded_transactions):
+        plan = (
+            Transaction.objects.filter(id__gt=0, state__in=Transaction.UNSETTLED_STATES)
+            .order_by("id")
+            .explain()
+        )
+
+        assert "txn_unsettled_idx" in plan
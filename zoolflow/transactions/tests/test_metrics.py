@@ -0,0 +1,76 @@
+import pytest
+import requests
+from django.urls import reverse
+from ..services import metrics
+from ..services.metrics import MetricsRegistry, track_provider_call
+
+
+@pytest.fixture
+def registry(mocker):
+    registry = MetricsRegistry()
+    registry._store = metrics._LocalStore()
+    mocker.patch.object(metrics, "registry", registry)
+    return registry
+
+
+def _response(mocker, status_code=200, content=b'{"id": 1}', retries=0):
+    response = mocker.Mock(status_code=status_code, content=content)
+    response.request.body = b'{"amount_cents": 100}'
+    response.raw.retries.history = [object()] * retries
+    return response
+
+
+class TestTrackProviderCall:
+    def test_records_latency_status_retries_and_bytes(self, registry, mocker):
+        with track_provider_call("paymob", "paymob:order") as call:
+            call.response = _response(mocker, retries=2)
+
+        text = registry.render()
+        labels = 'endpoint="paymob:order",upstream="paymob"'
+        # label sets are rendered in name order
+        assert "# TYPE provider_request_duration_seconds histogram" in text
+        assert f"provider_request_duration_seconds_count{{{labels}}} 1" in text
+        assert (
+            'provider_request_duration_seconds_bucket{endpoint="paymob:order",le="+Inf",upstream="paymob"} 1'
+            in text
+        )
+        assert (
+            'provider_requests_total{endpoint="paymob:order",status="200",upstream="paymob"} 1'
+            in text
+        )
+        assert f"provider_request_retries_total{{{labels}}} 2" in text
+        assert f"provider_response_bytes_total{{{labels}}} 9" in text
+        assert f"provider_request_bytes_total{{{labels}}} 21" in text
+
+    def test_timeout_is_counted_and_reraised(self, registry):
+        with pytest.raises(requests.Timeout):
+            with track_provider_call("mailgun", "mailgun:messages"):
+                raise requests.Timeout("read timed out")
+
+        assert 'status="timeout",upstream="mailgun"} 1' in registry.render()
+
+
+@pytest.mark.django_db
+class TestMetricsView:
+    def test_scraper_token_reads_metrics_with_circuit_gauges(
+        self, api_client, registry, settings
+    ):
+        settings.METRICS_AUTH_TOKEN = "scrape-secret"
+        registry.inc("provider_requests_total", {"upstream": "paymob"})
+
+        response = api_client.get(
+            reverse("metrics"), HTTP_AUTHORIZATION="Metrics scrape-secret"
+        )
+
+        body = response.content.decode()
+        assert response.status_code == 200
+        assert response["Content-Type"].startswith("text/plain")
+        assert 'provider_requests_total{upstream="paymob"} 1' in body
+        assert 'provider_circuit_state{endpoint="paymob:order"} 0' in body
+
+    def test_wrong_token_is_refused(self, api_client, settings):
+        settings.METRICS_AUTH_TOKEN = "scrape-secret"
+
+        response = api_client.get(reverse("metrics"), HTTP_AUTHORIZATION="Metrics nope")
+
+        assert response.status_code in (401, 403)
@@ -1,7 +1,12 @@
+import threading
 import pytest
-from django.db import transaction as db_transaction
+from django.db import connections, transaction as db_transaction
 from ..models import Transaction
-from ..services.orchestration import TransactionOrchestrationService as tos
+from ..services.orchestration import (
+    TransactionOrchestrationService as tos,
+    TransactionOrchestrationServiceError,
+)
+from ..services.paymob import ProviderServiceError
 
 
 @pytest.mark.django_db
@@ -44,3 +49,314 @@ def test_transaction_invalid_state_transition(customer_factory):
 
     with pytest.raises(ValueError):
         transaction.transition_to(Transaction.TransactionState.SUCCEEDED)
+
+
+def _paymob_flags(**overrides):
+    flags = {
+        "success": True,
+        "pending": False,
+        "is_auth": False,
+        "is_capture": False,
+        "is_voided": False,
+        "is_refunded": False,
+        "error_occured": False,
+        "is_standalone_payment": True,
+    }
+    flags.update(overrides)
+    return flags
+
+
+@pytest.mark.django_db
+def test_update_state_from_trusted_flags_skips_provider(mocker, customer_factory):
+    customer = customer_factory()
+    transaction = Transaction.objects.create(
+        customer=customer,
+        amount=50,
+        state=Transaction.TransactionState.PENDING,
+    )
+    mock_paymob = mocker.patch(
+        "zoolflow.transactions.services.orchestration.PayMobClient",
+    )
+    mocker.patch("zoolflow.notifications.tasks.transaction_state_email_task.delay")
+
+    state = tos.update_and_mail_state(
+        transaction.merchant_order_id, "373906620", flags=_paymob_flags()
+    )
+
+    transaction.refresh_from_db()
+    assert state == Transaction.TransactionState.SUCCEEDED
+    assert transaction.state == Transaction.TransactionState.SUCCEEDED
+    assert transaction.transaction_id == "373906620"
+    assert not mock_paymob.called
+
+
+@pytest.mark.django_db
+def test_reconciliation_applies_provider_state_on_mismatch(mocker, customer_factory):
+    from ..tasks import reconcile_webhook_state_task
+
+    customer = customer_factory()
+    transaction = Transaction.objects.create(
+        customer=customer,
+        amount=50,
+        state=Transaction.TransactionState.SUCCEEDED,
+        transaction_id="373906621",
+    )
+    mock_paymob = mocker.patch("zoolflow.transactions.tasks.PayMobClient")
+    mock_paymob.return_value.get_transaction_flags.return_value = _paymob_flags(
+        is_refunded=True
+    )
+    mocker.patch("zoolflow.notifications.tasks.transaction_state_email_task.delay")
+
+    reconcile_webhook_state_task(
+        transaction.merchant_order_id,
+        "373906621",
+        Transaction.TransactionState.SUCCEEDED,
+    )
+
+    transaction.refresh_from_db()
+    assert transaction.state == Transaction.TransactionState.REFUNDED
+
+
+@pytest.mark.django_db
+def test_update_state_fetches_once_and_hands_details_to_email(
+    mocker, customer_factory, django_assert_num_queries
+):
+    customer = customer_factory()
+    transaction = Transaction.objects.create(
+        customer=customer,
+        amount=50,
+        state=Transaction.TransactionState.PENDING,
+    )
+    mock_delay = mocker.patch(
+        "zoolflow.notifications.tasks.transaction_state_email_task.delay"
+    )
+    mocker.patch.object(db_transaction, "on_commit", lambda func: func())
+
+    # conditional update, then the customer and user for the email
+    with django_assert_num_queries(2):
+        tos.update_and_mail_state(
+            transaction.merchant_order_id, "373906622", flags=_paymob_flags()
+        )
+
+    mock_delay.assert_called_once_with(
+        "373906622",
+        {
+            "email": customer.user.email,
+            "username": customer.user.username,
+            "state": Transaction.TransactionState.SUCCEEDED,
+            "state_display": "Succeeded",
+        },
+    )
+
+
+@pytest.mark.django_db
+def test_duplicate_webhook_updates_nothing_and_mails_nothing(mocker, customer_factory):
+    customer = customer_factory()
+    transaction = Transaction.objects.create(
+        customer=customer,
+        amount=50,
+        state=Transaction.TransactionState.SUCCEEDED,
+        transaction_id="373906623",
+        version=2,
+    )
+    mock_delay = mocker.patch(
+        "zoolflow.notifications.tasks.transaction_state_email_task.delay"
+    )
+    mocker.patch.object(db_transaction, "on_commit", lambda func: func())
+
+    state = tos.update_and_mail_state(
+        transaction.merchant_order_id, 373906623, flags=_paymob_flags()
+    )
+
+    transaction.refresh_from_db()
+    assert state == Transaction.TransactionState.SUCCEEDED
+    assert transaction.version == 2
+    assert not mock_delay.called
+
+
+@pytest.mark.django_db
+def test_refused_transition_leaves_the_row_unchanged(mocker, customer_factory):
+    customer = customer_factory()
+    transaction = Transaction.objects.create(
+        customer=customer, amount=50, state=Transaction.TransactionState.FAILED
+    )
+    mocker.patch("zoolflow.notifications.tasks.transaction_state_email_task.delay")
+
+    with pytest.raises(TransactionOrchestrationServiceError) as e:
+        tos.update_and_mail_state(
+            transaction.merchant_order_id, "373906624", flags=_paymob_flags()
+        )
+
+    transaction.refresh_from_db()
+    assert e.value.details == "Transition"
+    assert e.value.message == "invalid transition failed -> succeeded"
+    assert transaction.state == Transaction.TransactionState.FAILED
+    assert transaction.transaction_id is None
+
+
+@pytest.mark.django_db
+def test_conditional_transition_checks_predecessors_and_version(customer_factory):
+    states = Transaction.TransactionState
+    transaction = Transaction.objects.create(
+        customer=customer_factory(), amount=50, state=states.PENDING
+    )
+    queryset = Transaction.objects.filter(id=transaction.id)
+
+    assert Transaction.STATE_PREDECESSORS[states.SUCCEEDED] == {
+        states.PENDING,
+        states.AUTHORIZED,
+        states.SUCCEEDED,
+    }
+    assert queryset.transition(states.AUTHORIZED, version=0) == 1
+    # a writer holding the old version lost the race
+    assert queryset.transition(states.SUCCEEDED, version=0) == 0
+    # INITIATED is not reachable from AUTHORIZED
+    assert queryset.transition(states.INITIATED) == 0
+
+    transaction.refresh_from_db()
+    assert (transaction.state, transaction.version) == (states.AUTHORIZED, 1)
+
+
+@pytest.mark.django_db
+def test_batch_orchestration_reports_per_item_results(mocker, customer_factory):
+    customer = customer_factory()
+    existing = Transaction.objects.create(
+        customer=customer, amount=10, idempotency_key="batch-key-1"
+    )
+    mock_paymob = mocker.patch(
+        "zoolflow.transactions.services.orchestration.PayMobClient",
+    )
+    instance = mock_paymob.return_value
+    instance.create_order.side_effect = [
+        "paymob-order-1",
+        ProviderServiceError("provider API fail"),
+    ]
+    instance.payment_key_token.return_value = "batch-payment-token"
+
+    results = tos(customer=customer).create_transactions(
+        [
+            {"amount": 10, "idempotency_key": "batch-key-1"},
+            {"amount": 20, "idempotency_key": "batch-key-2"},
+            {"amount": 30},
+        ]
+    )
+
+    (replayed_tx, replayed, _), (ok_tx, _, ok_error), (failed_tx, _, error) = results
+    assert replayed and replayed_tx == existing
+    assert ok_error is None
+    assert ok_tx.order_id == "paymob-order-1"
+    assert ok_tx.state == Transaction.TransactionState.PENDING
+    assert error.details == "Provider interaction failed"
+    assert failed_tx.state == Transaction.TransactionState.FAILED
+    assert Transaction.objects.filter(customer=customer).count() == 3
+
+
+@pytest.mark.django_db
+def test_batch_orchestration_on_worker_threads_keeps_item_order(
+    mocker, customer_factory, settings
+):
+    settings.TRANSACTION_BATCH_MAX_WORKERS = 3
+    customer = customer_factory()
+    threads = set()
+    stored = {}
+
+    def provider(**kwargs):
+        client = mocker.Mock()
+        if kwargs.get("amount_cents") == 2000:
+            client.create_order.side_effect = ProviderServiceError("provider API fail")
+        else:
+            client.create_order.return_value = (
+                f"paymob-order-{kwargs.get('amount_cents')}"
+            )
+        client.payment_key_token.return_value = "batch-payment-token"
+        return client
+
+    def define_provider_attribute(transaction, order_id, payment_token):
+        threads.add(threading.get_ident())
+        stored[transaction.id] = order_id
+
+    def fail_on_provider_error(transaction, e):
+        threads.add(threading.get_ident())
+        raise TransactionOrchestrationServiceError(
+            details="Provider interaction failed", message=e.message
+        )
+
+    mocker.patch(
+        "zoolflow.transactions.services.orchestration.PayMobClient",
+        side_effect=provider,
+    )
+    # the workers' connections don't see the test's uncommitted rows,
+    # keep the provider fields writes in memory
+    mocker.patch.object(
+        tos, "_define_provider_attribute", staticmethod(define_provider_attribute)
+    )
+    mocker.patch.object(
+        tos, "_fail_on_provider_error", staticmethod(fail_on_provider_error)
+    )
+
+    results = tos(customer=customer).create_transactions(
+        [{"amount": 10}, {"amount": 20}, {"amount": 30}, {"amount": 40}]
+    )
+
+    assert threads and threading.get_ident() not in threads
+    assert [tx.amount for tx, _, _ in results] == [10, 20, 30, 40]
+    assert [stored.get(tx.id) for tx, _, _ in results] == [
+        "paymob-order-1000",
+        None,
+        "paymob-order-3000",
+        "paymob-order-4000",
+    ]
+    errors = [error for _, _, error in results]
+    assert errors[0] is None and errors[2] is None and errors[3] is None
+    assert errors[1].details == "Provider interaction failed"
+
+
+@pytest.mark.django_db(transaction=True)
+def test_batch_orchestration_workers_write_to_the_database(
+    mocker, customer_factory, settings
+):
+    settings.TRANSACTION_BATCH_MAX_WORKERS = 2
+    # committed users fire their verification email on commit
+    mocker.patch("zoolflow.users.signals.VerificationCodeService")
+    customer = customer_factory()
+
+    def provider(**kwargs):
+        client = mocker.Mock()
+        if kwargs.get("amount_cents") == 2000:
+            client.create_order.side_effect = ProviderServiceError("provider API fail")
+        else:
+            client.create_order.return_value = (
+                f"paymob-order-{kwargs.get('amount_cents')}"
+            )
+        client.payment_key_token.return_value = "batch-payment-token"
+        return client
+
+    mocker.patch(
+        "zoolflow.transactions.services.orchestration.PayMobClient",
+        side_effect=provider,
+    )
+    close_all = mocker.spy(connections, "close_all")
+
+    results = tos(customer=customer).create_transactions(
+        [{"amount": 10}, {"amount": 20}, {"amount": 30}, {"amount": 40}]
+    )
+
+    # each worker closed its own connection after every transaction
+    assert close_all.call_count == 4
+    # results are the rows the workers wrote, re-read in items order
+    assert [tx.amount for tx, _, _ in results] == [10, 20, 30, 40]
+    assert [tx.order_id for tx, _, _ in results] == [
+        "paymob-order-1000",
+        None,
+        "paymob-order-3000",
+        "paymob-order-4000",
+    ]
+    assert [tx.state for tx, _, _ in results] == [
+        Transaction.TransactionState.PENDING,
+        Transaction.TransactionState.FAILED,
+        Transaction.TransactionState.PENDING,
+        Transaction.TransactionState.PENDING,
+    ]
+    stored = Transaction.objects.get(id=results[0][0].id)
+    assert stored.payment_token == "batch-payment-token"
+    assert results[1][2].details == "Provider interaction failed"
@@ -1,7 +1,9 @@
 import pytest
 import requests
 from rest_framework import status
+from zoolflow.customers.services.helpers import SupportedCountryError
 from ..services.paymob import ProviderServiceError
+from ..services.payloads import PaymentContext, order_payload, payment_token_payload
 
 
 @pytest.mark.django_db()
@@ -48,3 +50,26 @@ class TestPayMobService:
                 requested_field="not_found",
                 field_name="testfield",
             )
+
+
+@pytest.mark.django_db()
+class TestPaymentContext:
+    def test_payloads_share_single_query_context(
+        self, customer_factory, django_assert_num_queries
+    ):
+        customer = customer_factory()
+        customer = type(customer).objects.get(pk=customer.pk)
+
+        with django_assert_num_queries(1):
+            context = PaymentContext.for_customer(customer)
+            order = order_payload(1000, "token", "ORD-1", context)
+            payment = payment_token_payload(1000, "token", "order-1", context)
+
+        assert order["currency"] == payment["currency"] == "EGP"
+        assert payment["billing_data"]["email"] == customer.user.email
+
+    def test_missing_main_address_raises(self, customer_factory):
+        customer = customer_factory(with_address=False)
+
+        with pytest.raises(SupportedCountryError):
+            PaymentContext.for_customer(customer)
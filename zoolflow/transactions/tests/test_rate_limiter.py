@@ -0,0 +1,71 @@
+import pytest
+from ..services import rate_limiter
+from ..services.paymob import PayMobClient, ProviderUnavailableError
+from ..services.rate_limiter import RateLimiter, RateLimitExceeded
+
+
+@pytest.fixture
+def limits(settings):
+    settings.PROVIDER_RATE_LIMITS = {
+        "upstream": {"rate": 10, "burst": 2},
+        "upstream:slow": {"rate": 1, "burst": 1},
+    }
+    rate_limiter._local_buckets = rate_limiter._LocalBuckets()
+    return settings.PROVIDER_RATE_LIMITS
+
+
+class TestRateLimiter:
+    def test_burst_then_wait_time(self, limits):
+        limiter = RateLimiter("upstream:orders")
+
+        assert limiter.try_acquire() == 0
+        assert limiter.try_acquire() == 0
+        # provider budget applies, next token in 1/rate seconds
+        assert limiter.try_acquire() == pytest.approx(0.1, abs=0.01)
+
+    def test_endpoint_budget_overrides_provider(self, limits):
+        limiter = RateLimiter("upstream:slow")
+
+        limiter.try_acquire()
+
+        assert limiter.try_acquire() == pytest.approx(1, abs=0.01)
+
+    def test_unbudgeted_upstream_is_not_limited(self, limits):
+        limiter = RateLimiter("other")
+
+        assert all(limiter.try_acquire() == 0 for _ in range(100))
+
+    def test_acquire_blocks_within_deadline(self, limits, mocker):
+        sleep = mocker.patch.object(rate_limiter.time, "sleep")
+        limiter = RateLimiter("upstream")
+        limiter.try_acquire(2)
+        mocker.patch.object(limiter, "try_acquire", side_effect=[0.1, 0])
+
+        limiter.acquire(timeout=1)
+
+        sleep.assert_called_once_with(0.1)
+
+    def test_acquire_raises_retry_after_past_deadline(self, limits):
+        limiter = RateLimiter("upstream:slow")
+        limiter.try_acquire()
+
+        with pytest.raises(RateLimitExceeded) as exc:
+            limiter.acquire(timeout=0.5)
+
+        assert exc.value.retry_after == pytest.approx(1, abs=0.01)
+
+
+def test_spent_paymob_budget_becomes_provider_unavailable(mocker, settings):
+    settings.PROVIDER_RATE_LIMIT_MAX_WAIT = 0
+    mocker.patch.object(rate_limiter.RateLimiter, "try_acquire", return_value=3)
+    session = mocker.Mock()
+    mocker.patch(
+        "zoolflow.transactions.services.paymob.get_session_with_retries",
+        return_value=session,
+    )
+
+    with pytest.raises(ProviderUnavailableError) as exc:
+        PayMobClient().inquire_order_transaction("order-1")
+
+    assert exc.value.retry_after == 3
+    assert not session.post.called
@@ -0,0 +1,137 @@
+from datetime import timedelta
+import pytest
+from django.core.cache import cache
+from django.utils import timezone
+from ..models import Transaction
+from ..services.reconciliation import TransactionReconciliationService
+
+SUCCESS_FLAGS = {
+    "id": 555001,
+    "success": True,
+    "pending": False,
+    "is_auth": False,
+    "is_capture": False,
+    "is_voided": False,
+    "is_refunded": False,
+    "error_occured": False,
+    "is_standalone_payment": True,
+}
+
+
+@pytest.fixture
+def mock_client(mocker):
+    client = mocker.patch(
+        "zoolflow.transactions.services.reconciliation.PayMobClient"
+    ).return_value
+    cache.delete("transactions:reconciliation:checkpoint")
+    return client
+
+
+@pytest.mark.django_db
+class TestTransactionReconciliation:
+    def test_stuck_pending_transaction_is_reconciled(
+        self, customer_factory, mock_client
+    ):
+        customer = customer_factory()
+        stuck = Transaction.objects.create(
+            customer=customer,
+            amount=20,
+            order_id="order-1",
+            state=Transaction.TransactionState.PENDING,
+        )
+        Transaction.objects.create(
+            customer=customer,
+            amount=20,
+            state=Transaction.TransactionState.FAILED,
+        )
+        mock_client.inquire_order_transaction.return_value = SUCCESS_FLAGS
+
+        stats = TransactionReconciliationService(min_age=0).run()
+
+        stuck.refresh_from_db()
+        assert stats["scanned"] == 1
+        assert stats["updated"] == 1
+        assert stats["finished"] is True
+        assert stuck.state == Transaction.TransactionState.SUCCEEDED
+        assert stuck.transaction_id == "555001"
+
+    def test_checkpoint_lets_next_run_resume(self, customer_factory, mock_client):
+        customer = customer_factory()
+        first, second = [
+            Transaction.objects.create(
+                customer=customer,
+                amount=20,
+                transaction_id=f"txn-{index}",
+                state=Transaction.TransactionState.AUTHORIZED,
+            )
+            for index in range(2)
+        ]
+        mock_client.get_transaction_flags.return_value = {
+            **SUCCESS_FLAGS,
+            "id": None,
+            "success": False,
+            "is_voided": True,
+        }
+        service = TransactionReconciliationService(batch_size=1, min_age=0)
+
+        stats = service.run(max_batches=1)
+        assert stats["finished"] is False
+        assert cache.get(service.checkpoint_key) == first.id
+
+        service.run()
+        mock_client.get_transaction_flags.assert_called_with("txn-1")
+        second.refresh_from_db()
+        assert second.state == Transaction.TransactionState.VOIDED
+        assert cache.get(service.checkpoint_key) is None
+
+    def test_provider_failure_is_counted_and_skipped(
+        self, customer_factory, mock_client
+    ):
+        from ..services.paymob import ProviderServiceError
+
+        Transaction.objects.create(
+            customer=customer_factory(),
+            amount=20,
+            order_id="order-2",
+            state=Transaction.TransactionState.PENDING,
+        )
+        mock_client.inquire_order_transaction.side_effect = ProviderServiceError("down")
+
+        stats = TransactionReconciliationService(min_age=0).run()
+
+        assert stats["failed"] == 1
+        assert stats["updated"] == 0
+
+    def test_abandoned_order_fails_and_old_ones_are_left_alone(
+        self, customer_factory, mock_client
+    ):
+        customer = customer_factory()
+        abandoned, recent, ancient = [
+            Transaction.objects.create(
+                customer=customer,
+                amount=20,
+                order_id=f"order-{age}",
+                state=Transaction.TransactionState.PENDING,
+            )
+            for age in (2, 0, 30)
+        ]
+        for tx, age in ((abandoned, 2), (ancient, 30)):
+            # created_at is auto_now_add, age it after the insert
+            Transaction.objects.filter(pk=tx.pk).update(
+                created_at=timezone.now() - timedelta(days=age)
+            )
+        # the order exists, the customer never paid it
+        mock_client.inquire_order_transaction.return_value = {"order": {"id": 1}}
+
+        stats = TransactionReconciliationService(min_age=0).run()
+
+        assert stats["scanned"] == 2
+        assert (stats["unpaid"], stats["updated"], stats["failed"]) == (2, 1, 0)
+        abandoned.refresh_from_db()
+        recent.refresh_from_db()
+        assert abandoned.state == Transaction.TransactionState.FAILED
+        assert recent.state == Transaction.TransactionState.PENDING
+        queried = [
+            c.args[0] for c in mock_client.inquire_order_transaction.call_args_list
+        ]
+        assert ancient.order_id not in queried
@@ -1,7 +1,16 @@
+import json
+from datetime import timedelta
 import pytest
+from django.db import connection, transaction as db_transaction
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 
 from zoolflow.transactions.models import Transaction
+from zoolflow.transactions.services.idempotency import (
+    IdempotentResponseCache,
+    in_flight_timeout,
+)
 
 
 @pytest.mark.django_db
@@ -27,7 +36,7 @@ class TestTransactionApi:
         response = api_client.get(reverse("transactions:transaction-list"))
 
         assert response.status_code == 200
-        assert response.data["count"] == 1
+        assert len(response.data["results"]) == 1
         assert response.data["results"][0]["amount"] == "10.00"
 
     def test_staff_can_list_all_transactions(
@@ -56,7 +65,7 @@ class TestTransactionApi:
         response = api_client.get(reverse("transactions:transaction-list"))
 
         assert response.status_code == 200
-        assert response.data["count"] == 2
+        assert len(response.data["results"]) == 2
 
     def test_unverified_customer_cannot_create_transaction(
         self, api_client, customer_factory, mocker
@@ -113,3 +122,501 @@ class TestTransactionApi:
         assert response.status_code == 200
         assert response.data["merchant_order_id"] == existing.merchant_order_id
         assert not orchestrate_spy.called
+
+    def test_async_create_returns_accepted_and_orchestrates_in_background(
+        self,
+        api_client,
+        customer_factory,
+        mocker,
+        settings,
+        django_capture_on_commit_callbacks,
+    ):
+        settings.TRANSACTION_ORCHESTRATION_ASYNC = True
+        customer = customer_factory(
+            username="async_customer",
+            email="async_customer@example.com",
+            role_management="CUSTOMER",
+        )
+        customer.is_verified = True
+        customer.save(update_fields=["is_verified"])
+        mock_paymob = mocker.patch(
+            "zoolflow.transactions.services.orchestration.PayMobClient",
+        )
+        mock_paymob.return_value.create_order.return_value = "paymob-async-id"
+        mock_paymob.return_value.payment_key_token.return_value = "async-token"
+
+        api_client.force_authenticate(user=customer.user)
+        with django_capture_on_commit_callbacks(execute=False) as callbacks:
+            response = api_client.post(
+                reverse("transactions:transaction-list"),
+                {"amount": "75.00"},
+                format="json",
+            )
+
+        assert response.status_code == 202
+        merchant_order_id = response.data["merchant_order_id"]
+        assert response.data["state_display"] == "Initiated"
+        assert not mock_paymob.return_value.create_order.called
+
+        # run the queued orchestration task (eager in tests)
+        for callback in callbacks:
+            callback()
+
+        detail = api_client.get(
+            reverse(
+                "transactions:transaction-detail",
+                kwargs={"merchant_order_id": merchant_order_id},
+            )
+        )
+        assert detail.status_code == 200
+        assert detail.data["state_display"] == "Pending"
+        assert detail.data["payment_token"] == "async-token"
+
+        # the pk the detail route took before still works
+        by_pk = api_client.get(
+            reverse(
+                "transactions:transaction-detail",
+                kwargs={
+                    "merchant_order_id": Transaction.objects.get(
+                        merchant_order_id=merchant_order_id
+                    ).pk
+                },
+            )
+        )
+        assert by_pk.status_code == 200
+        assert by_pk.data["merchant_order_id"] == merchant_order_id
+
+    def test_list_pages_by_cursor_with_page_numbers_opt_in(
+        self, api_client, customer_factory
+    ):
+        customer = customer_factory(
+            username="cursor_customer",
+            email="cursor_customer@example.com",
+            role_management="CUSTOMER",
+        )
+        for amount in range(1, 4):
+            Transaction.objects.create(customer=customer, amount=amount)
+        api_client.force_authenticate(user=customer.user)
+        url = reverse("transactions:transaction-list")
+
+        first = api_client.get(url, {"page_size": 2})
+        second = api_client.get(first.data["next"])
+        numbered = api_client.get(url, {"page": 1, "page_size": 2})
+
+        assert "count" not in first.data
+        assert [row["amount"] for row in first.data["results"]] == ["3.00", "2.00"]
+        assert [row["amount"] for row in second.data["results"]] == ["1.00"]
+        assert second.data["next"] is None
+        assert numbered.data["count"] == 3
+
+    def test_idempotent_replay_is_served_from_cache(
+        self, api_client, customer_factory, mocker
+    ):
+        customer = customer_factory(
+            username="cached_customer",
+            email="cached_customer@example.com",
+            role_management="CUSTOMER",
+        )
+        customer.is_verified = True
+        customer.save(update_fields=["is_verified"])
+        mock_paymob = mocker.patch(
+            "zoolflow.transactions.services.orchestration.PayMobClient",
+        )
+        mock_paymob.return_value.create_order.return_value = "paymob-order"
+        mock_paymob.return_value.payment_key_token.return_value = "payment-token"
+        # run the provider interaction as it runs outside the test transaction
+        mocker.patch.object(db_transaction, "on_commit", lambda func: func())
+        api_client.force_authenticate(user=customer.user)
+        url = reverse("transactions:transaction-list")
+
+        created = api_client.post(
+            url, {"amount": "15.00"}, format="json", HTTP_IDEMPOTENCY_KEY="cache-001"
+        )
+        with CaptureQueriesContext(connection) as queries:
+            replay = api_client.post(
+                url,
+                {"amount": "15.00"},
+                format="json",
+                HTTP_IDEMPOTENCY_KEY="cache-001",
+            )
+
+        assert created.status_code == replay.status_code == 201
+        assert replay.data == created.data
+        assert not any("transactions_transaction" in q["sql"] for q in queries)
+
+    def test_accepted_replay_keeps_status_with_current_transaction(
+        self,
+        api_client,
+        customer_factory,
+        mocker,
+        settings,
+        django_capture_on_commit_callbacks,
+    ):
+        settings.TRANSACTION_ORCHESTRATION_ASYNC = True
+        customer = customer_factory(
+            username="accepted_customer",
+            email="accepted_customer@example.com",
+            role_management="CUSTOMER",
+        )
+        customer.is_verified = True
+        customer.save(update_fields=["is_verified"])
+        mock_paymob = mocker.patch(
+            "zoolflow.transactions.services.orchestration.PayMobClient",
+        )
+        mock_paymob.return_value.create_order.return_value = "paymob-accepted"
+        mock_paymob.return_value.payment_key_token.return_value = "accepted-token"
+        api_client.force_authenticate(user=customer.user)
+        url = reverse("transactions:transaction-list")
+
+        with django_capture_on_commit_callbacks(execute=True):
+            created = api_client.post(
+                url,
+                {"amount": "15.00"},
+                format="json",
+                HTTP_IDEMPOTENCY_KEY="accepted-001",
+            )
+        replay = api_client.post(
+            url, {"amount": "15.00"}, format="json", HTTP_IDEMPOTENCY_KEY="accepted-001"
+        )
+
+        assert created.status_code == replay.status_code == 202
+        assert created.data["payment_token"] is None
+        assert replay.data["merchant_order_id"] == created.data["merchant_order_id"]
+        # orchestrated since, the replay isn't the snapshot of the create
+        assert replay.data["payment_token"] == "accepted-token"
+
+    def test_in_flight_marker_outlives_the_slowest_create(self, settings):
+        settings.IDEMPOTENCY_IN_FLIGHT_TTL = None
+        settings.CONNECTION_TIMEOUT = (5, 15)
+        settings.PROVIDER_RATE_LIMIT_MAX_WAIT = 2
+        settings.HTTP_CLIENT_RETRY_POLICIES = {
+            "default": {"total": 3, "backoff_factor": 1}
+        }
+
+        # auth, order and payment key: 2s rate wait, 4 attempts of 20s, 1+2+4s backoff
+        assert in_flight_timeout() == 3 * (2 + 4 * 20 + 7)
+        settings.IDEMPOTENCY_IN_FLIGHT_TTL = 90
+        assert in_flight_timeout() == 90
+
+    def test_concurrent_duplicate_gets_conflict_while_first_is_in_flight(
+        self, api_client, customer_factory, mocker, settings
+    ):
+        settings.IDEMPOTENCY_WAIT_TIMEOUT = 0
+        customer = customer_factory(
+            username="inflight_customer",
+            email="inflight_customer@example.com",
+            role_management="CUSTOMER",
+        )
+        customer.is_verified = True
+        customer.save(update_fields=["is_verified"])
+        orchestrate_spy = mocker.patch(
+            "zoolflow.transactions.views.TransactionOrchestrationService.create_transaction"
+        )
+        IdempotentResponseCache(customer.id, "inflight-001").acquire()
+
+        api_client.force_authenticate(user=customer.user)
+        response = api_client.post(
+            reverse("transactions:transaction-list"),
+            {"amount": "15.00"},
+            format="json",
+            HTTP_IDEMPOTENCY_KEY="inflight-001",
+        )
+
+        assert response.status_code == 409
+        assert not orchestrate_spy.called
+
+    def test_staff_streams_filtered_ndjson_export(self, api_client, customer_factory):
+        customer = customer_factory(
+            username="export_customer",
+            email="export_customer@example.com",
+            role_management="CUSTOMER",
+        )
+        Transaction.objects.create(customer=customer, amount=30)
+        Transaction.objects.create(customer=customer, amount=40, state="pending")
+        staff_customer = customer_factory(
+            username="export_staff",
+            email="export_staff@example.com",
+            role_management="STAFF",
+        )
+
+        api_client.force_authenticate(user=staff_customer.user)
+        response = api_client.get(
+            reverse("transactions:transaction-export", args=["ndjson"]),
+            {"state": "pending"},
+        )
+        rows = [
+            json.loads(line)
+            for line in b"".join(response.streaming_content).decode().splitlines()
+        ]
+
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/x-ndjson"
+        assert len(rows) == 1
+        assert rows[0]["amount"] == "40.00"
+        assert rows[0]["state"] == "pending"
+
+    def test_staff_streams_csv_export_with_header(self, api_client, customer_factory):
+        customer = customer_factory(
+            username="csv_customer",
+            email="csv_customer@example.com",
+            role_management="CUSTOMER",
+        )
+        Transaction.objects.create(customer=customer, amount=30)
+        staff_customer = customer_factory(
+            username="csv_staff",
+            email="csv_staff@example.com",
+            role_management="STAFF",
+        )
+
+        api_client.force_authenticate(user=staff_customer.user)
+        response = api_client.get(
+            reverse("transactions:transaction-export", args=["csv"])
+        )
+        lines = b"".join(response.streaming_content).decode().splitlines()
+
+        assert response.status_code == 200
+        assert lines[0].startswith("id,merchant_order_id,customer_id,amount")
+        assert len(lines) == 2
+
+    def test_customer_cannot_export(self, api_client, customer_factory):
+        customer = customer_factory(
+            username="export_denied",
+            email="export_denied@example.com",
+            role_management="CUSTOMER",
+        )
+
+        api_client.force_authenticate(user=customer.user)
+        response = api_client.get(
+            reverse("transactions:transaction-export", args=["csv"])
+        )
+
+        assert response.status_code == 403
+
+    def test_batch_create_returns_multi_status_per_item(
+        self, api_client, customer_factory, mocker
+    ):
+        customer = customer_factory(
+            username="batch_customer",
+            email="batch_customer@example.com",
+            role_management="CUSTOMER",
+        )
+        customer.is_verified = True
+        customer.save(update_fields=["is_verified"])
+        Transaction.objects.create(
+            customer=customer, amount=10, idempotency_key="invoice-1"
+        )
+        mock_paymob = mocker.patch(
+            "zoolflow.transactions.services.orchestration.PayMobClient",
+        )
+        mock_paymob.return_value.create_order.return_value = "paymob-order"
+        mock_paymob.return_value.payment_key_token.return_value = "payment-token"
+
+        api_client.force_authenticate(user=customer.user)
+        response = api_client.post(
+            reverse("transactions:transaction-batch"),
+            [
+                {"amount": "10.00", "idempotency_key": "invoice-1"},
+                {"amount": "25.00", "idempotency_key": "invoice-2"},
+            ],
+            format="json",
+        )
+
+        assert response.status_code == 207
+        assert [item["status"] for item in response.data] == [200, 201]
+        assert response.data[1]["transaction"]["payment_token"] == "payment-token"
+        assert Transaction.objects.filter(customer=customer).count() == 2
+
+    def test_batch_create_rejects_duplicate_keys(self, api_client, customer_factory):
+        customer = customer_factory(
+            username="batch_duplicate",
+            email="batch_duplicate@example.com",
+            role_management="CUSTOMER",
+        )
+        customer.is_verified = True
+        customer.save(update_fields=["is_verified"])
+
+        api_client.force_authenticate(user=customer.user)
+        response = api_client.post(
+            reverse("transactions:transaction-batch"),
+            [
+                {"amount": "10.00", "idempotency_key": "same"},
+                {"amount": "20.00", "idempotency_key": "same"},
+            ],
+            format="json",
+        )
+
+        assert response.status_code == 400
+        assert not Transaction.objects.filter(customer=customer).exists()
+
+    def test_batch_create_tells_non_string_keys_apart(
+        self, api_client, customer_factory
+    ):
+        customer = customer_factory(
+            username="batch_key_type",
+            email="batch_key_type@example.com",
+            role_management="CUSTOMER",
+        )
+        customer.is_verified = True
+        customer.save(update_fields=["is_verified"])
+        url = reverse("transactions:transaction-batch")
+
+        api_client.force_authenticate(user=customer.user)
+        not_a_string = api_client.post(
+            url, [{"amount": "10.00", "idempotency_key": 12345}], format="json"
+        )
+        too_long = api_client.post(
+            url, [{"amount": "10.00", "idempotency_key": "k" * 65}], format="json"
+        )
+
+        assert not_a_string.status_code == 400
+        assert not_a_string.data["non_field_errors"] == [
+            "idempotency_key must be a string."
+        ]
+        assert too_long.status_code == 400
+        assert too_long.data["non_field_errors"] == [
+            "Idempotency-Key exceeds max length (64)."
+        ]
+        assert not Transaction.objects.filter(customer=customer).exists()
+
+    def test_lazy_payment_key_is_requested_once_at_checkout(
+        self, api_client, customer_factory, mocker, settings
+    ):
+        settings.PAYMOB_LAZY_PAYMENT_KEY = True
+        customer = customer_factory(
+            username="lazy_customer",
+            email="lazy_customer@example.com",
+            role_management="CUSTOMER",
+        )
+        customer.is_verified = True
+        customer.save(update_fields=["is_verified"])
+        mock_paymob = mocker.patch(
+            "zoolflow.transactions.services.orchestration.PayMobClient",
+        )
+        mock_paymob.return_value.create_order.return_value = "paymob-lazy-order"
+        mock_paymob.return_value.payment_key_token.return_value = "lazy-token"
+        mocker.patch.object(db_transaction, "on_commit", lambda func: func())
+
+        api_client.force_authenticate(user=customer.user)
+        created = api_client.post(
+            reverse("transactions:transaction-list"), {"amount": "80.00"}, format="json"
+        )
+        checkout_url = reverse(
+            "transactions:transaction-checkout",
+            kwargs={"merchant_order_id": created.data["merchant_order_id"]},
+        )
+        # the order exists, the payment key waits for the checkout
+        assert created.status_code == 201
+        assert created.data["state_display"] == "Pending"
+        assert created.data["payment_token"] is None
+        assert not mock_paymob.return_value.payment_key_token.called
+
+        first = api_client.post(checkout_url)
+        reload = api_client.post(checkout_url)
+
+        assert first.status_code == reload.status_code == 200
+        assert reload.data["payment_token"] == "lazy-token"
+        mock_paymob.return_value.payment_key_token.assert_called_once_with(
+            order_id="paymob-lazy-order"
+        )
+
+    def test_checkout_renews_expired_key_and_refuses_settled(
+        self, api_client, customer_factory, mocker
+    ):
+        customer = customer_factory(
+            username="checkout_customer",
+            email="checkout_customer@example.com",
+            role_management="CUSTOMER",
+        )
+        customer.is_verified = True
+        customer.save(update_fields=["is_verified"])
+        expired = Transaction.objects.create(
+            customer=customer,
+            amount=10,
+            state=Transaction.TransactionState.PENDING,
+            order_id="paymob-expired",
+            payment_token="old-token",
+            payment_token_expires_at=timezone.now() - timedelta(seconds=1),
+        )
+        settled = Transaction.objects.create(
+            customer=customer, amount=10, state=Transaction.TransactionState.SUCCEEDED
+        )
+        # paid with an eagerly minted key that hasn't expired yet
+        paid = Transaction.objects.create(
+            customer=customer,
+            amount=10,
+            state=Transaction.TransactionState.SUCCEEDED,
+            order_id="paymob-paid",
+            payment_token="paid-token",
+            payment_token_expires_at=timezone.now() + timedelta(minutes=50),
+        )
+        mock_paymob = mocker.patch(
+            "zoolflow.transactions.services.orchestration.PayMobClient",
+        )
+        mock_paymob.return_value.payment_key_token.return_value = "new-token"
+
+        api_client.force_authenticate(user=customer.user)
+        renewed = api_client.post(
+            reverse(
+                "transactions:transaction-checkout",
+                kwargs={"merchant_order_id": expired.merchant_order_id},
+            )
+        )
+        refused = api_client.post(
+            reverse(
+                "transactions:transaction-checkout",
+                kwargs={"merchant_order_id": settled.merchant_order_id},
+            )
+        )
+
+        paid_checkout = api_client.post(
+            reverse(
+                "transactions:transaction-checkout",
+                kwargs={"merchant_order_id": paid.merchant_order_id},
+            )
+        )
+
+        expired.refresh_from_db()
+        assert renewed.status_code == 200
+        assert expired.payment_token == "new-token"
+        assert expired.payment_token_expires_at > timezone.now()
+        assert refused.status_code == 409
+        assert paid_checkout.status_code == 409
+        assert "payment_token" not in paid_checkout.data
+
+    def test_staff_checkout_orchestrates_for_the_owner(
+        self, api_client, customer_factory, mocker
+    ):
+        owner = customer_factory(
+            username="checkout_owner",
+            email="checkout_owner@example.com",
+            role_management="CUSTOMER",
+        )
+        staff = customer_factory(
+            username="checkout_staff",
+            email="checkout_staff@example.com",
+            role_management="STAFF",
+        )
+        staff.is_verified = True
+        staff.save(update_fields=["is_verified"])
+        transaction = Transaction.objects.create(
+            customer=owner,
+            amount=10,
+            state=Transaction.TransactionState.PENDING,
+            order_id="paymob-owner-order",
+        )
+        mock_paymob = mocker.patch(
+            "zoolflow.transactions.services.orchestration.PayMobClient",
+        )
+        mock_paymob.return_value.payment_key_token.return_value = "owner-token"
+
+        api_client.force_authenticate(user=staff.user)
+        response = api_client.post(
+            reverse(
+                "transactions:transaction-checkout",
+                kwargs={"merchant_order_id": transaction.merchant_order_id},
+            )
+        )
+
+        assert response.status_code == 200
+        assert response.data["payment_token"] == "owner-token"
+        assert mock_paymob.call_args.kwargs["customer"] == owner
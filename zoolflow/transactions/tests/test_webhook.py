@@ -1,14 +1,17 @@
+import hashlib
+import hmac
 import pytest
+from django.core.cache import cache
+from django.urls import reverse
+from ..models import Transaction, WebhookInbox
+from ..services.inbox import drain_merchant_inbox
+from ..services.locks import CacheLock
 from ..services.webhook import WebhookService
 
 
 @pytest.mark.django_db
 class TestPayMobWebHookView:
     def test_recieved_hmac(self, api_client, mocker):
-        mocker.patch(
-            "zoolflow.transactions.services.webhook.bring_transaction",
-            return_value=None,
-        )
         recieved_hmac = (
             (
                 "8cd9658e7234fe44365814fa53508c\
@@ -58,3 +61,119 @@ class TestPayMobWebHookView:
             webhook.verify_paymob_hmac(recieved_hmac)
         except Exception as e:
             pytest.fail(f"verify_paymob_hmac raised an exception: {e}")
+
+
+def _signed_webhook(merchant_order_id, secret_key, **overrides):
+    obj = {
+        "pending": False,
+        "id": 373906620,
+        "amount_cents": 5000,
+        "created_at": "2025-11-24T15:58:08.589528",
+        "currency": "EGP",
+        "error_occured": False,
+        "has_parent_transaction": False,
+        "integration_id": 5306007,
+        "is_3d_secure": True,
+        "is_auth": False,
+        "is_capture": False,
+        "is_refunded": False,
+        "success": True,
+        "is_standalone_payment": True,
+        "is_voided": False,
+        "order": {"id": 422946804, "merchant_order_id": merchant_order_id},
+        "owner": 2045572,
+        "source_data": {"pan": "0008", "type": "card", "sub_type": "MasterCard"},
+    }
+    obj.update(overrides)
+    signature = hmac.new(
+        secret_key.encode("utf-8"),
+        WebhookService.paymob_hmac_message(obj).encode("utf-8"),
+        hashlib.sha512,
+    ).hexdigest()
+    return {"obj": obj}, signature
+
+
+@pytest.mark.django_db
+class TestWebhookInbox:
+    def test_webhook_is_stored_once_and_applied_from_inbox(
+        self,
+        api_client,
+        customer_factory,
+        settings,
+        mocker,
+        django_capture_on_commit_callbacks,
+    ):
+        settings.PAYMOB_WEBHOOK_INBOX = True
+        settings.PAYMOB_WEBHOOK_RECONCILE_SAMPLE_RATE = 0
+        mocker.patch("zoolflow.notifications.tasks.transaction_state_email_task.delay")
+        transaction = Transaction.objects.create(
+            customer=customer_factory(),
+            amount=50,
+            state=Transaction.TransactionState.PENDING,
+        )
+        payload, signature = _signed_webhook(
+            transaction.merchant_order_id, settings.HMAC_SECRET_KEY
+        )
+        url = f"{reverse('transactions:transaction_webhook')}?hmac={signature}"
+
+        with django_capture_on_commit_callbacks(execute=False) as callbacks:
+            first = api_client.post(url, payload, format="json")
+            duplicate = api_client.post(url, payload, format="json")
+
+        assert first.status_code == duplicate.status_code == 200
+        assert WebhookInbox.objects.count() == 1
+        transaction.refresh_from_db()
+        assert transaction.state == Transaction.TransactionState.PENDING
+
+        assert drain_merchant_inbox(transaction.merchant_order_id) == 1
+        transaction.refresh_from_db()
+        entry = WebhookInbox.objects.get()
+        assert transaction.state == Transaction.TransactionState.SUCCEEDED
+        assert entry.status == WebhookInbox.InboxStatus.PROCESSED
+
+    def test_unknown_transaction_marks_entry_failed(self, settings):
+        settings.PAYMOB_WEBHOOK_RECONCILE_SAMPLE_RATE = 0
+        payload, signature = _signed_webhook("ORD-missing", settings.HMAC_SECRET_KEY)
+        WebhookInbox.objects.create(
+            dedupe_key=signature,
+            merchant_order_id="ORD-missing",
+            provider_transaction_id="373906620",
+            payload=payload["obj"],
+        )
+
+        drain_merchant_inbox("ORD-missing")
+
+        entry = WebhookInbox.objects.get()
+        assert entry.status == WebhookInbox.InboxStatus.FAILED
+        assert entry.attempts == 1
+
+    def test_drainer_that_lost_its_lock_stops_and_leaves_the_new_one(
+        self, settings, mocker
+    ):
+        settings.PAYMOB_WEBHOOK_RECONCILE_SAMPLE_RATE = 0
+        for n in range(2):
+            WebhookInbox.objects.create(
+                dedupe_key=f"lost-lock-{n}",
+                merchant_order_id="ORD-lost-lock",
+                provider_transaction_id=str(n),
+                payload={},
+            )
+        lock_key = "webhook:inbox:ORD-lost-lock:lock"
+        takeover = CacheLock(lock_key, timeout=60)
+
+        def slow_webhook(*args, **kwargs):
+            # the drain lock expires, another worker takes it
+            cache.delete(lock_key)
+            assert takeover.acquire()
+
+        mocker.patch(
+            "zoolflow.transactions.services.inbox.TransactionOrchestrationService"
+            ".update_and_mail_state",
+            side_effect=slow_webhook,
+        )
+
+        assert drain_merchant_inbox("ORD-lost-lock") == 1
+        assert cache.get(lock_key) == takeover.token
+        assert WebhookInbox.objects.filter(
+            status=WebhookInbox.InboxStatus.RECEIVED
+        ).count() == 1
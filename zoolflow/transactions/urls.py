@@ -1,6 +1,13 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import TransactionViewSet, TransactionView, PayMobWebHookView
+from .views import (
+    TransactionViewSet,
+    TransactionView,
+    PayMobWebHookView,
+    ProviderCircuitView,
+    AsyncTransactionCreateView,
+    AsyncPayMobWebHookView,
+)
 
 app_name = "transactions"
 register = DefaultRouter()
@@ -9,5 +16,17 @@ register.register(r"transaction", TransactionViewSet, basename="transaction")
 urlpatterns = [
     path("", include(register.urls)),
     path("webhook/", PayMobWebHookView.as_view(), name="transaction_webhook"),
+    # event loop versions, for the ASGI workers (web_asgi)
+    path(
+        "async/transaction/",
+        AsyncTransactionCreateView.as_view(),
+        name="transaction_create_async",
+    ),
+    path(
+        "async/webhook/",
+        AsyncPayMobWebHookView.as_view(),
+        name="transaction_webhook_async",
+    ),
+    path("circuits/", ProviderCircuitView.as_view(), name="provider_circuits"),
     path("testpay-view/", TransactionView.as_view(), name="checkout_view"),
 ]
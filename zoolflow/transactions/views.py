@@ -1,23 +1,41 @@
 import logging
+from adrf.views import APIView as AsyncAPIView
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.views.generic import TemplateView
 from django.contrib.auth import get_user_model
 from django.db import IntegrityError
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
 from rest_framework import status
 from rest_framework.response import Response
-from .pagination import TransactionPagination
+from config.db_router import ReplicaReadMixin, pin_to_primary
+from .pagination import TransactionCursorPagination, TransactionPagination
 from .serializers import TransactionSerializer
-from .models import Transaction
-from .permissions import IsVerifiedCustomer
+from .models import Transaction, TransactionArchive
+from .permissions import IsMetricsScraper, IsVerifiedCustomer
+from zoolflow.users.permissions import IsAdminOrStaff
 from .services.orchestration import (
     TransactionOrchestrationService,
     TransactionOrchestrationServiceError,
 )
 from .services.webhook import WebhookServiceError, WebhookService
-from .services.paymob import ProviderServiceError
+from .services.inbox import store_webhook
+from .services.idempotency import IdempotentResponseCache
+from .services.export import EXPORT_FORMATS
+from .services.paymob import (
+    AsyncPayMobClient,
+    ProviderServiceError,
+    ProviderUnavailableError,
+)
+from .services.circuit_breaker import CLOSED, HALF_OPEN, OPEN, breaker_snapshots
+from .services import metrics
 
 user = get_user_model()
 logger = logging.getLogger(__name__)
@@ -30,24 +48,151 @@ def _request_context(request):
     }
 
 
+def _orchestration_pending(transaction):
+    # queued for the orchestration worker, or deferred while PayMob's circuit is open
+    return (
+        TransactionOrchestrationService.is_asynchronous()
+        or transaction.state == Transaction.TransactionState.INITIATED
+    )
+
+
 # Create your views here.
-class TransactionViewSet(ModelViewSet):
+class TransactionViewSet(ReplicaReadMixin, ModelViewSet):
     http_method_names = ["get", "post"]
     permission_classes = [IsAuthenticated, IsVerifiedCustomer]
     serializer_class = TransactionSerializer
-    pagination_class = TransactionPagination
+    pagination_class = TransactionCursorPagination
     filter_backends = [DjangoFilterBackend]
     filterset_fields = ["state", "created_at"]
+    # clients poll the transaction by the id returned on creation,
+    # all-digit values are the pk the detail routes took before
+    lookup_field = "merchant_order_id"
+    # old terminal transactions are only read from the archive when asked for
+    archive_query_param = "include_archived"
+
+    @property
+    def paginator(self):
+        """
+        Cursor pagination by default, page numbers (with count) when ?page is sent.
+        Lists including the archive are page numbered too, the cursor can't
+        filter a UNION
+        """
+        if not hasattr(self, "_paginator"):
+            if "page" in self.request.query_params or self._include_archived():
+                self._paginator = TransactionPagination()
+            else:
+                self._paginator = self.pagination_class()
+        return self._paginator
 
     def get_queryset(self):
-        """filter transactions based on user role"""
+        queryset = self._visible(Transaction)
+        if self.action == "checkout":
+            # checkout orchestrates for the owner, not for the requesting user
+            return queryset.select_related("customer__user")
+        return queryset
+
+    def _visible(self, model):
+        """filter transactions (or archived ones) based on user role"""
         role = self.request.user.role_management
         if role == user.Roles.CUSTOMER:
-            return Transaction.objects.filter(customer__user=self.request.user)
+            return model.objects.filter(customer__user=self.request.user)
         # permission for staff to view all transactions only
         elif role in (user.Roles.STAFF, user.Roles.ADMIN):
-            return Transaction.objects.all()
-        return Transaction.objects.none()
+            return model.objects.all()
+        return model.objects.none()
+
+    def _include_archived(self):
+        value = self.request.query_params.get(self.archive_query_param, "")
+        return value.lower() in ("1", "true", "yes")
+
+    def filter_queryset(self, queryset):
+        """
+        Apply the filters to the hot table, and to the archive as well when
+        ?include_archived=true is sent with a list or an export
+        """
+        queryset = super().filter_queryset(queryset)
+        if self.action not in ("list", "export") or not self._include_archived():
+            return queryset
+        archived = super().filter_queryset(self._visible(TransactionArchive))
+        # same columns in the same order, rows come back as Transaction.
+        # the parts can't be ordered on their own, only the UNION is
+        return (
+            queryset.order_by()
+            .union(archived.defer("archived_at").order_by(), all=True)
+            .order_by("-created_at", "-id")
+        )
+
+    def _lookup(self):
+        """Filter kwargs of the detail route, by merchant_order_id or pk"""
+        value = self.kwargs[self.lookup_field]
+        if value.isdigit():
+            # merchant order ids always carry the ORD- prefix
+            return {"pk": value}
+        return {self.lookup_field: value}
+
+    def get_object(self):
+        """
+        Look the transaction up by merchant_order_id or pk, in the archive
+        when it is no longer in the hot table and ?include_archived=true is sent
+        """
+        lookup = self._lookup()
+        try:
+            transaction = get_object_or_404(
+                self.filter_queryset(self.get_queryset()), **lookup
+            )
+            self.check_object_permissions(self.request, transaction)
+            return transaction
+        except Http404:
+            if self.action != "retrieve" or not self._include_archived():
+                raise
+        archived = get_object_or_404(self._visible(TransactionArchive), **lookup)
+        self.check_object_permissions(self.request, archived)
+        return archived
+
+    @action(
+        detail=False,
+        methods=["get"],
+        url_path=r"export/(?P<file_format>csv|ndjson)",
+        permission_classes=[IsAuthenticated, IsAdminOrStaff],
+        pagination_class=None,
+    )
+    def export(self, request, file_format=None):
+        """
+        Stream every transaction matching the list filters as CSV or NDJSON
+        """
+        queryset = self.filter_queryset(self.get_queryset())
+        stream, content_type = EXPORT_FORMATS[file_format]
+        response = StreamingHttpResponse(stream(queryset), content_type=content_type)
+        filename = f"transactions-{timezone.now():%Y%m%d%H%M%S}.{file_format}"
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+    @action(detail=True, methods=["post"])
+    def checkout(self, request, merchant_order_id=None):
+        """
+        Return the transaction with a valid payment token for the PayMob iframe,
+        PayMob is only asked for one when none is stored or it expired
+        """
+        transaction = self.get_object()
+        service = TransactionOrchestrationService(transaction.customer)
+        try:
+            service.checkout_payment_token(transaction)
+        except ProviderUnavailableError as e:
+            return Response(
+                {"non_field_errors": [f"{e.details}:{e.message}"]},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={"Retry-After": str(max(int(e.retry_after or 0), 1))},
+            )
+        except TransactionOrchestrationServiceError as e:
+            return Response(
+                {"non_field_errors": [f"{e.details}:{e.message}"]},
+                status=(
+                    status.HTTP_409_CONFLICT
+                    if e.details == "Checkout"
+                    else status.HTTP_502_BAD_GATEWAY
+                ),
+            )
+        return Response(self.get_serializer(transaction).data)
 
     def create(self, request, *args, **kwargs):
         """
@@ -65,6 +210,147 @@ class TransactionViewSet(ModelViewSet):
                 {"non_field_errors": ["Idempotency-Key exceeds max length (64)."]},
                 status=status.HTTP_400_BAD_REQUEST,
             )
+        if not idempotency_key:
+            return self._create_transaction(request, customer, validated_data)
+
+        # replays are answered from the cache without touching the database
+        replay_cache = IdempotentResponseCache(customer.id, idempotency_key)
+        cached = replay_cache.get()
+        if cached is None and not replay_cache.acquire():
+            cached = replay_cache.wait()
+            if cached is None:
+                return Response(
+                    {
+                        "non_field_errors": [
+                            "Request with this Idempotency-Key in progress."
+                        ]
+                    },
+                    status=status.HTTP_409_CONFLICT,
+                )
+        if cached is not None:
+            logger.info(
+                "Idempotent transaction replay served from cache.",
+                extra={"customer_id": customer.id, **_request_context(request)},
+            )
+            if cached["status"] == status.HTTP_202_ACCEPTED:
+                return self._pending_replay(customer, cached)
+            return Response(cached["data"], status=cached["status"])
+
+        try:
+            response = self._create_transaction(
+                request, customer, validated_data, idempotency_key
+            )
+            if status.is_success(response.status_code):
+                replay_cache.store(response)
+            return response
+        finally:
+            replay_cache.release()
+
+    @staticmethod
+    def _pending_replay(customer, cached):
+        """
+        Replay an accepted create with the transaction as it is now, its
+        orchestration may have finished since
+        """
+        transaction = Transaction.objects.filter(
+            customer=customer, merchant_order_id=cached["data"]["merchant_order_id"]
+        ).first()
+        data = (
+            TransactionSerializer(transaction).data if transaction else cached["data"]
+        )
+        return Response(data, status=cached["status"])
+
+    @action(detail=False, methods=["post"])
+    def batch(self, request):
+        """
+        Create many transactions at once, answering per item results.
+
+        Body is a list of {"amount", "idempotency_key"} items
+        """
+        items = request.data
+        max_size = getattr(settings, "TRANSACTION_BATCH_MAX_SIZE", 100)
+        if not isinstance(items, list) or not items:
+            return Response(
+                {"non_field_errors": ["Expected a non-empty list of transactions."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(items) > max_size:
+            return Response(
+                {"non_field_errors": [f"Batch exceeds max size ({max_size})."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        keys = [
+            item.get("idempotency_key") if isinstance(item, dict) else None
+            for item in items
+        ]
+        given_keys = [key for key in keys if key]
+        if any(not isinstance(key, str) for key in given_keys):
+            return Response(
+                {"non_field_errors": ["idempotency_key must be a string."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if any(len(key) > 64 for key in given_keys):
+            return Response(
+                {"non_field_errors": ["Idempotency-Key exceeds max length (64)."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if len(set(given_keys)) != len(given_keys):
+            return Response(
+                {"non_field_errors": ["Duplicate idempotency_key in batch."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        serializer = self.get_serializer(data=items, many=True)
+        serializer.is_valid(raise_exception=True)
+        validated_items = []
+        for data, key in zip(serializer.validated_data, keys):
+            data = dict(data)
+            if key:
+                data["idempotency_key"] = key
+            validated_items.append(data)
+
+        customer = request.user.customer_profile
+        try:
+            results = TransactionOrchestrationService(customer).create_transactions(
+                validated_items
+            )
+        except IntegrityError:
+            # a concurrent request is creating some of the same keys
+            return Response(
+                {
+                    "non_field_errors": [
+                        "Request with this Idempotency-Key in progress."
+                    ]
+                },
+                status=status.HTTP_409_CONFLICT,
+            )
+
+        output = []
+        for tx, replayed, error in results:
+            item = {"transaction": self.get_serializer(tx).data}
+            if replayed:
+                item["status"] = status.HTTP_200_OK
+            elif error is not None:
+                item["status"] = status.HTTP_400_BAD_REQUEST
+                item["errors"] = [f"{error.details}:{error.message}"]
+            elif _orchestration_pending(tx):
+                item["status"] = status.HTTP_202_ACCEPTED
+            else:
+                item["status"] = status.HTTP_201_CREATED
+            output.append(item)
+        logger.info(
+            "Transaction batch processed.",
+            extra={
+                "customer_id": customer.id,
+                "size": len(results),
+                **_request_context(request),
+            },
+        )
+        return Response(output, status=status.HTTP_207_MULTI_STATUS)
+
+    def _create_transaction(
+        self, request, customer, validated_data, idempotency_key=None
+    ):
         if idempotency_key:
             existing = Transaction.objects.filter(
                 customer=customer,
@@ -109,66 +395,316 @@ class TransactionViewSet(ModelViewSet):
             },
         )
         output_serializer = self.get_serializer(transaction)
+        if _orchestration_pending(transaction):
+            # provider order and payment token are created by the orchestration worker
+            return Response(output_serializer.data, status=status.HTTP_202_ACCEPTED)
         return Response(output_serializer.data, status=status.HTTP_201_CREATED)
 
 
-class PayMobWebHookView(APIView):
-    def post(self, request):
+class AsyncTransactionCreateView(AsyncAPIView):
+    """
+    Transaction create of TransactionViewSet served from the event loop under
+    ASGI. PayMob is called through AsyncPayMobClient, the database work runs
+    in the sync thread and redis round trips in other threads, so a worker
+    keeps many provider calls in flight
+    """
+
+    permission_classes = [IsAuthenticated, IsVerifiedCustomer]
+
+    async def post(self, request):
+        response = await self._post(request)
+        if status.is_success(response.status_code):
+            # read-your-writes, as ReplicaReadMixin does for the sync views
+            await sync_to_async(pin_to_primary, thread_sensitive=False)(request.user)
+        return response
+
+    async def _post(self, request):
+        serializer = TransactionSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        customer = await sync_to_async(lambda: request.user.customer_profile)()
+        validated_data = dict(serializer.validated_data)
+        idempotency_key = request.headers.get("Idempotency-Key")
+        if idempotency_key and len(idempotency_key) > 64:
+            return Response(
+                {"non_field_errors": ["Idempotency-Key exceeds max length (64)."]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if not idempotency_key:
+            return await self._create_transaction(request, customer, validated_data)
+
+        replay_cache = IdempotentResponseCache(customer.id, idempotency_key)
+
+        def claim():
+            # the lookup, the lock and the wait in one thread hop
+            cached = replay_cache.get()
+            if cached is None and not replay_cache.acquire():
+                return replay_cache.wait(), False
+            return cached, cached is None
+
+        cached, acquired = await sync_to_async(claim, thread_sensitive=False)()
+        if cached is None and not acquired:
+            return Response(
+                {
+                    "non_field_errors": [
+                        "Request with this Idempotency-Key in progress."
+                    ]
+                },
+                status=status.HTTP_409_CONFLICT,
+            )
+        if cached is not None:
+            logger.info(
+                "Idempotent transaction replay served from cache.",
+                extra={"customer_id": customer.id, **_request_context(request)},
+            )
+            if cached["status"] == status.HTTP_202_ACCEPTED:
+                return await sync_to_async(TransactionViewSet._pending_replay)(
+                    customer, cached
+                )
+            return Response(cached["data"], status=cached["status"])
+
         try:
-            data = request.data.get("obj")
-            if not data or not isinstance(data, dict):
-                return Response(
-                    {"Webhook": "Invalid webhook payload."},
-                    status=status.HTTP_400_BAD_REQUEST,
+            response = await self._create_transaction(
+                request, customer, validated_data, idempotency_key
+            )
+            if status.is_success(response.status_code):
+                await sync_to_async(replay_cache.store, thread_sensitive=False)(
+                    response
                 )
+            return response
+        finally:
+            await sync_to_async(replay_cache.release, thread_sensitive=False)()
 
-            transaction_id = data.get("id")
-            merchant_id = data.get("order", {}).get("merchant_order_id")
-            if not transaction_id or not merchant_id:
+    async def _create_transaction(
+        self, request, customer, validated_data, idempotency_key=None
+    ):
+        if idempotency_key:
+            existing = await Transaction.objects.filter(
+                customer=customer, idempotency_key=idempotency_key
+            ).afirst()
+            if existing:
                 return Response(
-                    {"Webhook": "Missing transaction reference fields."},
-                    status=status.HTTP_400_BAD_REQUEST,
+                    TransactionSerializer(existing).data, status=status.HTTP_200_OK
                 )
+            validated_data["idempotency_key"] = idempotency_key
+
+        try:
+            transaction = await TransactionOrchestrationService(
+                customer
+            ).create_transaction_async(validated_data)
+        except IntegrityError:
+            if idempotency_key:
+                existing = await Transaction.objects.filter(
+                    customer=customer, idempotency_key=idempotency_key
+                ).afirst()
+                if existing:
+                    return Response(
+                        TransactionSerializer(existing).data,
+                        status=status.HTTP_200_OK,
+                    )
+            raise
+        except TransactionOrchestrationServiceError as e:
+            return Response(
+                {"non_field_errors": [f"{e.details}:{e.message}"]},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        logger.info(
+            "Transaction created successfully.",
+            extra={
+                "merchant_order_id": transaction.merchant_order_id,
+                "customer_id": customer.id,
+                **_request_context(request),
+            },
+        )
+        data = TransactionSerializer(transaction).data
+        if _orchestration_pending(transaction):
+            return Response(data, status=status.HTTP_202_ACCEPTED)
+        return Response(data, status=status.HTTP_201_CREATED)
+
+
+def _webhook_reference(request):
+    """
+    Return (obj, merchant_order_id, provider transaction id) of the webhook
+    body, or the 400 response when it misses them
+    """
+    data = request.data.get("obj")
+    if not data or not isinstance(data, dict):
+        return Response(
+            {"Webhook": "Invalid webhook payload."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+
+    transaction_id = data.get("id")
+    merchant_id = data.get("order", {}).get("merchant_order_id")
+    if not transaction_id or not merchant_id:
+        return Response(
+            {"Webhook": "Missing transaction reference fields."},
+            status=status.HTTP_400_BAD_REQUEST,
+        )
+    return data, merchant_id, transaction_id
+
 
+def _webhook_error_response(e):
+    if isinstance(e, ProviderServiceError):
+        return Response(
+            {"non_field_errors": [f"Provider error:{e.message}"]},
+            status=status.HTTP_502_BAD_GATEWAY,
+        )
+    # WebhookServiceError or TransactionOrchestrationServiceError
+    return Response(
+        {"non_field_errors": [f"{e.details}:{e.message}"]},
+        status=status.HTTP_400_BAD_REQUEST,
+    )
+
+
+_WEBHOOK_ERRORS = (
+    WebhookServiceError,
+    ProviderServiceError,
+    TransactionOrchestrationServiceError,
+)
+
+
+class PayMobWebHookView(APIView):
+    def post(self, request):
+        reference = _webhook_reference(request)
+        if isinstance(reference, Response):
+            return reference
+        data, merchant_id, transaction_id = reference
+        try:
             # Check incoming HMAC signature with computed one internally
             w_service = WebhookService(data, merchant_id, transaction_id)
             received_hmac = request.GET.get("hmac")
             w_service.verify_paymob_hmac(received_hmac)
 
+            if getattr(settings, "PAYMOB_WEBHOOK_INBOX", True):
+                # acknowledge now, the inbox consumers apply it in order
+                store_webhook(data, merchant_id, transaction_id, received_hmac)
+                return Response(
+                    {"Webhook": "HMAC successfully verified."},
+                    status=status.HTTP_200_OK,
+                )
+
             # Update transaction and mail this updates
-            TransactionOrchestrationService.update_and_mail_state(
-                merchant_id, transaction_id
-            )
-            logger.info(
-                "Webhook processed successfully.",
-                extra={
-                    "merchant_order_id": merchant_id,
-                    "provider_transaction_id": transaction_id,
-                    **_request_context(request),
-                },
-            )
+            if TransactionOrchestrationService.is_webhook_payload_trusted():
+                # HMAC verified body already carries the provider flags
+                state = TransactionOrchestrationService.update_and_mail_state(
+                    merchant_id, transaction_id, flags=data
+                )
+                TransactionOrchestrationService.sample_state_reconciliation(
+                    merchant_id, transaction_id, state
+                )
+            else:
+                TransactionOrchestrationService.update_and_mail_state(
+                    merchant_id, transaction_id
+                )
+        except _WEBHOOK_ERRORS as e:
+            return _webhook_error_response(e)
 
-            return Response(
-                {"Webhook": "HMAC successfully verified."},
-                status=status.HTTP_200_OK,
-            )
+        logger.info(
+            "Webhook processed successfully.",
+            extra={
+                "merchant_order_id": merchant_id,
+                "provider_transaction_id": transaction_id,
+                **_request_context(request),
+            },
+        )
+        return Response(
+            {"Webhook": "HMAC successfully verified."},
+            status=status.HTTP_200_OK,
+        )
 
-        except WebhookServiceError as e:
-            return Response(
-                {"non_field_errors": [f"{e.details}:{e.message}"]},
-                status=status.HTTP_400_BAD_REQUEST,
+
+class AsyncPayMobWebHookView(AsyncAPIView):
+    """
+    PayMobWebHookView served from the event loop under ASGI.
+
+    Untrusted payloads are checked with PayMob through AsyncPayMobClient,
+    only the database work runs in the sync thread
+    """
+
+    async def post(self, request):
+        reference = _webhook_reference(request)
+        if isinstance(reference, Response):
+            return reference
+        data, merchant_id, transaction_id = reference
+        try:
+            received_hmac = request.GET.get("hmac")
+            WebhookService(data, merchant_id, transaction_id).verify_paymob_hmac(
+                received_hmac
             )
 
-        except ProviderServiceError as e:
-            return Response(
-                {"non_field_errors": [f"Provider error:{e.message}"]},
-                status=status.HTTP_502_BAD_GATEWAY,
+            if getattr(settings, "PAYMOB_WEBHOOK_INBOX", True):
+                await sync_to_async(store_webhook)(
+                    data, merchant_id, transaction_id, received_hmac
+                )
+                return Response(
+                    {"Webhook": "HMAC successfully verified."},
+                    status=status.HTTP_200_OK,
+                )
+
+            trusted = TransactionOrchestrationService.is_webhook_payload_trusted()
+            flags = (
+                data
+                if trusted
+                else await AsyncPayMobClient().get_transaction_flags(transaction_id)
             )
-        except TransactionOrchestrationServiceError as e:
-            return Response(
-                {"non_field_errors": [f"{e.details}:{e.message}"]},
-                status=status.HTTP_400_BAD_REQUEST,
+            state = await sync_to_async(
+                TransactionOrchestrationService.update_and_mail_state
+            )(merchant_id, transaction_id, flags=flags)
+            if trusted:
+                await sync_to_async(
+                    TransactionOrchestrationService.sample_state_reconciliation
+                )(merchant_id, transaction_id, state)
+        except _WEBHOOK_ERRORS as e:
+            return _webhook_error_response(e)
+
+        logger.info(
+            "Webhook processed successfully.",
+            extra={
+                "merchant_order_id": merchant_id,
+                "provider_transaction_id": transaction_id,
+                **_request_context(request),
+            },
+        )
+        return Response(
+            {"Webhook": "HMAC successfully verified."},
+            status=status.HTTP_200_OK,
+        )
+
+
+class ProviderCircuitView(APIView):
+    """
+    Staff view of the PayMob endpoint circuit breakers
+    """
+
+    permission_classes = [IsAuthenticated, IsAdminOrStaff]
+
+    def get(self, request):
+        return Response(breaker_snapshots(), status=status.HTTP_200_OK)
+
+
+class MetricsView(APIView):
+    """
+    Provider call metrics and circuit states in the prometheus text format
+    """
+
+    permission_classes = [IsMetricsScraper]
+    circuit_states = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def get(self, request):
+        gauges = [
+            (
+                "provider_circuit_state",
+                {"endpoint": circuit["name"]},
+                self.circuit_states[circuit["state"]],
             )
+            for circuit in breaker_snapshots()
+        ]
+        return HttpResponse(
+            metrics.registry.render(gauges),
+            content_type="text/plain; version=0.0.4; charset=utf-8",
+        )
 
 
 class TransactionView(TemplateView):